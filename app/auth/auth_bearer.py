@@ -1,6 +1,7 @@
 from fastapi import Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.auth.auth_handler import decode_jwt
+from app.auth.revocation import revoked_tokens
 
 
 class JWTBearer(HTTPBearer):
@@ -12,11 +13,10 @@ class JWTBearer(HTTPBearer):
         if credentials:
             if credentials.scheme != "Bearer":
                 raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
-            if not self.verify_jwt(credentials.credentials):
+            payload = decode_jwt(credentials.credentials)
+            if not payload or revoked_tokens.is_revoked(payload.get("jti")):
                 raise HTTPException(status_code=403, detail="Invalid or expired token.")
+            # Decoded once here; dependencies read it back from request.state
+            request.state.jwt_payload = payload
             return credentials.credentials
         raise HTTPException(status_code=403, detail="Invalid authorization code.")
-
-    def verify_jwt(self, jwt_token: str) -> bool:
-        payload = decode_jwt(jwt_token)
-        return True if payload else False
@@ -1,6 +1,7 @@
 import time
 import jwt
 from typing import Optional
+from uuid import uuid4
 
 # Load configuration values from .env
 from app.core.config import JWT_SECRET, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
@@ -10,12 +11,14 @@ def sign_jwt(user_id: str, role: str) -> dict:
     """
     Create a signed JWT token for the given user.
     The expiration time is controlled by ACCESS_TOKEN_EXPIRE_MINUTES in .env.
+    jti identifies the token so it can be revoked (POST /auth/logout).
     """
     expires_at = time.time() + 60 * ACCESS_TOKEN_EXPIRE_MINUTES
     payload = {
         "user_id": user_id,
         "role": role,
         "exp": expires_at,
+        "jti": uuid4().hex,
     }
 
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
@@ -1,17 +1,25 @@
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from app.auth.auth_bearer import JWTBearer
-from app.auth.auth_handler import decode_jwt
+from app.auth.user_cache import user_cache
 from app.db.database import users_collection
+from app.core.config import AUTH_STATELESS
 
 
-async def get_current_user(token: str = Depends(JWTBearer())):
-    payload = decode_jwt(token)
-    if not payload:
-        raise HTTPException(status_code=403, detail="Invalid or expired token")
+async def get_current_user(request: Request, token: str = Depends(JWTBearer())):
+    # JWTBearer has already decoded and validated the token for this request
+    payload = request.state.jwt_payload
 
-    user = await users_collection.find_one({"email": payload["user_id"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    email = payload["user_id"]
+    if AUTH_STATELESS:
+        # The signature vouches for these claims; no user lookup at all
+        return {"email": email, "role": payload["role"]}
+
+    user = user_cache.get(email)
+    if user is None:
+        user = await users_collection.find_one({"email": email})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.put(email, user)
 
     return user  # this is a MongoDB document dict
 
@@ -0,0 +1,75 @@
+"""
+Password hashing off the event loop.
+
+pbkdf2_sha256 costs tens of milliseconds of CPU per hash or verify. Run
+inline in a handler, that time is stolen from every other request on the
+event loop. Here it runs on a small dedicated thread pool instead; passlib's
+PBKDF2 goes through hashlib/OpenSSL, which releases the GIL, so the loop
+keeps serving reservations while logins are checked. At most
+PASSWORD_HASH_WORKERS hashes run at once. Callers wait for a thread on a
+semaphore rather than in the executor's unbounded queue, so a caller that
+goes away leaves no hash behind, and once PASSWORD_HASH_MAX_WAITING are
+waiting further ones get a 503 instead of piling up.
+
+Hashes made with fewer than PASSWORD_HASH_ROUNDS rounds still verify, and
+verify_and_update hands back a re-hashed password so login can upgrade it.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.core.config import (
+    PASSWORD_HASH_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_WAITING,
+)
+
+# Using pbkdf2_sha256 to avoid bcrypt length issues
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
+# Callers running or waiting for a thread, and the semaphore handing out the
+# threads (created per event loop, as asyncio primitives are bound to one)
+_pending = 0
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _run(func: Callable, *args):
+    global _pending, _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots_loop is not loop:
+        _slots, _slots_loop = asyncio.Semaphore(PASSWORD_HASH_WORKERS), loop
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_WAITING:
+        raise HTTPException(
+            status_code=503, detail="Too many password checks in progress, try again"
+        )
+    _pending += 1
+    try:
+        async with _slots:
+            return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    (matches, new_hash): new_hash is set when the password matched but its
+    stored hash is weaker than the current settings and should be replaced.
+    """
+    return await _run(pwd_context.verify_and_update, password, hashed)
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from pymongo import ASCENDING
+
+from app.core.config import TOKEN_REVOCATION_LAG_SECONDS, TOKEN_REVOCATION_REFRESH_SECONDS
+from app.db.database import revoked_tokens_collection
+from app.utils.time_utils import as_utc, from_ms, now_utc
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationSet:
+    """
+    In-memory deny list of token ids (the jti claim), so checking a token
+    costs no database round trip. Revocations are stored in the
+    revoked_tokens collection and read back incrementally: every refresh
+    only fetches documents revoked since TOKEN_REVOCATION_LAG_SECONDS before
+    the newest one seen (revoked_at comes from the revoking process's clock
+    and documents become visible out of order). A token revoked
+    by another process is therefore refused here within
+    TOKEN_REVOCATION_REFRESH_SECONDS. Entries are dropped once the token
+    would have expired anyway (MongoDB drops the documents with a TTL index).
+    """
+
+    def __init__(self):
+        # jti -> token expiry (epoch seconds, like the exp claim)
+        self._revoked: Dict[str, float] = {}
+        self._watermark: Optional[datetime] = None
+        self.refreshes = 0
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    async def revoke(self, jti: str, exp: float):
+        await revoked_tokens_collection.insert_one({
+            "jti": jti,
+            "expires_at": from_ms(int(exp * 1000)),
+            "revoked_at": now_utc(),
+        })
+        self._revoked[jti] = exp
+
+    async def refresh(self):
+        # Overlap with the previous refresh: a revocation stamped before the
+        # newest one seen may not have been visible yet; re-adding a jti is
+        # harmless.
+        query = {}
+        if self._watermark is not None:
+            since = self._watermark - timedelta(seconds=TOKEN_REVOCATION_LAG_SECONDS)
+            query = {"revoked_at": {"$gte": since}}
+        cursor = revoked_tokens_collection.find(query).sort("revoked_at", ASCENDING)
+        async for doc in cursor:
+            self._revoked[doc["jti"]] = as_utc(doc["expires_at"]).timestamp()
+            self._watermark = doc["revoked_at"]
+
+        now = time.time()
+        for jti in [jti for jti, exp in self._revoked.items() if exp < now]:
+            del self._revoked[jti]
+        self.refreshes += 1
+
+    def clear(self):
+        self._revoked.clear()
+        self._watermark = None
+
+    def stats(self) -> dict:
+        return {"revoked": len(self._revoked), "refreshes": self.refreshes}
+
+
+revoked_tokens = RevocationSet()
+
+
+async def revocation_refresher():
+    """Pick up revocations made by other processes (startup loads the rest)."""
+    while True:
+        await asyncio.sleep(TOKEN_REVOCATION_REFRESH_SECONDS)
+        try:
+            await revoked_tokens.refresh()
+        except Exception:
+            logger.exception("Refreshing revoked tokens failed")
@@ -0,0 +1,64 @@
+"""
+Run the service as a partitioned cluster of worker processes:
+
+    python -m app.cluster --workers 4 --host 0.0.0.0 --port 8000
+
+Every worker binds the same port with SO_REUSEPORT, so the kernel spreads
+connections over them. Each one owns its share of the products (see
+app.services.partitioning) and forwards requests for the others. Workers get
+their own subdirectory of RESERVATION_JOURNAL_DIR when journaling is on.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+
+
+def _worker(worker_id: int, workers: int, host: str, port: int):
+    os.environ["RESERVATION_BACKEND"] = "partitioned"
+    os.environ["CLUSTER_WORKERS"] = str(workers)
+    os.environ["CLUSTER_WORKER_ID"] = str(worker_id)
+    journal_dir = os.environ.get("RESERVATION_JOURNAL_DIR")
+    if journal_dir:
+        os.environ["RESERVATION_JOURNAL_DIR"] = os.path.join(journal_dir, f"worker-{worker_id}")
+
+    # Imported only now so app.core.config sees this worker's environment
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+
+    server = uvicorn.Server(uvicorn.Config("main:app", host=host, port=port))
+    asyncio.run(server.serve(sockets=[sock]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    processes = [
+        multiprocessing.Process(
+            target=_worker, args=(i, args.workers, args.host, args.port), name=f"worker-{i}"
+        )
+        for i in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
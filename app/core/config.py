@@ -13,7 +13,117 @@ MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "inventory_reservation_db")
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-key")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))
+# Authenticated user documents are cached by email; set max entries to 0 to
+# always read the user from MongoDB.
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# Trust the role and email in the signed token instead of loading the user
+# document on every request. Role changes then only apply to new tokens.
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "false").lower() in ("1", "true", "yes")
+# How often revoked token ids (POST /auth/logout) are reloaded from MongoDB,
+# i.e. how long another process may still accept a revoked token.
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.getenv("TOKEN_REVOCATION_REFRESH_SECONDS", "5"))
+# Each refresh re-reads revocations stamped up to this long before the newest
+# one seen: a revocation stamped earlier but committed later (clock skew
+# between processes, a slow insert) is still picked up.
+TOKEN_REVOCATION_LAG_SECONDS = float(os.getenv("TOKEN_REVOCATION_LAG_SECONDS", "60"))
+# pbkdf2_sha256 rounds for new hashes; stored hashes with fewer rounds are
+# re-hashed on the user's next login. Hashing runs on a pool of
+# PASSWORD_HASH_WORKERS threads so it never blocks the event loop; beyond
+# PASSWORD_HASH_MAX_WAITING callers waiting for a thread, logins get a 503.
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", "256"))
 
 # === Reservation config ===
+# "memory": in-process store and locks (single worker process only).
+# "mongo": MongoDB is the only state; safe with any number of workers.
+# "partitioned": in-process store per worker, products sharded over the
+# workers started by app.cluster (see the cluster settings below).
+RESERVATION_BACKEND = os.getenv("RESERVATION_BACKEND", "memory")
 RESERVATION_DEFAULT_TTL_MINUTES = int(os.getenv("RESERVATION_DEFAULT_TTL_MINUTES", "15"))
+# Upper bound on how long the expiration worker sleeps; it normally wakes at
+# the earliest pending expires_at instead.
 RESERVATION_CLEANUP_INTERVAL_SECONDS = int(os.getenv("RESERVATION_CLEANUP_INTERVAL_SECONDS", "30"))
+# Most active holds one user may have at once (0 = unlimited); further
+# reservations are rejected with 429.
+RESERVATION_MAX_ACTIVE_PER_USER = int(os.getenv("RESERVATION_MAX_ACTIVE_PER_USER", "0"))
+# Reservations for the same product arriving within this window are
+# coalesced into one stock update and one insert_many (0 = one write per
+# request). At most RESERVATION_BATCH_MAX_SIZE requests go into one batch.
+RESERVATION_BATCH_WINDOW_MS = float(os.getenv("RESERVATION_BATCH_WINDOW_MS", "0"))
+RESERVATION_BATCH_MAX_SIZE = int(os.getenv("RESERVATION_BATCH_MAX_SIZE", "1000"))
+# Lock wait stats are kept per product for the products in use plus the
+# PRODUCT_LOCK_STATS_MAX_KEYS most recently used idle ones (older ones only
+# count in the totals). GET /metrics lists the PRODUCT_LOCK_STATS_TOP
+# products with the most wait.
+PRODUCT_LOCK_STATS_MAX_KEYS = int(os.getenv("PRODUCT_LOCK_STATS_MAX_KEYS", "1000"))
+PRODUCT_LOCK_STATS_TOP = int(os.getenv("PRODUCT_LOCK_STATS_TOP", "20"))
+# Expired reservations are persisted in batches of this size, with at most
+# RESERVATION_EXPIRY_CONCURRENCY batches in flight at once.
+RESERVATION_EXPIRY_BATCH_SIZE = int(os.getenv("RESERVATION_EXPIRY_BATCH_SIZE", "500"))
+RESERVATION_EXPIRY_CONCURRENCY = int(os.getenv("RESERVATION_EXPIRY_CONCURRENCY", "4"))
+# Local journal + snapshots of the reservation store for fast restarts.
+# Disabled when RESERVATION_JOURNAL_DIR is empty (the store is then rebuilt
+# from MongoDB on startup).
+RESERVATION_JOURNAL_DIR = os.getenv("RESERVATION_JOURNAL_DIR", "")
+RESERVATION_JOURNAL_GROUP_COMMIT_MS = int(os.getenv("RESERVATION_JOURNAL_GROUP_COMMIT_MS", "2"))
+RESERVATION_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("RESERVATION_SNAPSHOT_INTERVAL_SECONDS", "300"))
+
+# With RESERVATION_BACKEND=mongo only the worker holding the expiry lease
+# sweeps expired reservations. It renews the lease every heartbeat; if it
+# dies another worker takes over within about TTL + heartbeat seconds.
+EXPIRY_LEASE_TTL_SECONDS = float(os.getenv("EXPIRY_LEASE_TTL_SECONDS", "15"))
+EXPIRY_LEASE_HEARTBEAT_SECONDS = float(os.getenv("EXPIRY_LEASE_HEARTBEAT_SECONDS", "5"))
+
+# === Cluster (RESERVATION_BACKEND=partitioned) ===
+# Set by app.cluster for each worker it starts. Workers forward requests for
+# products they do not own over Unix sockets in CLUSTER_SOCKET_DIR.
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "1"))
+CLUSTER_WORKER_ID = int(os.getenv("CLUSTER_WORKER_ID", "0"))
+CLUSTER_SOCKET_DIR = os.getenv("CLUSTER_SOCKET_DIR", "/tmp/inventory-cluster")
+
+# === Responses ===
+# Routers ("products", "reservations") whose hot endpoints encode responses
+# straight to JSON with precompiled serializers instead of re-validating them
+# through response_model, e.g. FAST_JSON_ROUTERS=products,reservations.
+FAST_JSON_ROUTERS = {
+    name.strip() for name in os.getenv("FAST_JSON_ROUTERS", "").split(",") if name.strip()
+}
+
+# === Striped stock ===
+# How often stock is rebalanced between the buckets of striped products.
+# Only the holder of the "stock-rebalance" lease rebalances; it uses the
+# EXPIRY_LEASE_TTL_SECONDS / EXPIRY_LEASE_HEARTBEAT_SECONDS timings.
+STOCK_REBALANCE_INTERVAL_SECONDS = int(os.getenv("STOCK_REBALANCE_INTERVAL_SECONDS", "5"))
+
+# === Product catalog cache ===
+# Public product reads are served from memory. Stock figures may lag writes by
+# at most CATALOG_CACHE_MAX_STALENESS_MS; untouched entries are re-read from
+# MongoDB after CATALOG_CACHE_TTL_SECONDS to pick up writes from other processes.
+CATALOG_CACHE_MAX_STALENESS_MS = int(os.getenv("CATALOG_CACHE_MAX_STALENESS_MS", "5"))
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "30"))
+# With RESERVATION_BACKEND=mongo or partitioned, stock also changes in other
+# processes, so untouched entries are re-read after at most this long.
+CATALOG_CACHE_SHARED_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_SHARED_TTL_SECONDS", "1"))
+
+# === Metrics counters ===
+# Product/order/reservation totals are kept in memory and checkpointed to the
+# counters collection this often; collection-backed totals are re-counted
+# every COUNTERS_RECONCILE_SECONDS.
+COUNTERS_CHECKPOINT_SECONDS = float(os.getenv("COUNTERS_CHECKPOINT_SECONDS", "10"))
+COUNTERS_RECONCILE_SECONDS = float(os.getenv("COUNTERS_RECONCILE_SECONDS", "300"))
+
+# === Latency histograms ===
+# Handler, MongoDB command and lock latency histograms for
+# GET /metrics/prometheus. Lock timings are always recorded; this opts in to
+# the per-request middleware and pymongo command monitoring.
+LATENCY_METRICS = os.getenv("LATENCY_METRICS", "false").lower() in ("1", "true", "yes")
+
+# === Audit log writer ===
+# Events are buffered in memory and written with insert_many once
+# AUDIT_BATCH_SIZE events are queued or AUDIT_FLUSH_INTERVAL_MS has passed.
+# When AUDIT_QUEUE_MAX_SIZE events are waiting, request handlers block.
+AUDIT_QUEUE_MAX_SIZE = int(os.getenv("AUDIT_QUEUE_MAX_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "50"))
@@ -1,8 +1,47 @@
+from typing import List
+
 from motor.motor_asyncio import AsyncIOMotorClient
-from app.core.config import MONGO_URL, MONGO_DB_NAME
+from pymongo import monitoring
+
+from app.core.config import MONGO_URL, MONGO_DB_NAME, LATENCY_METRICS
+
+
+class CommandListeners(monitoring.CommandListener):
+    """
+    Forwards pymongo command events to listeners registered at startup, so
+    the shared client can be created before anyone who wants the events is
+    imported.
+    """
+
+    def __init__(self):
+        self.listeners: List[monitoring.CommandListener] = []
+
+    def register(self, listener: monitoring.CommandListener):
+        self.listeners.append(listener)
+
+    def started(self, event):
+        for listener in self.listeners:
+            listener.started(event)
+
+    def succeeded(self, event):
+        for listener in self.listeners:
+            listener.succeeded(event)
+
+    def failed(self, event):
+        for listener in self.listeners:
+            listener.failed(event)
+
+
+command_listeners = CommandListeners()
+
+
+def create_client(event_listeners=()) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(MONGO_URL, event_listeners=list(event_listeners))
+
 
-# Create a single shared MongoDB client
-client = AsyncIOMotorClient(MONGO_URL)
+# Create a single shared MongoDB client. Command monitoring costs something
+# on every command, so it is only switched on with LATENCY_METRICS.
+client = create_client([command_listeners] if LATENCY_METRICS else [])
 db = client[MONGO_DB_NAME]
 
 # Collections
@@ -12,3 +51,7 @@ audit_collection = db["audit_logs"]
 reservations_collection = db["reservations"]
 stock_history_collection = db["stock_history"]
 users_collection = db["users"]
+stock_buckets_collection = db["stock_buckets"]
+leases_collection = db["leases"]
+revoked_tokens_collection = db["revoked_tokens"]
+counters_collection = db["counters"]
@@ -0,0 +1,162 @@
+"""
+Index bootstrap and query-plan check.
+
+ensure_indexes() runs from the main.py lifespan. The plan check is exposed as
+GET /admin/query-plans and on the command line:
+
+    python -m app.db.indexes          # create indexes, then check plans
+    python -m app.db.indexes --check  # only check plans
+"""
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from app.db import database
+
+logger = logging.getLogger(__name__)
+
+
+# Keyed by the attribute name in app.db.database, looked up at call time.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "products_collection": [
+        IndexModel([("product_id", ASCENDING)], unique=True, name="product_id_unique"),
+        # Striped products, reloaded by every process's stock_rebalancer
+        IndexModel([("stock_stripes", ASCENDING)], sparse=True, name="stock_stripes"),
+    ],
+    "reservations_collection": [
+        IndexModel([("reservation_id", ASCENDING)], unique=True, name="reservation_id_unique"),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        # Used by the mongo reservation backend (carts, claim tokens)
+        IndexModel([("cart_id", ASCENDING)], sparse=True, name="cart_id"),
+        IndexModel([("claim", ASCENDING)], sparse=True, name="claim"),
+    ],
+    "orders_collection": [
+        IndexModel([("order_id", ASCENDING)], unique=True, name="order_id_unique"),
+        # One order per reservation: the in-memory backend upserts on it
+        IndexModel([("reservation_id", ASCENDING)], unique=True, name="reservation_id_unique"),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_id_created_at",
+        ),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at"),
+    ],
+    "stock_history_collection": [
+        IndexModel([("product_id", ASCENDING), ("timestamp", DESCENDING)], name="product_id_timestamp"),
+    ],
+    "audit_collection": [
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp"),
+    ],
+    "users_collection": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "revoked_tokens_collection": [
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+        # Revocations are only needed until the token expires anyway
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "stock_buckets_collection": [
+        IndexModel(
+            [("product_id", ASCENDING), ("bucket", ASCENDING)],
+            unique=True,
+            name="product_id_bucket_unique",
+        ),
+    ],
+}
+
+
+# (name, collection attribute, filter, sort) for every query on a hot path.
+HOT_QUERIES = [
+    ("product by id", "products_collection", {"product_id": "PROD_00000000"}, None),
+    ("striped products", "products_collection", {"stock_stripes": {"$gte": 2}}, None),
+    ("reservation by id", "reservations_collection", {"reservation_id": "RES_00000000"}, None),
+    (
+        "active reservations",
+        "reservations_collection",
+        {"status": "active"},
+        [("expires_at", ASCENDING)],
+    ),
+    ("order by id", "orders_collection", {"order_id": "ORD_00000000"}, None),
+    (
+        "orders by user",
+        "orders_collection",
+        {"user_id": "user@example.com"},
+        [("created_at", DESCENDING), ("_id", DESCENDING)],
+    ),
+    ("all orders", "orders_collection", {}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    (
+        "stock history by product",
+        "stock_history_collection",
+        {"product_id": "PROD_00000000"},
+        [("timestamp", DESCENDING)],
+    ),
+    ("audit log", "audit_collection", {}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("user by email", "users_collection", {"email": "user@example.com"}, None),
+    (
+        "stock bucket",
+        "stock_buckets_collection",
+        {"product_id": "PROD_00000000", "bucket": 0},
+        None,
+    ),
+]
+
+
+async def ensure_indexes():
+    """Create every declared index; existing ones are left untouched."""
+    for attr, models in INDEXES.items():
+        collection = getattr(database, attr)
+        try:
+            await collection.create_indexes(models)
+        except Exception:
+            logger.exception("Creating indexes on %s failed", collection.name)
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan.get("stage", "?")]
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def check_query_plans() -> List[Dict[str, Any]]:
+    """Run explain() on every hot query and flag the ones using a COLLSCAN."""
+    report = []
+    for name, attr, flt, sort in HOT_QUERIES:
+        collection = getattr(database, attr)
+        cursor = collection.find(flt)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.limit(1).explain()
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        # Newer servers wrap the classic plan in queryPlan
+        stages = _plan_stages(winning.get("queryPlan", winning))
+        report.append({
+            "query": name,
+            "collection": collection.name,
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages,
+            "in_memory_sort": "SORT" in stages,
+        })
+    return report
+
+
+async def _main(check_only: bool) -> int:
+    if not check_only:
+        await ensure_indexes()
+    report = await check_query_plans()
+    for entry in report:
+        flag = "COLLSCAN" if entry["collection_scan"] else "ok"
+        print(f"{flag:8} {entry['collection']:15} {entry['query']:28} {' <- '.join(entry['stages'])}")
+    return 1 if any(entry["collection_scan"] for entry in report) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create indexes and check hot query plans")
+    parser.add_argument("--check", action="store_true", help="only check query plans")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.check)))
@@ -1,15 +1,15 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
 
 from app.db.database import users_collection
+from app.auth.auth_bearer import JWTBearer
 from app.auth.auth_handler import sign_jwt
+from app.auth.passwords import hash_password, verify_and_update
+from app.auth.revocation import revoked_tokens
+from app.auth.user_cache import user_cache
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-# Using pbkdf2_sha256 to avoid bcrypt length issues
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
 
 class UserRegister(BaseModel):
     email: EmailStr
@@ -32,7 +32,7 @@ async def register_user(user: UserRegister):
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
 
-    hashed_pw = pwd_context.hash(user.password)
+    hashed_pw = await hash_password(user.password)
     new_user = {
         "email": user.email,
         "password": hashed_pw,
@@ -40,6 +40,7 @@ async def register_user(user: UserRegister):
         "role": user.role,
     }
     await users_collection.insert_one(new_user)
+    user_cache.invalidate(user.email)
     return {"message": "User registered successfully", "role": user.role}
 
 
@@ -49,8 +50,15 @@ async def login_user(user: UserLogin):
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not pwd_context.verify(user.password, db_user["password"]):
+    valid, new_hash = await verify_and_update(user.password, db_user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash predates the current PASSWORD_HASH_ROUNDS: upgrade it
+        await users_collection.update_one(
+            {"email": db_user["email"]}, {"$set": {"password": new_hash}}
+        )
+        user_cache.invalidate(db_user["email"])
 
     token = sign_jwt(db_user["email"], db_user["role"])
     return {
@@ -59,3 +67,12 @@ async def login_user(user: UserLogin):
         "role": db_user["role"],
         "full_name": db_user.get("full_name"),
     }
+
+
+@router.post("/logout")
+async def logout_user(request: Request, token: str = Depends(JWTBearer())):
+    payload = request.state.jwt_payload
+    if "jti" not in payload:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked; log in again")
+    await revoked_tokens.revoke(payload["jti"], payload["exp"])
+    return {"message": "Logged out"}
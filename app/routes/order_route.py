@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
 from app.schemas.order_schema import OrderResponse, OrderStatusUpdate
@@ -9,13 +10,26 @@ router = APIRouter(prefix="/orders", tags=["Orders"])
 
 
 @router.get("/", response_model=List[OrderResponse])
-async def list_orders(current_user: dict = Depends(get_current_user)):
+async def list_orders(
+    response: Response,
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
     # Normal user: only their orders
     # Admin: can see all orders
-    if current_user["role"] == "admin":
-        docs = await os.list_orders(user_id=None)
-    else:
-        docs = await os.list_orders(user_id=current_user["email"])
+    user_id = None if current_user["role"] == "admin" else current_user["email"]
+
+    if stream:
+        return StreamingResponse(
+            os.stream_orders(user_id=user_id, cursor=cursor),
+            media_type="application/x-ndjson",
+        )
+
+    docs, next_cursor = await os.list_orders(user_id=user_id, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return [OrderResponse(**d) for d in docs]
 
@@ -1,20 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from uuid import uuid4
-from pymongo import ReturnDocument
+from app.services import stock_service
 from app.services.audit_service import log_event
+from app.services.catalog_cache import catalog_cache
+from app.services.counters import counters
+from app.services.reservation_service import product_locks
 
 from app.db.database import products_collection, stock_history_collection
 from app.schemas.product_schema import (
     ProductCreate,
     ProductResponse,
     StockAdjustmentRequest,
+    StockStripesRequest,
 )
 from app.utils.time_utils import now_utc
+from app.utils.pagination import fetch_page, stream_ndjson
 from app.auth.deps import require_admin
+from app.utils.serializers import ResponseSerializer, fast_json_enabled
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
+product_json = ResponseSerializer(ProductResponse, fast_json_enabled("products"))
+
+# _id grows with insertion time and is always indexed
+PRODUCT_SORT = [("_id", 1)]
+DEFAULT_PAGE_SIZE = 1000
+
 
 @router.post("/", response_model=ProductResponse, dependencies=[Depends(require_admin)])
 async def create_product(
@@ -33,6 +46,8 @@ async def create_product(
         "created_at": now_utc(),
     }
     await products_collection.insert_one(doc)
+    catalog_cache.invalidate(product_id)
+    counters.incr("products")
 
     await log_event(
         event_type="product_created",
@@ -51,18 +66,65 @@ async def create_product(
 
 # ❌ public – no auth required
 @router.get("/", response_model=List[ProductResponse])
-async def list_products():
-    docs = await products_collection.find({}).to_list(length=1000)
-    return [ProductResponse(**d) for d in docs]
+async def list_products(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    """
+    Products in creation order. When more remain, the X-Next-Cursor header
+    holds the cursor for the next page. stream=true returns every product
+    from the cursor on as NDJSON instead.
+    """
+    if stream:
+        return StreamingResponse(
+            stream_ndjson(
+                products_collection,
+                {},
+                PRODUCT_SORT,
+                lambda d: ProductResponse(**d).model_dump_json(),
+                cursor,
+                stock_service.with_stock,
+            ),
+            media_type="application/x-ndjson",
+        )
+
+    first_page = cursor is None and limit == DEFAULT_PAGE_SIZE
+    cached = catalog_cache.get_listing() if first_page else None
+    if cached is not None:
+        products, next_cursor = cached
+    else:
+        version = catalog_cache.version
+        docs, next_cursor = await fetch_page(
+            products_collection, {}, PRODUCT_SORT, limit, cursor
+        )
+        docs = await stock_service.with_stock_many(docs)
+        # The fast path encodes the documents directly, no models needed
+        products = docs if product_json.enabled else [ProductResponse(**d) for d in docs]
+        if first_page:
+            catalog_cache.store_listing(products, next_cursor, version)
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if headers:
+        response.headers.update(headers)
+    return product_json.response(products, headers=headers)
 
 
 # ❌ public – no auth required
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(product_id: str):
+    cached = catalog_cache.get_product(product_id)
+    if cached is not None:
+        return product_json.response(cached)
+
+    version = catalog_cache.version
     doc = await products_collection.find_one({"product_id": product_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Product not found")
-    return ProductResponse(**doc)
+    product = ProductResponse(**await stock_service.with_stock(doc))
+    catalog_cache.store_product(product, version)
+    return product_json.response(product)
 
 
 @router.put(
@@ -78,17 +140,10 @@ async def adjust_stock(
     before = await products_collection.find_one({"product_id": product_id})
     if not before:
         raise HTTPException(status_code=404, detail="Product not found")
+    before = await stock_service.with_stock(before)
 
-    updated = await products_collection.find_one_and_update(
-        {"product_id": product_id},
-        {
-            "$inc": {
-                "total_stock": payload.change_quantity,
-                "available_stock": payload.change_quantity,
-            }
-        },
-        return_document=ReturnDocument.AFTER,
-    )
+    updated = await stock_service.adjust(product_id, payload.change_quantity)
+    catalog_cache.invalidate(product_id)
 
     await stock_history_collection.insert_one(
         {
@@ -129,6 +184,37 @@ async def adjust_stock(
     return ProductResponse(**updated)
 
 
+@router.put(
+    "/{product_id}/stripes",
+    response_model=ProductResponse,
+    dependencies=[Depends(require_admin)],
+)
+async def set_stock_stripes(
+    product_id: str,
+    payload: StockStripesRequest,
+    current_user: dict = Depends(require_admin),
+):
+    """
+    Split the product's available stock over `stripes` bucket documents so
+    concurrent reservations stop contending on one document (1 = back to a
+    single document).
+    """
+    async with product_locks.hold(product_id):
+        product = await stock_service.set_stripes(product_id, payload.stripes)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    await log_event(
+        event_type="stock_striping_changed",
+        entity_type="product",
+        entity_id=product_id,
+        user_id=current_user["email"],
+        changes={"stripes": payload.stripes},
+    )
+
+    return ProductResponse(**product)
+
+
 @router.get("/{product_id}/history", dependencies=[Depends(require_admin)])
 async def get_stock_history(product_id: str,
     current_user: dict = Depends(require_admin),):
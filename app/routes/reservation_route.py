@@ -6,14 +6,19 @@ from app.schemas.reservation_schema import (
     ReservationResponse,
     ReservationCommitRequest,
     CancelReservationRequest,
+    CartReservationCreate,
+    CartReservationResponse,
 )
 from app.schemas.order_schema import OrderResponse
-from app.services import reservation_service as rs
+from app.services.reservation_backend import backend as rs
+from app.services import stock_service
 from app.auth.deps import require_user
-from app.db.database import products_collection
+from app.utils.serializers import ResponseSerializer, fast_json_enabled
 
 router = APIRouter(prefix="/reservations", tags=["Reservations"])
 
+reservation_json = ResponseSerializer(ReservationResponse, fast_json_enabled("reservations"))
+
 
 @router.post("/", response_model=ReservationResponse)
 async def create_reservation(
@@ -24,24 +29,50 @@ async def create_reservation(
 
     res = await rs.create_reservation(payload, user_email)
 
-    product_doc = await products_collection.find_one(
-        {"product_id": res.product_id},
-        {"available_stock": 1, "_id": 0},
-    )
-    available_stock = product_doc["available_stock"] if product_doc else None
-
-    return ReservationResponse(
-        reservation_id=res.reservation_id,
-        user_id=res.user_id,
-        product_id=res.product_id,
-        quantity=res.quantity,
-        status=res.status,
-        created_at=res.created_at,
-        expires_at=res.expires_at,
-        available_stock=available_stock,
+    # Stock left after the reservation, straight from its stock write;
+    # striped products do not report it, so sum their buckets instead
+    available_stock = res.available_stock
+    if available_stock is None:
+        available_stock = await stock_service.available(res.product_id)
+
+    return reservation_json.response(res, available_stock=available_stock)
+
+
+@router.post("/cart", response_model=CartReservationResponse)
+async def create_cart_reservation(
+    payload: CartReservationCreate,
+    current_user: dict = Depends(require_user),
+):
+    items = await rs.create_cart_reservation(payload, current_user["email"])
+
+    return CartReservationResponse(
+        cart_id=items[0].cart_id,
+        reservations=[
+            ReservationResponse(
+                reservation_id=r.reservation_id,
+                user_id=r.user_id,
+                product_id=r.product_id,
+                quantity=r.quantity,
+                status=r.status,
+                created_at=r.created_at,
+                expires_at=r.expires_at,
+                cart_id=r.cart_id,
+            )
+            for r in items
+        ],
     )
 
 
+@router.post("/cart/{cart_id}/commit", response_model=List[OrderResponse])
+async def commit_cart(
+    cart_id: str,
+    payload: ReservationCommitRequest,
+    current_user: dict = Depends(require_user),
+):
+    docs = await rs.commit_cart(cart_id, payload, current_user["email"])
+    return [OrderResponse(**d) for d in docs]
+
+
 @router.get("/{reservation_id}", response_model=ReservationResponse)
 async def get_reservation(
     reservation_id: str,
@@ -53,15 +84,8 @@ async def get_reservation(
     if res.user_id != current_user["email"]:
         raise HTTPException(status_code=403, detail="Not allowed to view this reservation")
 
-    return ReservationResponse(
-        reservation_id=res.reservation_id,
-        user_id=res.user_id,
-        product_id=res.product_id,
-        quantity=res.quantity,
-        status=res.status,
-        created_at=res.created_at,
-        expires_at=res.expires_at,
-    )
+    # available_stock is only reported when the reservation is created
+    return reservation_json.response(res, available_stock=None)
 
 
 @router.get("/user/{user_id}", response_model=List[ReservationResponse])
@@ -73,18 +97,7 @@ async def get_user_reservations(
 
     items = await rs.get_user_active_reservations(user_email)
 
-    return [
-        ReservationResponse(
-            reservation_id=r.reservation_id,
-            user_id=r.user_id,
-            product_id=r.product_id,
-            quantity=r.quantity,
-            status=r.status,
-            created_at=r.created_at,
-            expires_at=r.expires_at,
-        )
-        for r in items
-    ]
+    return reservation_json.response(items, available_stock=None)
 
 
 @router.post("/{reservation_id}/commit", response_model=OrderResponse)
@@ -1,11 +1,33 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional
 
-from app.db.database import db, products_collection, orders_collection, audit_collection
-from app.services.reservation_service import reservation_store
+from app.db.database import db, audit_collection
+from app.db.indexes import check_query_plans
+from app.services.reservation_service import (
+    reservation_store,
+    product_locks,
+    reservation_batcher,
+    reservation_journal,
+    warm_restart_stats,
+)
+from app.services import stock_service
+from app.services.counters import counters
+from app.services.latency_metrics import render_prometheus
+from app.services.reservation_backend import backend
+from app.services.mongo_reservation_service import expiry_lease
+from app.core.config import PRODUCT_LOCK_STATS_TOP, RESERVATION_BACKEND
+from app.services.audit_service import audit_writer
+from app.services.catalog_cache import catalog_cache
 from app.auth.deps import require_admin
+from app.auth.user_cache import user_cache
+from app.auth.revocation import revoked_tokens
+from app.utils.pagination import encode_document, fetch_page, stream_ndjson
 
 router = APIRouter(tags=["System"])
 
+AUDIT_SORT = [("timestamp", -1), ("_id", -1)]
+
 
 @router.get("/health")
 async def health():
@@ -15,20 +37,64 @@ async def health():
 
 @router.get("/metrics", dependencies=[Depends(require_admin)])
 async def metrics():
-    product_count = await products_collection.count_documents({})
-    order_count = await orders_collection.count_documents({})
+    # Every figure here is read from memory: no collection is counted
     active_reservations = len(reservation_store)
     return {
-        "products": product_count,
-        "orders": order_count,
+        "products": counters.value("products"),
+        "orders": counters.value("orders"),
         "active_reservations_in_memory": active_reservations,
+        "rates": {
+            "reservations_per_second": counters.rate("reservations_created"),
+            "commits_per_second": counters.rate("orders"),
+            "expirations_per_second": counters.rate("reservations_expired"),
+        },
+        "counters": counters.snapshot(),
+        "product_lock_wait": product_locks.total_stats(),
+        "product_lock_wait_top": product_locks.top_stats(PRODUCT_LOCK_STATS_TOP),
+        "warm_restart": warm_restart_stats,
+        "reservation_journal": reservation_journal.stats() if reservation_journal else None,
+        "reservation_batcher": reservation_batcher.stats() if reservation_batcher else None,
+        "audit_writer": audit_writer.stats(),
+        "user_cache": user_cache.stats(),
+        "revoked_tokens": revoked_tokens.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "stock_striping": stock_service.stats(),
+        "cluster": backend.stats() if RESERVATION_BACKEND == "partitioned" else None,
+        "expiry_lease": expiry_lease.stats() if RESERVATION_BACKEND == "mongo" else None,
     }
 
 
+@router.get("/metrics/prometheus", dependencies=[Depends(require_admin)])
+async def prometheus_metrics():
+    # Latency histograms of this process in the Prometheus text format
+    return Response(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/audit/", dependencies=[Depends(require_admin)])
-async def get_audit_logs(limit: int = 50):
-    cursor = audit_collection.find({}).sort("timestamp", -1).limit(limit)
-    logs = await cursor.to_list(length=limit)
+async def get_audit_logs(
+    response: Response,
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        return StreamingResponse(
+            stream_ndjson(audit_collection, {}, AUDIT_SORT, encode_document, cursor),
+            media_type="application/x-ndjson",
+        )
+
+    logs, next_cursor = await fetch_page(audit_collection, {}, AUDIT_SORT, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     for log in logs:
         log["_id"] = str(log["_id"])
     return logs
+
+
+@router.get("/admin/query-plans", dependencies=[Depends(require_admin)])
+async def query_plans():
+    plans = await check_query_plans()
+    return {
+        "collection_scans": [p["query"] for p in plans if p["collection_scan"]],
+        "plans": plans,
+    }
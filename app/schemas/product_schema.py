@@ -24,3 +24,7 @@ class ProductResponse(BaseModel):
 class StockAdjustmentRequest(BaseModel):
     change_quantity: int
     reason: str
+
+
+class StockStripesRequest(BaseModel):
+    stripes: int = Field(ge=1, le=64)
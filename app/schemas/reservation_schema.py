@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -18,6 +18,22 @@ class ReservationResponse(BaseModel):
     created_at: datetime
     expires_at: datetime
     available_stock: Optional[int] = None
+    cart_id: Optional[str] = None
+
+
+class CartItem(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
+
+
+class CartReservationCreate(BaseModel):
+    items: List[CartItem] = Field(min_length=1, max_length=50)
+    ttl_minutes: int = Field(gt=0, le=60)
+
+
+class CartReservationResponse(BaseModel):
+    cart_id: str
+    reservations: List[ReservationResponse]
 
 
 class ReservationCommitRequest(BaseModel):
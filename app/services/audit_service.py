@@ -1,16 +1,177 @@
-from typing import Optional, Dict, Any
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, List
+
 from app.db.database import audit_collection
 from app.utils.time_utils import now_utc
+from app.core.config import (
+    AUDIT_QUEUE_MAX_SIZE,
+    AUDIT_BATCH_SIZE,
+    AUDIT_FLUSH_INTERVAL_MS,
+)
 
+logger = logging.getLogger(__name__)
 
-async def log_event(
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    In-process audit queue. Events are buffered and written with insert_many
+    once AUDIT_BATCH_SIZE events are waiting or AUDIT_FLUSH_INTERVAL_MS has
+    passed since the first one arrived. The buffer is bounded: when it is
+    full, producers wait (backpressure) instead of growing memory.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._closing
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the flusher task."""
+        if self._task is None:
+            return
+        # Close intake first: from here on log_event writes straight through,
+        # so nothing new lands behind the stop marker.
+        self._closing = True
+        queue = self._queue
+        try:
+            self._batch_ready.set()
+            await queue.put(_STOP)
+            self._batch_ready.set()
+            await self._task
+            # Producers that were waiting on a full queue got their events in
+            # while it drained; keep flushing until none are left.
+            while True:
+                await asyncio.sleep(0)
+                if queue.empty():
+                    break
+                batch = []
+                while not queue.empty() and len(batch) < self.batch_size:
+                    doc = queue.get_nowait()
+                    if doc is not _STOP:
+                        batch.append(doc)
+                await self._flush(batch)
+        finally:
+            self._task = None
+            self._queue = None
+            self._batch_ready = None
+            self._closing = False
+
+    async def put(self, doc: Dict[str, Any]):
+        queue = self._queue
+        if queue.full():
+            self.backpressure_waits += 1
+            self._batch_ready.set()
+        await queue.put(doc)
+        if queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self):
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            first = await queue.get()
+            batch = []
+            if first is _STOP:
+                stopping = True
+            else:
+                batch.append(first)
+                # Once stop() has begun, flush without waiting for the timer
+                if queue.qsize() < self.batch_size - 1 and not self._closing:
+                    self._batch_ready.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self._batch_ready.wait(), self.flush_interval
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+
+            # On shutdown take everything; otherwise at most one batch.
+            while not queue.empty() and (stopping or len(batch) < self.batch_size):
+                doc = queue.get_nowait()
+                if doc is _STOP:
+                    stopping = True
+                    continue
+                batch.append(doc)
+
+            for i in range(0, len(batch), self.batch_size):
+                await self._flush(batch[i:i + self.batch_size])
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            await audit_collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Writing %d audit events failed", len(batch))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.batches += 1
+        self.last_flush_ms = elapsed_ms
+        self._total_flush_ms += elapsed_ms
+        if elapsed_ms > self.max_flush_ms:
+            self.max_flush_ms = elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self.max_size,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 3)
+            if self.batches
+            else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+
+audit_writer = AuditWriter(
+    max_size=AUDIT_QUEUE_MAX_SIZE,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL_MS / 1000,
+)
+
+
+def build_event(
     event_type: str,
     entity_type: str,
     entity_id: str,
     user_id: Optional[str] = None,
     changes: Optional[Dict[str, Any]] = None,
-):
-    doc = {
+) -> Dict[str, Any]:
+    return {
         "event_type": event_type,
         "entity_type": entity_type,
         "entity_id": entity_id,
@@ -20,9 +181,37 @@ async def log_event(
         "ip_address": None,
         "user_agent": None,
     }
-    print(f"[AUDIT LOG] Writing to DB: {doc}")
+
+
+async def log_event(
+    event_type: str,
+    entity_type: str,
+    entity_id: str,
+    user_id: Optional[str] = None,
+    changes: Optional[Dict[str, Any]] = None,
+):
+    doc = build_event(event_type, entity_type, entity_id, user_id, changes)
+    if audit_writer.running:
+        await audit_writer.put(doc)
+        return
+
+    # No writer running (scripts, tests): write straight through.
+    try:
+        await audit_collection.insert_one(doc)
+    except Exception:
+        logger.exception("Writing audit event %s failed", event_type)
+
+
+async def log_events(docs: List[Dict[str, Any]]):
+    """Write several events built with build_event() in one go."""
+    if not docs:
+        return
+    if audit_writer.running:
+        for doc in docs:
+            await audit_writer.put(doc)
+        return
+
     try:
-        result = await audit_collection.insert_one(doc)
-        print(f"[AUDIT LOG] Inserted with id: {result.inserted_id}")
-    except Exception as e:
-        print(f"[AUDIT LOG ERROR] {e}")
+        await audit_collection.insert_many(docs, ordered=False)
+    except Exception:
+        logger.exception("Writing %d audit events failed", len(docs))
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class KeyedBatcher:
+    """
+    Coalesces concurrent requests per key (product_id). The first request for
+    a key opens a window of `window_ms`; everything submitted for that key
+    until the window closes is handed to `handler(key, items)` as one batch,
+    in arrival order. The handler returns one result per item, where an
+    exception instance is raised to that item's caller. Requests arriving
+    while a batch is being handled queue up for the next one.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, List[Any]], Awaitable[List[Any]]],
+        window_ms: float,
+        max_batch: int,
+    ):
+        self.handler = handler
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Dict[str, List[Tuple[Any, asyncio.Future]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def submit(self, key: str, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((item, future))
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._drain(key))
+        return await future
+
+    async def _drain(self, key: str):
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.window)
+                queued = self._pending.pop(key)
+                batch, rest = queued[:self.max_batch], queued[self.max_batch:]
+                if rest:
+                    self._pending[key] = rest
+                await self._run(key, batch)
+        finally:
+            del self._tasks[key]
+
+    async def _run(self, key: str, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            results = await self.handler(key, [item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "open_windows": len(self._tasks),
+        }
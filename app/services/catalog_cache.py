@@ -0,0 +1,122 @@
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from app.schemas.product_schema import ProductResponse
+from app.core.config import (
+    CATALOG_CACHE_MAX_STALENESS_MS,
+    CATALOG_CACHE_SHARED_TTL_SECONDS,
+    CATALOG_CACHE_TTL_SECONDS,
+    RESERVATION_BACKEND,
+)
+
+
+class CatalogCache:
+    """
+    In-memory copy of the public product catalog.
+
+    Every stock or catalog write bumps a global version counter and records
+    that version against the product. A cached entry is served while nothing
+    has touched its product since it was loaded (up to the TTL, which bounds
+    writes made by other processes), and otherwise for at most
+    CATALOG_CACHE_MAX_STALENESS_MS. Under a reservation storm that turns
+    thousands of reads into one Mongo read per staleness window.
+
+    Stock writes store the updated document as it is; it is only turned into
+    a ProductResponse when somebody reads it.
+    """
+
+    def __init__(self, max_staleness_ms: float, ttl_seconds: float):
+        self.max_staleness = max_staleness_ms / 1000
+        self.ttl = ttl_seconds
+        self.version = 0
+        self._product_versions: Dict[str, int] = {}
+        # product_id -> (response or raw document, version it was loaded at, loaded_at)
+        self._entries: Dict[str, Tuple[Union[ProductResponse, dict], int, float]] = {}
+        # First listing page: ((responses, next_cursor), version, loaded_at)
+        self._listing: Optional[Tuple[Tuple[List[ProductResponse], Optional[str]], int, float]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, loaded_version: int, changed_version: int, loaded_at: float) -> bool:
+        age = time.monotonic() - loaded_at
+        if age <= self.max_staleness:
+            return True
+        return changed_version <= loaded_version and age <= self.ttl
+
+    def get_product(self, product_id: str) -> Optional[ProductResponse]:
+        entry = self._entries.get(product_id)
+        if entry is not None:
+            response, loaded_version, loaded_at = entry
+            if self._fresh(loaded_version, self._product_versions.get(product_id, 0), loaded_at):
+                self.hits += 1
+                if isinstance(response, dict):
+                    response = ProductResponse(**response)
+                    self._entries[product_id] = (response, loaded_version, loaded_at)
+                return response
+            del self._entries[product_id]
+        self.misses += 1
+        return None
+
+    def store_product(self, response: ProductResponse, loaded_version: int):
+        """Cache a product read; loaded_version is self.version from before the read."""
+        self._entries[response.product_id] = (response, loaded_version, time.monotonic())
+
+    def get_listing(self) -> Optional[Tuple[List[ProductResponse], Optional[str]]]:
+        """First page of the default listing and its next-page cursor."""
+        if self._listing is not None:
+            page, loaded_version, loaded_at = self._listing
+            if self._fresh(loaded_version, self.version, loaded_at):
+                self.hits += 1
+                return page
+            self._listing = None
+        self.misses += 1
+        return None
+
+    def store_listing(
+        self,
+        responses: List[ProductResponse],
+        next_cursor: Optional[str],
+        loaded_version: int,
+    ):
+        self._listing = ((responses, next_cursor), loaded_version, time.monotonic())
+
+    def bump(self, product_id: str, doc: Optional[dict] = None):
+        """
+        Record a stock change. Pass the updated document when the write
+        returned one, so single-product reads stay exact.
+        """
+        self.version += 1
+        self._product_versions[product_id] = self.version
+        if doc is not None:
+            self._entries[product_id] = (doc, self.version, time.monotonic())
+
+    def invalidate(self, product_id: str):
+        """Drop a product and the listing outright (catalog edits, new products)."""
+        self.bump(product_id)
+        self._entries.pop(product_id, None)
+        self._listing = None
+
+    def clear(self):
+        self.version = 0
+        self._product_versions.clear()
+        self._entries.clear()
+        self._listing = None
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "products_cached": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# With the mongo and partitioned backends other processes write stock too,
+# and their writes do not bump this process's versions: only a short TTL
+# bounds how stale an untouched entry can get.
+catalog_cache = CatalogCache(
+    CATALOG_CACHE_MAX_STALENESS_MS,
+    CATALOG_CACHE_TTL_SECONDS
+    if RESERVATION_BACKEND == "memory"
+    else min(CATALOG_CACHE_TTL_SECONDS, CATALOG_CACHE_SHARED_TTL_SECONDS),
+)
@@ -0,0 +1,163 @@
+"""
+Request forwarding between the workers of a partitioned cluster.
+
+Every worker listens on CLUSTER_SOCKET_DIR/worker-<id>.sock. A message is a
+4-byte big-endian length followed by Extended JSON (bson.json_util, so
+datetimes survive the trip):
+
+    request   {"op": "<handler name>", "args": {...}}
+    response  {"ok": <result>} | {"error": {"status_code": ..., "detail": ...}}
+
+HTTPExceptions raised by a handler are re-raised on the calling worker, so a
+forwarded request fails exactly like a local one.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import struct
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from bson import json_util
+from fastapi import HTTPException
+
+from app.core.config import CLUSTER_SOCKET_DIR
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct(">I")
+
+# op name -> coroutine function, registered by partitioned_reservations
+handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+
+def socket_path(worker: int) -> str:
+    return os.path.join(CLUSTER_SOCKET_DIR, f"worker-{worker}.sock")
+
+
+async def _send(writer: asyncio.StreamWriter, message: Any):
+    data = json_util.dumps(message).encode()
+    writer.write(_LENGTH.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def _recv(reader: asyncio.StreamReader) -> Any:
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return json_util.loads(await reader.readexactly(length))
+
+
+class IPCServer:
+    def __init__(self, worker: int):
+        self.worker = worker
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self.handled = 0
+
+    async def start(self):
+        path = socket_path(self.worker)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = await asyncio.start_unix_server(self._serve, path=path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Idle peer connections would otherwise keep wait_closed() waiting
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # One request at a time per connection; callers keep a pool of them
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await _recv(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                await _send(writer, await self._dispatch(request))
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, request: dict) -> dict:
+        self.handled += 1
+        try:
+            handler = handlers[request["op"]]
+            return {"ok": await handler(**request["args"])}
+        except HTTPException as e:
+            return {"error": {"status_code": e.status_code, "detail": e.detail}}
+        except Exception:
+            logger.exception("Forwarded %s failed", request.get("op"))
+            return {
+                "error": {
+                    "status_code": 500,
+                    "detail": f"Internal error on worker {self.worker}",
+                }
+            }
+
+
+class PeerClient:
+    """
+    Pool of idle connections per peer worker, opened on demand. A pooled
+    connection the peer has closed (it restarted) is dropped before use, and
+    a request whose send fails on a pooled connection is retried once on a
+    fresh one. Once the request is sent it is never retried: the peer may
+    already have run it.
+    """
+
+    def __init__(self):
+        self._idle: Dict[int, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self.forwarded = 0
+
+    async def call(self, worker: int, op: str, **args) -> Any:
+        idle = self._idle.setdefault(worker, [])
+        while True:
+            pooled = bool(idle)
+            if pooled:
+                reader, writer = idle.pop()
+                if reader.at_eof() or writer.is_closing():
+                    writer.close()
+                    continue
+            else:
+                reader, writer = await asyncio.open_unix_connection(socket_path(worker))
+
+            try:
+                await _send(writer, {"op": op, "args": args})
+            except ConnectionError:
+                writer.close()
+                if not pooled:
+                    raise
+                # The peer closed its pooled connections while they sat idle:
+                # drop them all and retry once on a new one
+                for _, stale in idle:
+                    stale.close()
+                idle.clear()
+                continue
+            except BaseException:
+                writer.close()
+                raise
+            try:
+                response = await _recv(reader)
+            except BaseException:
+                writer.close()
+                raise
+            break
+        idle.append((reader, writer))
+        self.forwarded += 1
+
+        if "error" in response:
+            raise HTTPException(**response["error"])
+        return response["ok"]
+
+    async def close(self):
+        writers = [writer for idle in self._idle.values() for _, writer in idle]
+        self._idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
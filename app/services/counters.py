@@ -0,0 +1,232 @@
+"""
+Running totals and rates for GET /metrics without counting collections.
+
+The services call counters.incr() as they create products, reservations and
+orders. A scrape then reads a few integers instead of running
+count_documents over growing collections.
+
+Totals are shared between processes through the small counters collection.
+Increments are kept per minute in window documents
+({_id: "<name>@<minute>", name, minute, value}); a total is its base
+document ({_id: <name>, value, upto}) plus the windows from minute `upto` on.
+Every COUNTERS_CHECKPOINT_SECONDS each process $inc's what it counted since
+its last checkpoint into the windows it counted it in, and reads the totals
+back.
+
+Every COUNTERS_RECONCILE_SECONDS the totals that mirror a collection
+(products, orders) are re-counted. That corrects any drift, e.g. from a
+process that died before its checkpoint or from documents written by
+scripts. The count only covers documents created before a cutoff minute,
+far enough back that every live process has checkpointed its increments
+for it; the base becomes that count with upto = cutoff, and the older
+windows are dropped. Increments other processes have not checkpointed yet
+are in windows at or after the cutoff, so they are added once, on top of
+the count, when they arrive. The same pass folds old windows of the other
+totals into their base documents, so the collection stays small.
+
+Rates are per process: events per second averaged over the last
+RATE_WINDOW_SECONDS, kept in one fixed ring of per-second slots per counter.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import COUNTERS_CHECKPOINT_SECONDS, COUNTERS_RECONCILE_SECONDS
+from app.db import database
+from app.utils.time_utils import from_ms
+
+logger = logging.getLogger(__name__)
+
+RATE_WINDOW_SECONDS = 60
+
+# Length of a window document, and how many whole windows a reconcile stays
+# behind the current one so every live process has checkpointed them.
+WINDOW_SECONDS = 60
+RECONCILE_LAG_WINDOWS = int(2 * COUNTERS_CHECKPOINT_SECONDS // WINDOW_SECONDS) + 2
+
+# Totals that must match a collection's size: name -> (collection attribute,
+# creation time field). Documents without the field count as old.
+RECONCILED = {
+    "products": ("products_collection", "created_at"),
+    "orders": ("orders_collection", "created_at"),
+}
+
+
+def _window() -> int:
+    return int(time.time() // WINDOW_SECONDS)
+
+
+class Counters:
+    def __init__(self, window_seconds: int = RATE_WINDOW_SECONDS):
+        self.window = window_seconds
+        # Shared totals as of the last read, the window each starts from,
+        # and what this process counted since (name -> window -> amount)
+        self._base: Dict[str, int] = {}
+        self._upto: Dict[str, int] = {}
+        self._pending: Dict[str, Dict[int, int]] = {}
+        # name -> per-second event counts; slot = second % window
+        self._slots: Dict[str, List[int]] = {}
+        self._second = int(time.monotonic())
+        self.checkpoints = 0
+        self.reconciles = 0
+
+    def _advance(self, second: int):
+        # Zero the slots of the seconds that passed without events
+        for s in range(max(self._second + 1, second - self.window + 1), second + 1):
+            for slots in self._slots.values():
+                slots[s % self.window] = 0
+        self._second = max(self._second, second)
+
+    def incr(self, name: str, amount: int = 1):
+        second = int(time.monotonic())
+        if second != self._second:
+            self._advance(second)
+        windows = self._pending.get(name)
+        if windows is None:
+            windows = self._pending[name] = {}
+        window = _window()
+        windows[window] = windows.get(window, 0) + amount
+        slots = self._slots.get(name)
+        if slots is None:
+            slots = self._slots[name] = [0] * self.window
+        slots[second % self.window] += amount
+
+    def value(self, name: str) -> int:
+        upto = self._upto.get(name, 0)
+        pending = self._pending.get(name, {})
+        return self._base.get(name, 0) + sum(
+            amount for window, amount in pending.items() if window >= upto
+        )
+
+    def rate(self, name: str) -> float:
+        """Events per second over the last `window` seconds (this process)."""
+        self._advance(int(time.monotonic()))
+        slots = self._slots.get(name)
+        return sum(slots) / self.window if slots else 0.0
+
+    async def _read_totals(self):
+        docs = await database.counters_collection.find({}).to_list(length=None)
+        bases = {doc["_id"]: doc for doc in docs if "name" not in doc}
+        totals = {name: doc["value"] for name, doc in bases.items()}
+        upto = {name: doc.get("upto", 0) for name, doc in bases.items()}
+        for doc in docs:
+            name = doc.get("name")
+            if name is not None and doc["minute"] >= upto.get(name, 0):
+                totals[name] = totals.get(name, 0) + doc["value"]
+        self._base, self._upto = totals, upto
+
+    async def load(self):
+        """Read the shared totals; reconcile the ones never recorded yet."""
+        await self._read_totals()
+        missing = [name for name in RECONCILED if name not in self._upto]
+        if missing:
+            await self.reconcile(missing)
+
+    async def checkpoint(self):
+        pending, self._pending = self._pending, {}
+        ops = [
+            UpdateOne(
+                {"_id": f"{name}@{window}", "name": name, "minute": window},
+                {"$inc": {"value": amount}},
+                upsert=True,
+            )
+            for name, windows in pending.items()
+            for window, amount in windows.items()
+            if amount
+        ]
+        try:
+            if ops:
+                await database.counters_collection.bulk_write(ops, ordered=False)
+        except Exception:
+            # Keep the deltas for the next attempt
+            for name, windows in pending.items():
+                mine = self._pending.setdefault(name, {})
+                for window, amount in windows.items():
+                    mine[window] = mine.get(window, 0) + amount
+            raise
+        await self._read_totals()
+        self.checkpoints += 1
+
+    async def reconcile(self, names=None):
+        """
+        Reset collection-backed totals to their true count up to the cutoff
+        window, and fold old windows of the other totals into their base.
+        """
+        cutoff = _window() - RECONCILE_LAG_WINDOWS
+        before = from_ms(cutoff * WINDOW_SECONDS * 1000)
+        for name in names or RECONCILED:
+            attribute, field = RECONCILED[name]
+            collection = getattr(database, attribute)
+            count = await collection.count_documents(
+                {"$or": [{field: {"$lt": before}}, {field: {"$exists": False}}]}
+            )
+            try:
+                # Never move back: a later cutoff set by another process wins
+                await database.counters_collection.update_one(
+                    {
+                        "_id": name,
+                        "$or": [{"upto": {"$lte": cutoff}}, {"upto": {"$exists": False}}],
+                    },
+                    {"$set": {"value": count, "upto": cutoff}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue
+            await database.counters_collection.delete_many(
+                {"name": name, "minute": {"$lt": cutoff}}
+            )
+
+        if names is None:
+            await self._compact(cutoff)
+        await self._read_totals()
+        self.reconciles += 1
+
+    async def _compact(self, cutoff: int):
+        """Move windows before cutoff of the other totals into their base."""
+        old = await database.counters_collection.find(
+            {"minute": {"$lt": cutoff}}
+        ).to_list(length=None)
+        for doc in old:
+            if doc["name"] in RECONCILED:
+                continue
+            # Delete first: a window folded twice would count twice
+            folded = await database.counters_collection.find_one_and_delete({"_id": doc["_id"]})
+            if folded is not None and folded["value"]:
+                await database.counters_collection.update_one(
+                    {"_id": folded["name"]}, {"$inc": {"value": folded["value"]}}, upsert=True
+                )
+
+    def snapshot(self) -> dict:
+        names = set(self._base) | set(self._pending)
+        return {
+            "totals": {name: self.value(name) for name in sorted(names)},
+            "checkpoints": self.checkpoints,
+            "reconciles": self.reconciles,
+        }
+
+    def reset(self):
+        self._base.clear()
+        self._upto.clear()
+        self._pending.clear()
+        self._slots.clear()
+
+
+counters = Counters()
+
+
+async def counters_worker():
+    """Checkpoint the counters regularly and reconcile them now and then."""
+    last_reconcile = time.monotonic()
+    while True:
+        await asyncio.sleep(COUNTERS_CHECKPOINT_SECONDS)
+        try:
+            await counters.checkpoint()
+            if time.monotonic() - last_reconcile >= COUNTERS_RECONCILE_SECONDS:
+                await counters.reconcile()
+                last_reconcile = time.monotonic()
+        except Exception:
+            logger.exception("Checkpointing counters failed")
@@ -0,0 +1,68 @@
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+
+class ExpiryIndex:
+    """
+    Min-heap of (expires_ms, reservation_id) kept next to reservation_store.
+    Deadlines are integer epoch milliseconds.
+
+    Removal is lazy: discard() only forgets the live deadline, and the stale
+    heap entry (a tombstone) is skipped when it reaches the top. The heap is
+    rebuilt once tombstones outnumber live entries, so memory stays bounded
+    even when most holds are committed or cancelled instead of expiring.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, str]] = []
+        self._live: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, reservation_id: str) -> bool:
+        return reservation_id in self._live
+
+    def push(self, reservation_id: str, deadline: int):
+        self._live[reservation_id] = deadline
+        heapq.heappush(self._heap, (deadline, reservation_id))
+
+    def discard(self, reservation_id: str):
+        if self._live.pop(reservation_id, None) is not None:
+            self._maybe_compact()
+
+    def pop_due(self, now: int, limit: Optional[int] = None) -> List[str]:
+        """Remove and return the ids of every reservation expiring before now."""
+        heap = self._heap
+        due: List[str] = []
+        while heap and heap[0][0] < now:
+            if limit is not None and len(due) >= limit:
+                break
+            deadline, reservation_id = heapq.heappop(heap)
+            if self._live.get(reservation_id) == deadline:
+                del self._live[reservation_id]
+                due.append(reservation_id)
+        return due
+
+    def next_deadline(self) -> Optional[int]:
+        heap = self._heap
+        while heap:
+            deadline, reservation_id = heap[0]
+            if self._live.get(reservation_id) == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def tombstones(self) -> int:
+        return len(self._heap) - len(self._live)
+
+    def clear(self):
+        self._heap.clear()
+        self._live.clear()
+
+    def _maybe_compact(self):
+        if len(self._heap) > 1024 and self.tombstones() > len(self._live):
+            self._heap = [
+                entry for entry in self._heap if self._live.get(entry[1]) == entry[0]
+            ]
+            heapq.heapify(self._heap)
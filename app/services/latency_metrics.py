@@ -0,0 +1,207 @@
+"""
+Latency histograms in the Prometheus text format (GET /metrics/prometheus).
+
+    inventory_http_request_duration_seconds   handler latency per route
+    inventory_lock_wait_seconds               time spent waiting for a lock
+    inventory_lock_hold_seconds               time a lock was held
+    inventory_mongodb_command_duration_seconds
+                                              MongoDB round trips per
+                                              collection and command
+
+Recording an observation is one bisect and two additions on a preallocated
+list; cumulative bucket counts are only computed when the histograms are
+rendered. Routes are labelled with their path template (/products/{product_id})
+and locks with the name of their lock manager, never with ids, so the number
+of series stays fixed.
+
+MongoDB latency comes from pymongo command monitoring: with LATENCY_METRICS
+on, main.py registers mongo_commands with the shared client's command
+listeners. Motor runs pymongo on worker threads, which is why series are
+updated under a lock. Request methods outside HTTP_METHODS are labelled
+"OTHER", so clients cannot add series.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds in seconds, from uncontended lock waits up to slow requests
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> per-bucket counts (last one is +Inf), then the sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        slot = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series[slot] += 1
+            series[-1] += seconds
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(snapshot):
+            pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = ",".join(pairs + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{label_text}}} {int(cumulative)}")
+            label_text = "{" + ",".join(pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}_sum{label_text} {series[-1]!r}")
+            lines.append(f"{self.name}_count{label_text} {int(cumulative)}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+handler_latency = Histogram(
+    "inventory_http_request_duration_seconds",
+    "Time from receiving a request until its response was sent.",
+    ("method", "route", "status"),
+)
+lock_wait = Histogram(
+    "inventory_lock_wait_seconds",
+    "Time spent waiting to acquire a keyed lock.",
+    ("lock",),
+)
+lock_hold = Histogram(
+    "inventory_lock_hold_seconds",
+    "Time a keyed lock was held.",
+    ("lock",),
+)
+mongo_command_latency = Histogram(
+    "inventory_mongodb_command_duration_seconds",
+    "MongoDB command round trip as reported by pymongo command monitoring.",
+    ("collection", "command"),
+)
+
+HISTOGRAMS = (handler_latency, lock_wait, lock_hold, mongo_command_latency)
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Feeds mongo_command_latency from pymongo's command events."""
+
+    def __init__(self):
+        # (request_id, connection) -> collection of commands in flight; the
+        # collection is only part of the started event
+        self._collections: Dict[tuple, str] = {}
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            target = command.get("collection")
+        else:
+            target = command.get(event.command_name) if command else None
+        key = (event.request_id, event.connection_id)
+        self._collections[key] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        collection = self._collections.pop((event.request_id, event.connection_id), "")
+        mongo_command_latency.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+
+mongo_commands = MongoCommandTimer()
+
+
+class HandlerLatencyMiddleware:
+    """
+    ASGI middleware timing every HTTP request into handler_latency. The route
+    label is the matched route's path template, looked up from the endpoint
+    the router stored in the scope; unmatched requests are labelled "other".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._templates: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "other"
+        template = self._templates.get(endpoint)
+        if template is None:
+            routes = getattr(scope.get("app"), "routes", ())
+            self._templates.update(
+                (route.endpoint, route.path) for route in routes if hasattr(route, "endpoint")
+            )
+            template = self._templates.setdefault(endpoint, "other")
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            method = scope["method"]
+            handler_latency.observe(
+                time.perf_counter() - started,
+                method if method in HTTP_METHODS else "OTHER",
+                self._route(scope),
+                str(status),
+            )
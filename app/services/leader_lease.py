@@ -0,0 +1,121 @@
+"""
+Lease-based leader election on a MongoDB document, for background jobs that
+should run in only one of several worker processes.
+
+The lease is one document in the leases collection:
+
+    {_id: <name>, holder: <process id>, expires_at: <datetime>, renewed_at: <datetime>}
+
+A process takes the lease with a single conditional upsert, which succeeds
+only if the lease is free, already expired, or already its own. The holder
+renews it every heartbeat. If the holder dies, its lease runs out and
+another process's next heartbeat takes over, at most ttl + heartbeat seconds
+later. A holder only counts itself leader until the expiry it computed
+*before* sending its last renewal, so it steps down before anyone else can
+take over. This assumes the workers' clocks roughly agree.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.db.database import leases_collection
+from app.utils.time_utils import from_ms, now_ms
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    def __init__(self, name: str, ttl_seconds: float, heartbeat_seconds: float):
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.heartbeat_seconds = heartbeat_seconds
+        self._valid_until_ms = 0
+        self.current_holder: Optional[str] = None
+        self.acquired = 0
+        self.lost = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return now_ms() < self._valid_until_ms
+
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease; returns whether this process now holds it."""
+        was_leader = self.is_leader
+        started = now_ms()
+        try:
+            doc = await leases_collection.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [
+                        {"holder": self.holder},
+                        {"expires_at": {"$lt": from_ms(started)}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "holder": self.holder,
+                        "expires_at": from_ms(started + self.ttl_ms),
+                        "renewed_at": from_ms(started),
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Someone else holds a live lease
+            doc = None
+
+        if doc is not None:
+            self._valid_until_ms = started + self.ttl_ms
+            self.current_holder = self.holder
+            if not was_leader:
+                self.acquired += 1
+                logger.info("Took lease %s as %s", self.name, self.holder)
+            return True
+
+        self._valid_until_ms = 0
+        if was_leader:
+            self.lost += 1
+            logger.warning("Lost lease %s", self.name)
+        current = await leases_collection.find_one({"_id": self.name})
+        self.current_holder = current["holder"] if current else None
+        return False
+
+    async def run(self):
+        """Heartbeat loop; cancel it to stop competing for the lease."""
+        while True:
+            try:
+                await self.try_acquire()
+            except Exception:
+                # Cannot prove we still hold it, so stop acting as leader
+                self._valid_until_ms = 0
+                logger.exception("Renewing lease %s failed", self.name)
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    async def release(self):
+        """Give the lease up (shutdown) so a follower can take over at once."""
+        if not self.is_leader:
+            return
+        self._valid_until_ms = 0
+        await leases_collection.update_one(
+            {"_id": self.name, "holder": self.holder},
+            {"$set": {"expires_at": from_ms(0)}},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "current_holder": self.current_holder,
+            "valid_for_ms": max(0, self._valid_until_ms - now_ms()),
+            "acquired": self.acquired,
+            "lost": self.lost,
+        }
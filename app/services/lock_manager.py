@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+
+from app.services.latency_metrics import lock_hold, lock_wait
+
+
+class LockWaitStats:
+    __slots__ = ("acquisitions", "contended", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def merge(self, other: "LockWaitStats"):
+        self.acquisitions += other.acquisitions
+        self.contended += other.contended
+        self.total_wait += other.total_wait
+        if other.max_wait > self.max_wait:
+            self.max_wait = other.max_wait
+
+    def record(self, waited: float):
+        self.acquisitions += 1
+        if waited > 0:
+            self.contended += 1
+        self.total_wait += waited
+        if waited > self.max_wait:
+            self.max_wait = waited
+
+    def as_dict(self) -> dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "total_wait_ms": round(self.total_wait * 1000, 3),
+            "avg_wait_ms": round(self.total_wait * 1000 / self.acquisitions, 3)
+            if self.acquisitions
+            else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class KeyedLockManager:
+    """
+    Hands out one asyncio.Lock per key (product_id) so unrelated keys never
+    wait on each other. Locks are created on demand and dropped once nobody
+    holds or waits on them, so the table stays as small as the set of keys
+    currently in use. Wait time is recorded per key; when a key's lock is
+    dropped its stats move to an LRU of the max_recent most recently used
+    idle keys, and keys falling off the LRU are folded into one aggregate.
+    Wait and hold times also go into the latency histograms, labelled with
+    the manager's name.
+    """
+
+    def __init__(self, name: str = "keyed", max_recent: int = 1000):
+        self.name = name
+        self.max_recent = max_recent
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+        self._stats: Dict[str, LockWaitStats] = {}
+        # Idle keys, least recently used first
+        self._recent: "OrderedDict[str, LockWaitStats]" = OrderedDict()
+        # Keys evicted from _recent
+        self._retired = LockWaitStats()
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+
+        try:
+            if lock.locked():
+                started = time.perf_counter()
+                await lock.acquire()
+                waited = time.perf_counter() - started
+            else:
+                await lock.acquire()
+                waited = 0.0
+            self._record_wait(key, waited)
+            lock_wait.observe(waited, self.name)
+
+            acquired = time.perf_counter()
+            try:
+                yield
+            finally:
+                lock.release()
+                lock_hold.observe(time.perf_counter() - acquired, self.name)
+        finally:
+            remaining = self._users[key] - 1
+            if remaining:
+                self._users[key] = remaining
+            else:
+                del self._users[key]
+                del self._locks[key]
+                stats = self._stats.pop(key, None)
+                if stats is not None:
+                    self._retire(key, stats)
+
+    @asynccontextmanager
+    async def hold_many(self, keys: Iterable[str]):
+        """
+        Hold the locks of several keys at once. Keys are always taken in
+        sorted order, so two callers with overlapping key sets cannot deadlock.
+        """
+        async with AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self.hold(key))
+            yield
+
+    def locked(self, key: str) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def _record_wait(self, key: str, waited: float):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._recent.pop(key, None) or LockWaitStats()
+            self._stats[key] = stats
+        stats.record(waited)
+
+    def _retire(self, key: str, stats: LockWaitStats):
+        self._recent[key] = stats
+        while len(self._recent) > self.max_recent:
+            _, evicted = self._recent.popitem(last=False)
+            self._retired.merge(evicted)
+
+    def wait_stats(self, key: Optional[str] = None) -> Dict[str, dict]:
+        """Per-key stats of the keys in use or recently used."""
+        if key is not None:
+            stats = self._stats.get(key) or self._recent.get(key)
+            return {key: stats.as_dict()} if stats else {}
+        return {k: s.as_dict() for k, s in (*self._recent.items(), *self._stats.items())}
+
+    def top_stats(self, n: int) -> List[dict]:
+        """The n keys (in use or recently used) that waited longest in total."""
+        keyed = [*self._stats.items(), *self._recent.items()]
+        keyed.sort(key=lambda item: item[1].total_wait, reverse=True)
+        return [{"key": k, **s.as_dict()} for k, s in keyed[:n]]
+
+    def total_stats(self) -> dict:
+        """Wait stats over every key since startup."""
+        total = LockWaitStats()
+        total.merge(self._retired)
+        for stats in (*self._recent.values(), *self._stats.values()):
+            total.merge(stats)
+        return total.as_dict()
+
+    def reset(self):
+        self._locks.clear()
+        self._users.clear()
+        self._stats.clear()
+        self._recent.clear()
+        self._retired = LockWaitStats()
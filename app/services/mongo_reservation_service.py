@@ -0,0 +1,475 @@
+"""
+MongoDB-authoritative reservations (RESERVATION_BACKEND=mongo).
+
+Same operations as reservation_service, but without the in-process store or
+locks: the reservation document is the only state, and every transition is
+a conditional update on its status. Only one process can move a reservation
+out of "active", so any number of worker processes can run side by side
+without double commits. Stock is moved with stock_service's conditional
+updates, so it is never oversold either.
+
+A transition is claimed first and its side effects (order insert, stock
+movement) run afterwards. A process that dies in between leaves the stock
+reserved for a reservation that is no longer active. That errs on the side
+of underselling, never of overselling.
+
+Expired reservations are swept by one worker only: the holder of the
+"reservation-expiry" lease (see leader_lease). It sleeps until the earliest
+active expires_at, and holds created in its own process wake it early.
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.schemas.reservation_schema import ReservationCreate, CartReservationCreate
+from app.db.database import reservations_collection, orders_collection
+from app.services import stock_service
+from app.services.audit_service import build_event, log_event, log_events
+from app.services.counters import counters
+from app.services.leader_lease import LeaderLease
+from app.services.reservation_service import ReservationInMemory
+from app.utils.time_utils import as_utc, now_ms, now_utc, to_ms
+from app.core.config import (
+    RESERVATION_DEFAULT_TTL_MINUTES,
+    RESERVATION_CLEANUP_INTERVAL_SECONDS,
+    RESERVATION_EXPIRY_BATCH_SIZE,
+    RESERVATION_MAX_ACTIVE_PER_USER,
+    EXPIRY_LEASE_TTL_SECONDS,
+    EXPIRY_LEASE_HEARTBEAT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+expiry_lease = LeaderLease(
+    "reservation-expiry", EXPIRY_LEASE_TTL_SECONDS, EXPIRY_LEASE_HEARTBEAT_SECONDS
+)
+
+# Set by expiration_worker while it runs, as in reservation_service: the
+# event wakes it early, _worker_wake_at is when it plans to wake on its own.
+_expiry_wakeup: Optional[asyncio.Event] = None
+_worker_wake_at: Optional[int] = None
+
+
+def _wake_for(expires_ms: int):
+    if _expiry_wakeup is not None and (
+        _worker_wake_at is None or expires_ms < _worker_wake_at
+    ):
+        _expiry_wakeup.set()
+
+
+async def _check_user_cap(user_id: str, count: int):
+    # Best effort across processes: two concurrent creates can both pass
+    if RESERVATION_MAX_ACTIVE_PER_USER <= 0:
+        return
+    active = await reservations_collection.count_documents(
+        {"user_id": user_id, "status": "active"}
+    )
+    if active + count > RESERVATION_MAX_ACTIVE_PER_USER:
+        raise HTTPException(
+            status_code=429,
+            detail=f"At most {RESERVATION_MAX_ACTIVE_PER_USER} active reservations per user",
+        )
+
+
+async def create_reservation(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
+    await _check_user_cap(user_id, 1)
+    product = await stock_service.reserve(payload.product_id, payload.quantity)
+    if not product:
+        raise HTTPException(
+            status_code=400,
+            detail="Insufficient stock or product not found",
+        )
+
+    created_ms = now_ms()
+    ttl_minutes = payload.ttl_minutes or RESERVATION_DEFAULT_TTL_MINUTES
+    res = ReservationInMemory(
+        reservation_id=f"RES_{uuid4().hex[:8]}",
+        user_id=user_id,
+        product_id=payload.product_id,
+        quantity=payload.quantity,
+        status="active",
+        created_ms=created_ms,
+        expires_ms=created_ms + ttl_minutes * 60_000,
+        unit_price=float(product["price"]),
+        available_stock=product.get("available_stock"),
+    )
+    try:
+        await reservations_collection.insert_one(res.to_document())
+    except Exception:
+        await stock_service.release({payload.product_id: payload.quantity})
+        raise
+    _wake_for(res.expires_ms)
+    counters.incr("reservations_created")
+
+    await log_event(
+        "reservation_created",
+        "reservation",
+        res.reservation_id,
+        user_id,
+        {"product_id": payload.product_id, "quantity": payload.quantity},
+    )
+    return res
+
+
+async def get_reservation(reservation_id: str) -> ReservationInMemory:
+    doc = await reservations_collection.find_one({"reservation_id": reservation_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return ReservationInMemory.from_document(doc)
+
+
+async def get_user_active_reservations(user_id: str) -> List[ReservationInMemory]:
+    docs = reservations_collection.find({"user_id": user_id, "status": "active"})
+    return [ReservationInMemory.from_document(doc) async for doc in docs]
+
+
+async def _claim(reservation_id: str, status: str, extra: dict = None, live_only: bool = True):
+    """
+    Atomically move an active reservation to `status`. Returns the document
+    as it was before the update, or None if another request got there first
+    (or, with live_only, the reservation has already run out).
+    """
+    query = {"reservation_id": reservation_id, "status": "active"}
+    if live_only:
+        query["expires_at"] = {"$gt": now_utc()}
+    return await reservations_collection.find_one_and_update(
+        query,
+        {"$set": {"status": status, **(extra or {})}},
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+async def _refuse_claim(reservation_id: str):
+    """Explain why a claim failed, expiring the reservation if that is why."""
+    doc = await reservations_collection.find_one({"reservation_id": reservation_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    if doc["status"] != "active":
+        raise HTTPException(status_code=400, detail="Reservation not active")
+
+    expired = await _claim(reservation_id, "expired", live_only=False)
+    if expired is not None:
+        await stock_service.release({expired["product_id"]: expired["quantity"]})
+        counters.incr("reservations_expired")
+        await log_event(
+            "reservation_expired_on_commit",
+            "reservation",
+            reservation_id,
+            expired["user_id"],
+        )
+    raise HTTPException(status_code=400, detail="Reservation expired")
+
+
+async def commit_reservation(reservation_id: str, commit_payload) -> dict:
+    order_id = f"ORD_{uuid4().hex[:8]}"
+    doc = await _claim(reservation_id, "committed", {"order_id": order_id})
+    if doc is None:
+        await _refuse_claim(reservation_id)
+
+    total_amount = doc["unit_price"] * doc["quantity"]
+    order_doc = {
+        "order_id": order_id,
+        "reservation_id": reservation_id,
+        "user_id": doc["user_id"],
+        "product_id": doc["product_id"],
+        "quantity": doc["quantity"],
+        "unit_price": doc["unit_price"],
+        "total_amount": total_amount,
+        "status": "confirmed",
+        "payment_id": commit_payload.payment_id,
+        "shipping_address": commit_payload.shipping_address,
+        "created_at": now_utc(),
+        "shipped_at": None,
+    }
+    await asyncio.gather(
+        orders_collection.insert_one(order_doc),
+        stock_service.commit({doc["product_id"]: doc["quantity"]}),
+    )
+    counters.incr("orders")
+
+    await log_event(
+        "order_committed",
+        "order",
+        order_id,
+        doc["user_id"],
+        {"reservation_id": reservation_id, "total_amount": total_amount},
+    )
+    return order_doc
+
+
+async def cancel_reservation(reservation_id: str, cancel_payload):
+    doc = await _claim(
+        reservation_id,
+        "cancelled",
+        {"cancel_reason": cancel_payload.reason},
+        live_only=False,
+    )
+    if doc is None:
+        found = await reservations_collection.find_one({"reservation_id": reservation_id})
+        if not found:
+            raise HTTPException(status_code=404, detail="Reservation not found")
+        raise HTTPException(status_code=400, detail="Reservation not active")
+
+    await stock_service.release({doc["product_id"]: doc["quantity"]})
+    counters.incr("reservations_cancelled")
+
+    await log_event(
+        "reservation_cancelled",
+        "reservation",
+        reservation_id,
+        doc["user_id"],
+        {"reason": cancel_payload.reason},
+    )
+
+
+async def create_cart_reservation(
+    payload: CartReservationCreate, user_id: str
+) -> List[ReservationInMemory]:
+    """All cart lines or none, as in reservation_service, minus the locks."""
+    quantities: Dict[str, int] = {}
+    for item in payload.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    await _check_user_cap(user_id, len(quantities))
+
+    products = await asyncio.gather(*(
+        stock_service.reserve(product_id, quantity)
+        for product_id, quantity in quantities.items()
+    ))
+    reserved = {
+        product_id: product
+        for product_id, product in zip(quantities, products)
+        if product is not None
+    }
+    if len(reserved) < len(quantities):
+        if reserved:
+            await stock_service.release({pid: quantities[pid] for pid in reserved})
+        failed = [pid for pid in quantities if pid not in reserved]
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock or product not found: {', '.join(failed)}",
+        )
+
+    cart_id = f"CART_{uuid4().hex[:8]}"
+    created_ms = now_ms()
+    ttl_minutes = payload.ttl_minutes or RESERVATION_DEFAULT_TTL_MINUTES
+    reservations = [
+        ReservationInMemory(
+            reservation_id=f"RES_{uuid4().hex[:8]}",
+            user_id=user_id,
+            product_id=product_id,
+            quantity=quantity,
+            status="active",
+            created_ms=created_ms,
+            expires_ms=created_ms + ttl_minutes * 60_000,
+            unit_price=float(reserved[product_id]["price"]),
+            cart_id=cart_id,
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    try:
+        await reservations_collection.insert_many([res.to_document() for res in reservations])
+    except Exception:
+        await stock_service.release(quantities)
+        raise
+    _wake_for(min(res.expires_ms for res in reservations))
+    counters.incr("reservations_created", len(reservations))
+
+    await log_events([
+        build_event(
+            "reservation_created",
+            "reservation",
+            res.reservation_id,
+            user_id,
+            {"product_id": res.product_id, "quantity": res.quantity, "cart_id": cart_id},
+        )
+        for res in reservations
+    ])
+    return reservations
+
+
+async def commit_cart(cart_id: str, commit_payload, user_id: str) -> List[dict]:
+    """
+    Claim every line of the cart with one update_many tagged with a claim
+    token. If any line could not be claimed (cancelled, expired, committed by
+    someone else), the lines that were claimed are handed back.
+    """
+    lines = await reservations_collection.find({"cart_id": cart_id}).to_list(length=None)
+    if not lines or all(doc["status"] != "active" for doc in lines):
+        raise HTTPException(status_code=404, detail="Cart not active or already processed")
+    if any(doc["user_id"] != user_id for doc in lines):
+        raise HTTPException(status_code=403, detail="Not allowed to commit this cart")
+
+    token = uuid4().hex
+    now = now_utc()
+    await reservations_collection.update_many(
+        {"cart_id": cart_id, "status": "active", "expires_at": {"$gt": now}},
+        {"$set": {"status": "committed", "claim": token}},
+    )
+    claimed = await reservations_collection.find({"claim": token}).to_list(length=None)
+    if len(claimed) < len(lines):
+        if claimed:
+            await reservations_collection.update_many(
+                {"claim": token},
+                {"$set": {"status": "active", "claim": None}},
+            )
+        if any(as_utc(doc["expires_at"]) <= now for doc in lines):
+            # The sweeper releases the stock
+            raise HTTPException(status_code=400, detail="Cart reservation expired")
+        raise HTTPException(
+            status_code=400,
+            detail="Some reservations in this cart are no longer active",
+        )
+
+    order_docs = [
+        {
+            "order_id": f"ORD_{uuid4().hex[:8]}",
+            "reservation_id": doc["reservation_id"],
+            "user_id": doc["user_id"],
+            "product_id": doc["product_id"],
+            "quantity": doc["quantity"],
+            "unit_price": doc["unit_price"],
+            "total_amount": doc["unit_price"] * doc["quantity"],
+            "status": "confirmed",
+            "payment_id": commit_payload.payment_id,
+            "shipping_address": commit_payload.shipping_address,
+            "cart_id": cart_id,
+            "created_at": now,
+            "shipped_at": None,
+        }
+        for doc in claimed
+    ]
+    await asyncio.gather(
+        orders_collection.insert_many(order_docs),
+        stock_service.commit({doc["product_id"]: doc["quantity"] for doc in claimed}),
+    )
+    counters.incr("orders", len(order_docs))
+
+    await log_events([
+        build_event(
+            "order_committed",
+            "order",
+            order["order_id"],
+            user_id,
+            {
+                "reservation_id": order["reservation_id"],
+                "total_amount": order["total_amount"],
+                "cart_id": cart_id,
+            },
+        )
+        for order in order_docs
+    ])
+    return order_docs
+
+
+async def cleanup_expired_reservations() -> int:
+    """
+    Expire everything past due, one batch at a time. Each batch is claimed
+    with a token so that, with several processes sweeping at once, each
+    reservation's stock is released exactly once.
+    """
+    expired_total = 0
+    while True:
+        due = await (
+            reservations_collection.find(
+                {"status": "active", "expires_at": {"$lt": now_utc()}}
+            )
+            .limit(RESERVATION_EXPIRY_BATCH_SIZE)
+            .to_list(length=RESERVATION_EXPIRY_BATCH_SIZE)
+        )
+        if not due:
+            return expired_total
+
+        token = uuid4().hex
+        await reservations_collection.update_many(
+            {
+                "reservation_id": {"$in": [doc["reservation_id"] for doc in due]},
+                "status": "active",
+            },
+            {"$set": {"status": "expired", "claim": token}},
+        )
+        claimed = await reservations_collection.find({"claim": token}).to_list(length=None)
+
+        restore: Dict[str, int] = {}
+        for doc in claimed:
+            restore[doc["product_id"]] = restore.get(doc["product_id"], 0) + doc["quantity"]
+        if restore:
+            await stock_service.release(restore)
+        counters.incr("reservations_expired", len(claimed))
+        await log_events([
+            build_event(
+                "reservation_expired",
+                "reservation",
+                doc["reservation_id"],
+                doc["user_id"],
+                {"product_id": doc["product_id"], "quantity": doc["quantity"]},
+            )
+            for doc in claimed
+        ])
+        expired_total += len(claimed)
+        if len(due) < RESERVATION_EXPIRY_BATCH_SIZE:
+            return expired_total
+
+
+async def _next_deadline() -> Optional[int]:
+    """Earliest expires_at (ms) of an active reservation, from any process."""
+    docs = await (
+        reservations_collection.find({"status": "active"})
+        .sort("expires_at", 1)
+        .limit(1)
+        .to_list(length=1)
+    )
+    return to_ms(docs[0]["expires_at"]) if docs else None
+
+
+async def expiration_worker():
+    """
+    While this worker holds the expiry lease, sweep and then sleep until the
+    earliest active expires_at (never longer than
+    RESERVATION_CLEANUP_INTERVAL_SECONDS, so holds created by other
+    processes in the meantime are not missed for long). Every worker runs
+    this; the others just keep trying to take the lease over.
+    """
+    global _expiry_wakeup, _worker_wake_at
+
+    _expiry_wakeup = asyncio.Event()
+    heartbeat = asyncio.create_task(expiry_lease.run())
+    try:
+        while True:
+            # Cleared before the sweep so a hold created meanwhile still wakes us
+            _expiry_wakeup.clear()
+            now = now_ms()
+            if expiry_lease.is_leader:
+                wake_at = now + RESERVATION_CLEANUP_INTERVAL_SECONDS * 1000
+                try:
+                    await cleanup_expired_reservations()
+                    next_deadline = await _next_deadline()
+                    if next_deadline is not None and next_deadline < wake_at:
+                        wake_at = next_deadline
+                except Exception:
+                    logger.exception("Expiring reservations failed")
+                    wake_at = now + 1000
+            else:
+                wake_at = now + int(expiry_lease.heartbeat_seconds * 1000)
+            _worker_wake_at = wake_at
+
+            # At least a millisecond, so a deadline due right now cannot spin
+            timeout = max((wake_at - now_ms()) / 1000, 0.001)
+            try:
+                await asyncio.wait_for(_expiry_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _expiry_wakeup = None
+        _worker_wake_at = None
+        heartbeat.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await heartbeat
+        try:
+            await expiry_lease.release()
+        except Exception:
+            logger.exception("Releasing the expiry lease failed")
@@ -1,18 +1,45 @@
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 
 from fastapi import HTTPException
 from pymongo import ReturnDocument
 
 from app.db.database import orders_collection
 from app.services.audit_service import log_event
+from app.schemas.order_schema import OrderResponse
+from app.utils.pagination import fetch_page, stream_ndjson
 
+# Newest first; backed by the (user_id, created_at, _id) and (created_at, _id) indexes
+ORDER_SORT = [("created_at", -1), ("_id", -1)]
 
-async def list_orders(user_id: Optional[str] = None) -> List[dict]:
+
+def _orders_query(user_id: Optional[str]) -> Dict[str, Any]:
     query: Dict[str, Any] = {}
     if user_id:
         query["user_id"] = user_id
-    cursor = orders_collection.find(query).sort("created_at", -1)
-    return await cursor.to_list(length=200)
+    return query
+
+
+async def list_orders(
+    user_id: Optional[str] = None,
+    limit: int = 200,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """One page of orders, newest first, plus the cursor for the next page."""
+    return await fetch_page(
+        orders_collection, _orders_query(user_id), ORDER_SORT, limit, cursor
+    )
+
+
+def stream_orders(
+    user_id: Optional[str] = None, cursor: Optional[str] = None
+) -> AsyncIterator[bytes]:
+    return stream_ndjson(
+        orders_collection,
+        _orders_query(user_id),
+        ORDER_SORT,
+        lambda d: OrderResponse(**d).model_dump_json(),
+        cursor,
+    )
 
 
 async def get_order(order_id: str) -> dict:
@@ -0,0 +1,364 @@
+"""
+Product-partitioned reservations (RESERVATION_BACKEND=partitioned).
+
+Each worker started by app.cluster owns the products that partitioning's
+hash ring assigns to it. It runs the normal in-memory reservation_service
+for those products only. A request for a product owned by another worker is
+forwarded to that worker over cluster_ipc, and the reply or HTTP error is
+passed straight back. The in-memory fast path is unchanged; capacity grows
+with the number of workers because each one locks, batches and expires only
+its own products.
+
+Reservation ids do not say which product they belong to. A worker that
+does not hold a reservation locally looks its product up in MongoDB once
+and forwards the request. A cart whose products belong to several workers is
+reserved on each owner under one cart_id. It is all-or-nothing on creation
+(lines that succeeded are cancelled again). Commit checks the cart on every
+owner before committing on any; an owner that still fails after that (its
+holds expired in between, MongoDB errored) yields a 409 listing the orders
+created and the lines that were not committed.
+
+A user's holds are spread over the workers, so each worker's own
+RESERVATION_MAX_ACTIVE_PER_USER check only sees part of them. With a cap
+set, every create for a user goes through one worker, the user's owner on
+the ring (user_owner_of). It serializes that user's creates, counts the
+user's active holds on all workers and only then reserves on the product
+owners.
+"""
+import asyncio
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from fastapi import HTTPException
+
+from app.core.config import RESERVATION_MAX_ACTIVE_PER_USER
+from app.db.database import reservations_collection
+from app.schemas.reservation_schema import (
+    CancelReservationRequest,
+    CartReservationCreate,
+    ReservationCommitRequest,
+    ReservationCreate,
+)
+from app.services import cluster_ipc
+from app.services import reservation_service as rs
+from app.services.lock_manager import KeyedLockManager
+from app.services.partitioning import owner_of, ring, user_owner_of, worker_id
+from app.services.reservation_service import ReservationInMemory
+
+server = cluster_ipc.IPCServer(worker_id)
+peers = cluster_ipc.PeerClient()
+
+expiration_worker = rs.expiration_worker
+
+# Held by a user's owner while it counts and creates that user's holds
+user_locks = KeyedLockManager("user")
+
+
+def _encode(res: ReservationInMemory) -> Dict[str, Any]:
+    return {field: getattr(res, field) for field in ReservationInMemory.__slots__}
+
+
+def _decode(data: Dict[str, Any]) -> ReservationInMemory:
+    return ReservationInMemory(**data)
+
+
+# ---------- handlers: run on the owning worker ----------
+
+async def _handle_create(payload: dict, user_id: str):
+    return _encode(await rs.create_reservation(ReservationCreate(**payload), user_id))
+
+
+async def _handle_get(reservation_id: str):
+    return _encode(await rs.get_reservation(reservation_id))
+
+
+async def _handle_user_active(user_id: str):
+    return [_encode(r) for r in await rs.get_user_active_reservations(user_id)]
+
+
+async def _handle_commit(reservation_id: str, payload: dict):
+    return await rs.commit_reservation(reservation_id, ReservationCommitRequest(**payload))
+
+
+async def _handle_cancel(reservation_id: str, payload: dict):
+    await rs.cancel_reservation(reservation_id, CancelReservationRequest(**payload))
+
+
+async def _handle_create_cart(payload: dict, user_id: str, cart_id: str):
+    items = await rs.create_cart_reservation(CartReservationCreate(**payload), user_id, cart_id)
+    return [_encode(r) for r in items]
+
+
+async def _handle_check_cart(cart_id: str, user_id: str):
+    await rs.check_cart(cart_id, user_id)
+
+
+async def _handle_commit_cart(cart_id: str, payload: dict, user_id: str):
+    return await rs.commit_cart(cart_id, ReservationCommitRequest(**payload), user_id)
+
+
+async def _handle_user_active_count(user_id: str):
+    return len(rs.user_index.get(user_id, ()))
+
+
+async def _handle_create_capped(payload: dict, user_id: str):
+    return _encode(await _create_capped(ReservationCreate(**payload), user_id))
+
+
+async def _handle_create_cart_capped(payload: dict, user_id: str):
+    items = await _create_cart_capped(CartReservationCreate(**payload), user_id)
+    return [_encode(r) for r in items]
+
+
+cluster_ipc.handlers.update({
+    "create_reservation": _handle_create,
+    "get_reservation": _handle_get,
+    "user_active_reservations": _handle_user_active,
+    "commit_reservation": _handle_commit,
+    "cancel_reservation": _handle_cancel,
+    "create_cart_reservation": _handle_create_cart,
+    "check_cart": _handle_check_cart,
+    "commit_cart": _handle_commit_cart,
+    "user_active_count": _handle_user_active_count,
+    "create_reservation_capped": _handle_create_capped,
+    "create_cart_reservation_capped": _handle_create_cart_capped,
+})
+
+
+# ---------- routing: what the routes call ----------
+
+async def _reservation_owner(reservation_id: str) -> int:
+    if reservation_id in rs.reservation_store:
+        return worker_id
+    doc = await reservations_collection.find_one(
+        {"reservation_id": reservation_id}, {"product_id": 1, "_id": 0}
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return owner_of(doc["product_id"])
+
+
+async def _check_user_cap(user_id: str, count: int):
+    """On the user's owner, with user_locks held for user_id."""
+    remote = await asyncio.gather(*(
+        peers.call(w, "user_active_count", user_id=user_id)
+        for w in range(ring.workers)
+        if w != worker_id
+    ))
+    active = len(rs.user_index.get(user_id, ())) + sum(remote)
+    if active + count > RESERVATION_MAX_ACTIVE_PER_USER:
+        raise HTTPException(
+            status_code=429,
+            detail=f"At most {RESERVATION_MAX_ACTIVE_PER_USER} active reservations per user",
+        )
+
+
+async def _create_on_owner(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
+    owner = owner_of(payload.product_id)
+    if owner == worker_id:
+        return await rs.create_reservation(payload, user_id)
+    return _decode(await peers.call(
+        owner, "create_reservation", payload=payload.model_dump(), user_id=user_id
+    ))
+
+
+async def _create_capped(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
+    async with user_locks.hold(user_id):
+        await _check_user_cap(user_id, 1)
+        return await _create_on_owner(payload, user_id)
+
+
+async def create_reservation(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
+    if RESERVATION_MAX_ACTIVE_PER_USER <= 0:
+        return await _create_on_owner(payload, user_id)
+    owner = user_owner_of(user_id)
+    if owner == worker_id:
+        return await _create_capped(payload, user_id)
+    return _decode(await peers.call(
+        owner, "create_reservation_capped", payload=payload.model_dump(), user_id=user_id
+    ))
+
+
+async def get_reservation(reservation_id: str) -> ReservationInMemory:
+    owner = await _reservation_owner(reservation_id)
+    if owner == worker_id:
+        return await rs.get_reservation(reservation_id)
+    return _decode(await peers.call(owner, "get_reservation", reservation_id=reservation_id))
+
+
+async def get_user_active_reservations(user_id: str) -> List[ReservationInMemory]:
+    """A user's holds can sit on every worker: ask them all."""
+    local = await rs.get_user_active_reservations(user_id)
+    remote = await asyncio.gather(*(
+        peers.call(w, "user_active_reservations", user_id=user_id)
+        for w in range(ring.workers)
+        if w != worker_id
+    ))
+    return local + [_decode(r) for batch in remote for r in batch]
+
+
+async def commit_reservation(reservation_id: str, commit_payload) -> dict:
+    owner = await _reservation_owner(reservation_id)
+    if owner == worker_id:
+        return await rs.commit_reservation(reservation_id, commit_payload)
+    return await peers.call(
+        owner,
+        "commit_reservation",
+        reservation_id=reservation_id,
+        payload=commit_payload.model_dump(),
+    )
+
+
+async def cancel_reservation(reservation_id: str, cancel_payload):
+    owner = await _reservation_owner(reservation_id)
+    if owner == worker_id:
+        return await rs.cancel_reservation(reservation_id, cancel_payload)
+    await peers.call(
+        owner,
+        "cancel_reservation",
+        reservation_id=reservation_id,
+        payload=cancel_payload.model_dump(),
+    )
+
+
+async def _create_cart_on(owner: int, payload: CartReservationCreate, user_id: str, cart_id: str):
+    if owner == worker_id:
+        return await rs.create_cart_reservation(payload, user_id, cart_id)
+    items = await peers.call(
+        owner,
+        "create_cart_reservation",
+        payload=payload.model_dump(),
+        user_id=user_id,
+        cart_id=cart_id,
+    )
+    return [_decode(r) for r in items]
+
+
+async def _create_cart_capped(
+    payload: CartReservationCreate, user_id: str
+) -> List[ReservationInMemory]:
+    async with user_locks.hold(user_id):
+        await _check_user_cap(user_id, len({item.product_id for item in payload.items}))
+        return await _create_cart(payload, user_id)
+
+
+async def create_cart_reservation(
+    payload: CartReservationCreate, user_id: str
+) -> List[ReservationInMemory]:
+    if RESERVATION_MAX_ACTIVE_PER_USER <= 0:
+        return await _create_cart(payload, user_id)
+    owner = user_owner_of(user_id)
+    if owner == worker_id:
+        return await _create_cart_capped(payload, user_id)
+    items = await peers.call(
+        owner, "create_cart_reservation_capped", payload=payload.model_dump(), user_id=user_id
+    )
+    return [_decode(r) for r in items]
+
+
+async def _create_cart(
+    payload: CartReservationCreate, user_id: str
+) -> List[ReservationInMemory]:
+    by_owner: Dict[int, list] = {}
+    for item in payload.items:
+        by_owner.setdefault(owner_of(item.product_id), []).append(item)
+
+    cart_id = f"CART_{uuid4().hex[:8]}"
+    results = await asyncio.gather(*(
+        _create_cart_on(
+            owner,
+            CartReservationCreate(items=items, ttl_minutes=payload.ttl_minutes),
+            user_id,
+            cart_id,
+        )
+        for owner, items in by_owner.items()
+    ), return_exceptions=True)
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        rollback = CancelReservationRequest(reason="cart rollback")
+        await asyncio.gather(*(
+            cancel_reservation(res.reservation_id, rollback)
+            for part in results
+            if not isinstance(part, BaseException)
+            for res in part
+        ))
+        raise failures[0]
+    return [res for part in results for res in part]
+
+
+async def _commit_cart_on(owner: int, cart_id: str, commit_payload, user_id: str):
+    if owner == worker_id:
+        return await rs.commit_cart(cart_id, commit_payload, user_id)
+    return await peers.call(
+        owner,
+        "commit_cart",
+        cart_id=cart_id,
+        payload=commit_payload.model_dump(),
+        user_id=user_id,
+    )
+
+
+async def _check_cart_on(owner: int, cart_id: str, user_id: str):
+    if owner == worker_id:
+        return await rs.check_cart(cart_id, user_id)
+    await peers.call(owner, "check_cart", cart_id=cart_id, user_id=user_id)
+
+
+async def commit_cart(cart_id: str, commit_payload, user_id: str) -> List[dict]:
+    lines = await reservations_collection.find(
+        {"cart_id": cart_id}, {"reservation_id": 1, "product_id": 1, "_id": 0}
+    ).to_list(length=None)
+    by_owner: Dict[int, List[dict]] = {}
+    for doc in lines:
+        by_owner.setdefault(owner_of(doc["product_id"]), []).append(doc)
+    if len(by_owner) <= 1:
+        owner = next(iter(by_owner), worker_id)
+        return await _commit_cart_on(owner, cart_id, commit_payload, user_id)
+
+    # Nothing is committed unless every owner could commit its part right now
+    await asyncio.gather(*(_check_cart_on(owner, cart_id, user_id) for owner in by_owner))
+    results = await asyncio.gather(*(
+        _commit_cart_on(owner, cart_id, commit_payload, user_id) for owner in by_owner
+    ), return_exceptions=True)
+
+    orders = [order for part in results if not isinstance(part, BaseException) for order in part]
+    failed = [
+        {"reservation_id": line["reservation_id"], "product_id": line["product_id"]}
+        for owner, part in zip(by_owner, results)
+        if isinstance(part, BaseException)
+        for line in by_owner[owner]
+    ]
+    if failed:
+        if not orders:
+            raise next(part for part in results if isinstance(part, BaseException))
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Cart partially committed",
+                "orders": [
+                    {"order_id": o["order_id"], "reservation_id": o["reservation_id"]}
+                    for o in orders
+                ],
+                "failed": failed,
+            },
+        )
+    return orders
+
+
+async def start():
+    await server.start()
+
+
+async def stop():
+    await server.stop()
+    await peers.close()
+
+
+def stats() -> dict:
+    return {
+        "worker_id": worker_id,
+        "workers": ring.workers,
+        "forwarded": peers.forwarded,
+        "handled_for_peers": server.handled,
+    }
@@ -0,0 +1,48 @@
+import bisect
+import hashlib
+from typing import List, Tuple
+
+from app.core.config import CLUSTER_WORKERS, CLUSTER_WORKER_ID
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring of worker ids. Each worker gets `vnodes` points on
+    the ring and owns the keys hashing just before them, so the products move
+    evenly between workers and adding a worker only moves about 1/N of them.
+    """
+
+    def __init__(self, workers: int, vnodes: int = 64):
+        self.workers = workers
+        points: List[Tuple[int, int]] = sorted(
+            (_hash(f"worker-{w}#{v}"), w) for w in range(workers) for v in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [w for _, w in points]
+
+    def owner(self, key: str) -> int:
+        i = bisect.bisect(self._hashes, _hash(key))
+        return self._owners[i % len(self._owners)]
+
+
+# Set up by app.cluster for every worker it launches; a single worker owns
+# every product.
+ring = HashRing(max(CLUSTER_WORKERS, 1))
+worker_id = CLUSTER_WORKER_ID
+
+
+def owner_of(product_id: str) -> int:
+    return ring.owner(product_id)
+
+
+def is_local(product_id: str) -> bool:
+    return ring.owner(product_id) == worker_id
+
+
+def user_owner_of(user_id: str) -> int:
+    """Worker that enforces RESERVATION_MAX_ACTIVE_PER_USER for user_id."""
+    return ring.owner(f"user:{user_id}")
@@ -0,0 +1,23 @@
+"""
+The reservation implementation used by the routes, picked by
+RESERVATION_BACKEND:
+
+    memory  reservation_service: in-process store with per-product locks.
+            Fastest, but only correct with a single worker process.
+    mongo   mongo_reservation_service: every transition is a conditional
+            update in MongoDB, so any number of workers can run.
+    partitioned
+            partitioned_reservations: the memory backend, with each worker
+            launched by app.cluster owning a share of the products and
+            forwarding the rest to their owners.
+"""
+from app.core.config import RESERVATION_BACKEND
+
+if RESERVATION_BACKEND == "mongo":
+    from app.services import mongo_reservation_service as backend
+elif RESERVATION_BACKEND == "partitioned":
+    from app.services import partitioned_reservations as backend
+elif RESERVATION_BACKEND == "memory":
+    from app.services import reservation_service as backend
+else:
+    raise RuntimeError(f"Unknown RESERVATION_BACKEND: {RESERVATION_BACKEND!r}")
@@ -0,0 +1,402 @@
+"""
+Local persistence for the in-memory reservation store: a write-ahead journal
+plus periodic binary snapshots, so a restarted process can reload its holds
+without scanning the reservations collection.
+
+Files in the journal directory come in generations:
+
+    snapshot-00000007.bin   store contents when generation 7 started
+    journal-00000007.log    every change made during generation 7
+
+Recovery loads the newest valid snapshot and replays every journal from that
+generation on. Old generations are deleted only after a newer snapshot has
+been written and fsynced, so a crash at any point leaves a usable pair. When
+no snapshot is usable the store is rebuilt from MongoDB instead, and the next
+generation still starts above every file on disk so the stale journals are
+never appended to or replayed again.
+
+Journal lines are JSON records:
+
+    {"op": "create",  "res": [{...}, ...]}   holds written to the store
+    {"op": "pending", "ids": [...]}          about to leave the store
+    {"op": "pending", "ids": [...], "orders": [{...}, ...]}
+                                             same, for a commit: the orders
+                                             it is about to write
+    {"op": "remove",  "ids": [...]}          left the store and every write
+                                             for it is done
+
+A "pending" without a matching "remove" means the process died in the middle
+of a commit, cancel or expiry, or that a write after the claim failed; those
+ids are checked against MongoDB after recovery instead of being trusted
+blindly. The orders of such a commit are handed back too, so recovery can
+write the ones whose reservation was claimed. Open pendings, orders
+included, are carried into every new generation's journal.
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SNAPSHOT_MAGIC = b"RSNP"
+_SNAPSHOT_VERSION = 1
+# magic, version, record count
+_HEADER = struct.Struct("<4sHI")
+# id/user/product/cart lengths, quantity, created_at ms, expires_at ms, unit_price
+_RECORD = struct.Struct("<HHHHiqqd")
+_CRC = struct.Struct("<I")
+
+_FILE_RE = re.compile(r"^(snapshot|journal)-(\d{8})\.(bin|log)$")
+
+_ROTATE = object()
+
+
+def record_from_reservation(res: Any) -> Dict[str, Any]:
+    return {
+        "reservation_id": res.reservation_id,
+        "user_id": res.user_id,
+        "product_id": res.product_id,
+        "quantity": res.quantity,
+        "created_at": res.created_ms,
+        "expires_at": res.expires_ms,
+        "unit_price": res.unit_price,
+        "cart_id": res.cart_id,
+    }
+
+
+def reservation_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Keyword arguments for ReservationInMemory from a journal/snapshot record."""
+    return {
+        "reservation_id": record["reservation_id"],
+        "user_id": record["user_id"],
+        "product_id": record["product_id"],
+        "quantity": record["quantity"],
+        "status": "active",
+        "created_ms": record["created_at"],
+        "expires_ms": record["expires_at"],
+        "unit_price": record["unit_price"],
+        "cart_id": record["cart_id"],
+    }
+
+
+def encode_snapshot(records: Iterable[Dict[str, Any]]) -> bytes:
+    body = bytearray()
+    count = 0
+    for r in records:
+        rid = r["reservation_id"].encode()
+        uid = r["user_id"].encode()
+        pid = r["product_id"].encode()
+        cid = (r["cart_id"] or "").encode()
+        body += _RECORD.pack(
+            len(rid), len(uid), len(pid), len(cid),
+            r["quantity"], r["created_at"], r["expires_at"], r["unit_price"],
+        )
+        body += rid + uid + pid + cid
+        count += 1
+
+    data = _HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, count) + bytes(body)
+    return data + _CRC.pack(zlib.crc32(data))
+
+
+def decode_snapshot(path: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Read a snapshot through mmap; None if it is missing, torn or corrupt."""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size + _CRC.size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                end = len(buf) - _CRC.size
+                (crc,) = _CRC.unpack_from(buf, end)
+                if zlib.crc32(memoryview(buf)[:end]) != crc:
+                    return None
+                magic, version, count = _HEADER.unpack_from(buf, 0)
+                if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                    return None
+
+                records: Dict[str, Dict[str, Any]] = {}
+                offset = _HEADER.size
+                for _ in range(count):
+                    rid_len, uid_len, pid_len, cid_len, quantity, created, expires, price = (
+                        _RECORD.unpack_from(buf, offset)
+                    )
+                    offset += _RECORD.size
+                    rid = buf[offset:offset + rid_len].decode()
+                    offset += rid_len
+                    uid = buf[offset:offset + uid_len].decode()
+                    offset += uid_len
+                    pid = buf[offset:offset + pid_len].decode()
+                    offset += pid_len
+                    cid = buf[offset:offset + cid_len].decode() or None
+                    offset += cid_len
+                    records[rid] = {
+                        "reservation_id": rid,
+                        "user_id": uid,
+                        "product_id": pid,
+                        "quantity": quantity,
+                        "created_at": created,
+                        "expires_at": expires,
+                        "unit_price": price,
+                        "cart_id": cid,
+                    }
+                return records
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+class ReservationJournal:
+    def __init__(self, directory: str, group_commit_ms: float):
+        self.directory = directory
+        self.group_commit = group_commit_ms / 1000
+        self.generation = 0
+        self._file = None
+        # (line, future) pairs or (_ROTATE, (generation, first line)) markers
+        self._queue: List[Tuple[Any, Any]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._uncertain: Set[str] = set()
+        # reservation id -> order of an open commit pending
+        self._orders: Dict[str, Dict[str, Any]] = {}
+
+        self.records_written = 0
+        self.fsyncs = 0
+        self.snapshots = 0
+        self.last_snapshot_ms = 0.0
+
+    # ---------- recovery ----------
+
+    def _generations(self) -> Tuple[List[int], List[int]]:
+        snapshots, journals = [], []
+        if not os.path.isdir(self.directory):
+            return snapshots, journals
+        for name in os.listdir(self.directory):
+            match = _FILE_RE.match(name)
+            if match:
+                kind, gen = match.group(1), int(match.group(2))
+                (snapshots if kind == "snapshot" else journals).append(gen)
+        return sorted(snapshots), sorted(journals)
+
+    def _path(self, kind: str, generation: int) -> str:
+        ext = "bin" if kind == "snapshot" else "log"
+        return os.path.join(self.directory, f"{kind}-{generation:08d}.{ext}")
+
+    def recover(
+        self,
+    ) -> Optional[Tuple[Dict[str, Dict[str, Any]], Set[str], Dict[str, Dict[str, Any]]]]:
+        """
+        Rebuild the store from disk. Returns (records by reservation id,
+        ids left pending by a crash, orders of unfinished commits by
+        reservation id), or None when there is nothing to load.
+        """
+        snapshots, journals = self._generations()
+        if not snapshots and not journals:
+            return None
+        # Whatever happens below, the next generation must be newer than every
+        # file on disk, so start() never appends to a stale journal
+        self.generation = max(snapshots + journals)
+
+        records: Dict[str, Dict[str, Any]] = {}
+        base = None
+        for gen in reversed(snapshots):
+            loaded = decode_snapshot(self._path("snapshot", gen))
+            if loaded is not None:
+                records, base = loaded, gen
+                break
+        if base is None:
+            # Without a base snapshot the journals alone cannot be trusted
+            return None
+
+        uncertain: Set[str] = set()
+        orders: Dict[str, Dict[str, Any]] = {}
+        for gen in journals:
+            if gen < base:
+                continue
+            with open(self._path("journal", gen), "rb") as f:
+                for raw in f:
+                    try:
+                        entry = json.loads(raw)
+                    except ValueError:
+                        # Torn tail from a crash mid-write
+                        break
+                    op = entry.get("op")
+                    if op == "create":
+                        for r in entry["res"]:
+                            records[r["reservation_id"]] = r
+                    elif op == "pending":
+                        uncertain.update(entry["ids"])
+                        for order in entry.get("orders", ()):
+                            orders[order["reservation_id"]] = order
+                    elif op == "remove":
+                        for rid in entry["ids"]:
+                            records.pop(rid, None)
+                            uncertain.discard(rid)
+                            orders.pop(rid, None)
+
+        # A commit's hold may already be gone from the store; its order is not
+        uncertain &= records.keys()
+        return records, uncertain, orders
+
+    # ---------- writing ----------
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self, records: Iterable[Dict[str, Any]]):
+        """Write a fresh snapshot of the recovered state and open a new journal."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._wake = asyncio.Event()
+        self.generation += 1
+        self._file = open(self._path("journal", self.generation), "ab")
+        self._task = asyncio.create_task(self._run())
+        await self._write_snapshot(self.generation, encode_snapshot(records))
+
+    async def close(self, records: Iterable[Dict[str, Any]]):
+        """Take a final snapshot, flush outstanding records and stop."""
+        if self._task is None:
+            return
+        await self.snapshot(records)
+        # Barrier: resolves once everything queued before it is on disk
+        barrier = asyncio.get_running_loop().create_future()
+        self._queue.append((b"", barrier))
+        self._wake.set()
+        await barrier
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._file.close()
+        self._file = None
+
+    async def append(self, record: Dict[str, Any], durable: bool = True):
+        """
+        Queue one record. With durable=True, wait until the group fsync that
+        covers it has completed.
+        """
+        op = record["op"]
+        if op == "pending":
+            self._uncertain.update(record["ids"])
+            for order in record.get("orders", ()):
+                self._orders[order["reservation_id"]] = order
+        elif op == "remove":
+            self._uncertain.difference_update(record["ids"])
+            for rid in record["ids"]:
+                self._orders.pop(rid, None)
+
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        future = asyncio.get_running_loop().create_future() if durable else None
+        self._queue.append((line, future))
+        self._wake.set()
+        if future is not None:
+            await future
+
+    async def snapshot(self, records: Iterable[Dict[str, Any]]):
+        """
+        Snapshot the store and start a new generation. The store is serialized
+        and the journal switch is queued in the same event-loop step, so the
+        snapshot is exactly the state the new journal starts from.
+        """
+        data = encode_snapshot(records)
+        generation = self.generation + 1
+        self.generation = generation
+        first = b""
+        if self._uncertain:
+            carried: Dict[str, Any] = {"op": "pending", "ids": sorted(self._uncertain)}
+            if self._orders:
+                carried["orders"] = list(self._orders.values())
+            first = (json.dumps(carried, separators=(",", ":")) + "\n").encode()
+        self._queue.append((_ROTATE, (generation, first)))
+        self._wake.set()
+        await self._write_snapshot(generation, data)
+
+    async def _write_snapshot(self, generation: int, data: bytes):
+        started = asyncio.get_running_loop().time()
+        await asyncio.to_thread(self._write_snapshot_sync, generation, data)
+        self.snapshots += 1
+        self.last_snapshot_ms = (asyncio.get_running_loop().time() - started) * 1000
+
+    def _write_snapshot_sync(self, generation: int, data: bytes):
+        path = self._path("snapshot", generation)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        # The new snapshot is durable: every other generation is obsolete,
+        # including stale ones left behind by an unusable earlier recovery
+        snapshots, journals = self._generations()
+        for gen in snapshots:
+            if gen != generation:
+                os.remove(self._path("snapshot", gen))
+        for gen in journals:
+            if gen != generation:
+                os.remove(self._path("journal", gen))
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            # Group commit: let concurrent appends pile up, then fsync once
+            await asyncio.sleep(self.group_commit)
+
+            batch, self._queue = self._queue, []
+            chunks: List[bytes] = []
+            futures = []
+            for item, extra in batch:
+                if item is _ROTATE:
+                    await self._flush(chunks, futures)
+                    chunks, futures = [], []
+                    generation, first = extra
+                    await asyncio.to_thread(self._rotate_sync, generation, first)
+                    continue
+                chunks.append(item)
+                if extra is not None:
+                    futures.append(extra)
+            await self._flush(chunks, futures)
+
+    async def _flush(self, chunks: List[bytes], futures: list):
+        if not chunks:
+            return
+        try:
+            await asyncio.to_thread(self._write_sync, b"".join(chunks))
+        except Exception as e:
+            logger.exception("Reservation journal write failed")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.records_written += len(chunks)
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    def _write_sync(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+
+    def _rotate_sync(self, generation: int, first: bytes):
+        self._file.close()
+        self._file = open(self._path("journal", generation), "ab")
+        if first:
+            self._write_sync(first)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "records_written": self.records_written,
+            "fsyncs": self.fsyncs,
+            "snapshots": self.snapshots,
+            "last_snapshot_ms": round(self.last_snapshot_ms, 3),
+            "queued": len(self._queue),
+        }
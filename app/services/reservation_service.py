@@ -1,57 +1,359 @@
 import asyncio
-from typing import Dict, List
+import logging
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set
 from uuid import uuid4
 
 from fastapi import HTTPException
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from pymongo import ReturnDocument
+from datetime import datetime
+from pymongo import UpdateOne
 
-from app.schemas.reservation_schema import ReservationCreate
+from app.schemas.reservation_schema import ReservationCreate, CartReservationCreate
 from app.db.database import (
-    products_collection,
     reservations_collection,
     orders_collection,
 )
-from app.services.audit_service import log_event
-from app.utils.time_utils import now_utc
+from app.services.audit_service import build_event, log_event, log_events
+from app.services.batcher import KeyedBatcher
+from app.services.lock_manager import KeyedLockManager
+from app.services.expiry_index import ExpiryIndex
+from app.services import partitioning, stock_service
+from app.services.counters import counters
+from app.services.reservation_journal import (
+    ReservationJournal,
+    record_from_reservation,
+    reservation_fields,
+)
+from app.utils.time_utils import from_ms, now_ms, now_utc, to_ms
 from app.core.config import (
     RESERVATION_DEFAULT_TTL_MINUTES,
     RESERVATION_CLEANUP_INTERVAL_SECONDS,
+    RESERVATION_EXPIRY_BATCH_SIZE,
+    RESERVATION_EXPIRY_CONCURRENCY,
+    RESERVATION_MAX_ACTIVE_PER_USER,
+    RESERVATION_BATCH_WINDOW_MS,
+    RESERVATION_BATCH_MAX_SIZE,
+    PRODUCT_LOCK_STATS_MAX_KEYS,
+    RESERVATION_JOURNAL_DIR,
+    RESERVATION_JOURNAL_GROUP_COMMIT_MS,
+    RESERVATION_SNAPSHOT_INTERVAL_SECONDS,
 )
 
+logger = logging.getLogger(__name__)
+
+
+class ReservationInMemory:
+    """
+    One active hold, kept as small and cheap to build as possible: slotted,
+    product/user ids interned (a handful of distinct strings shared by
+    millions of holds) and timestamps as integer epoch milliseconds. No
+    validation happens here; payloads are validated by the request schemas
+    and datetimes only exist at the MongoDB/API boundary.
+
+    available_stock is only set on a freshly created hold: the product's
+    stock right after the reservation, as returned by the stock write. It is
+    never persisted.
+    """
+
+    __slots__ = (
+        "reservation_id",
+        "user_id",
+        "product_id",
+        "quantity",
+        "status",
+        "created_ms",
+        "expires_ms",
+        "unit_price",
+        "cart_id",
+        "available_stock",
+    )
+
+    def __init__(
+        self,
+        reservation_id: str,
+        user_id: str,
+        product_id: str,
+        quantity: int,
+        status: str,
+        created_ms: int,
+        expires_ms: int,
+        unit_price: float,
+        cart_id: Optional[str] = None,
+        available_stock: Optional[int] = None,
+    ):
+        self.reservation_id = reservation_id
+        self.user_id = sys.intern(user_id)
+        self.product_id = sys.intern(product_id)
+        self.quantity = quantity
+        self.status = status
+        self.created_ms = created_ms
+        self.expires_ms = expires_ms
+        self.unit_price = unit_price
+        self.cart_id = cart_id
+        self.available_stock = available_stock
 
-class ReservationInMemory(BaseModel):
-    reservation_id: str
-    user_id: str
-    product_id: str
-    quantity: int
-    status: str
-    created_at: datetime
-    expires_at: datetime
-    unit_price: float
+    @property
+    def created_at(self) -> datetime:
+        return from_ms(self.created_ms)
+
+    @property
+    def expires_at(self) -> datetime:
+        return from_ms(self.expires_ms)
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "ReservationInMemory":
+        return cls(
+            reservation_id=doc["reservation_id"],
+            user_id=doc["user_id"],
+            product_id=doc["product_id"],
+            quantity=doc["quantity"],
+            status=doc["status"],
+            created_ms=to_ms(doc["created_at"]),
+            expires_ms=to_ms(doc["expires_at"]),
+            unit_price=float(doc["unit_price"]),
+            cart_id=doc.get("cart_id"),
+        )
+
+    def to_document(self) -> dict:
+        return {
+            "reservation_id": self.reservation_id,
+            "user_id": self.user_id,
+            "product_id": self.product_id,
+            "quantity": self.quantity,
+            "status": self.status,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "unit_price": self.unit_price,
+            "cart_id": self.cart_id,
+        }
 
 
 reservation_store: Dict[str, ReservationInMemory] = {}
-reservation_lock = asyncio.Lock()
 
+# cart_id -> reservation ids created together by create_cart_reservation
+cart_store: Dict[str, List[str]] = {}
 
-async def create_reservation(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
-    async with reservation_lock:
-        product = await products_collection.find_one_and_update(
-            {
-                "product_id": payload.product_id,
-                "available_stock": {"$gte": payload.quantity},
-            },
-            {
-                "$inc": {
-                    "available_stock": -payload.quantity,
-                    "reserved_stock": payload.quantity,
-                }
-            },
-            return_document=ReturnDocument.AFTER,
+# Secondary indexes over reservation_store: user_id / product_id -> ids of
+# that user's / product's active holds. Maintained by _track and _untrack.
+user_index: Dict[str, Set[str]] = {}
+product_index: Dict[str, Set[str]] = {}
+
+# Holds a user is in the middle of creating (stock claimed, not yet tracked),
+# counted against RESERVATION_MAX_ACTIVE_PER_USER.
+_user_pending: Dict[str, int] = {}
+
+# Expiry-ordered view of reservation_store, so sweeps only touch holds that
+# are actually due instead of walking the whole store.
+expiry_index = ExpiryIndex()
+
+# One lock per product_id: reservations on different products never wait on
+# each other, while everything touching the same product stays serialized.
+product_locks = KeyedLockManager("product", PRODUCT_LOCK_STATS_MAX_KEYS)
+
+# Optional local write-ahead journal of reservation_store (see
+# reservation_journal.py); None when RESERVATION_JOURNAL_DIR is not set.
+reservation_journal: Optional[ReservationJournal] = (
+    ReservationJournal(RESERVATION_JOURNAL_DIR, RESERVATION_JOURNAL_GROUP_COMMIT_MS)
+    if RESERVATION_JOURNAL_DIR
+    else None
+)
+
+# Outcome of the last restore/rebuild of the store, shown in /metrics
+warm_restart_stats: Dict[str, Any] = {}
+
+# Set by expiration_worker while it runs: the event wakes it early and
+# _worker_wake_at is the time it currently intends to wake up on its own.
+_expiry_wakeup: Optional[asyncio.Event] = None
+_worker_wake_at: Optional[int] = None
+
+
+def _index_add(index: Dict[str, Set[str]], key: str, reservation_id: str):
+    ids = index.get(key)
+    if ids is None:
+        ids = index[key] = set()
+    ids.add(reservation_id)
+
+
+def _index_remove(index: Dict[str, Set[str]], key: str, reservation_id: str):
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(reservation_id)
+        if not ids:
+            del index[key]
+
+
+def _track(res: ReservationInMemory):
+    reservation_store[res.reservation_id] = res
+    _index_add(user_index, res.user_id, res.reservation_id)
+    _index_add(product_index, res.product_id, res.reservation_id)
+    expiry_index.push(res.reservation_id, res.expires_ms)
+    if _expiry_wakeup is not None and (
+        _worker_wake_at is None or res.expires_ms < _worker_wake_at
+    ):
+        _expiry_wakeup.set()
+
+
+def _untrack(reservation_id: str):
+    res = reservation_store.pop(reservation_id, None)
+    expiry_index.discard(reservation_id)
+    if res is None:
+        return
+    _index_remove(user_index, res.user_id, reservation_id)
+    _index_remove(product_index, res.product_id, reservation_id)
+    if res.cart_id is not None:
+        ids = cart_store.get(res.cart_id)
+        if ids is not None and not any(i in reservation_store for i in ids):
+            del cart_store[res.cart_id]
+
+
+@asynccontextmanager
+async def _user_slots(user_id: str, count: int):
+    """
+    Reserve room for `count` new holds under RESERVATION_MAX_ACTIVE_PER_USER
+    for the duration of a create. Holds still being created count too, so
+    concurrent requests from one user cannot overshoot the cap.
+    """
+    if RESERVATION_MAX_ACTIVE_PER_USER <= 0:
+        yield
+        return
+
+    pending = _user_pending.get(user_id, 0)
+    active = len(user_index.get(user_id, ()))
+    if active + pending + count > RESERVATION_MAX_ACTIVE_PER_USER:
+        raise HTTPException(
+            status_code=429,
+            detail=f"At most {RESERVATION_MAX_ACTIVE_PER_USER} active reservations per user",
+        )
+    _user_pending[user_id] = pending + count
+    try:
+        yield
+    finally:
+        remaining = _user_pending[user_id] - count
+        if remaining:
+            _user_pending[user_id] = remaining
+        else:
+            del _user_pending[user_id]
+
+
+async def _journal_created(reservations: List[ReservationInMemory]):
+    if reservation_journal is not None and reservation_journal.running:
+        await reservation_journal.append(
+            {"op": "create", "res": [record_from_reservation(r) for r in reservations]}
+        )
+
+
+async def _journal_pending(reservation_ids: List[str], order_docs: Optional[List[dict]] = None):
+    # Durable before the MongoDB writes, so a crash mid-way is detectable
+    if reservation_journal is not None and reservation_journal.running:
+        record: Dict[str, Any] = {"op": "pending", "ids": reservation_ids}
+        if order_docs:
+            record["orders"] = [
+                {**doc, "created_at": to_ms(doc["created_at"])} for doc in order_docs
+            ]
+        await reservation_journal.append(record)
+
+
+async def _journal_removed(reservation_ids: List[str]):
+    if reservation_journal is not None and reservation_journal.running:
+        await reservation_journal.append(
+            {"op": "remove", "ids": reservation_ids}, durable=False
         )
 
+
+async def _claim(reservation_id: str, status: str, extra: Optional[dict] = None) -> bool:
+    """
+    First write of every commit/cancel/expiry: move the reservation out of
+    "active" in MongoDB, conditionally. Once it has succeeded the hold is
+    done for good, so the writes that follow are never repeated by a retry.
+    """
+    result = await reservations_collection.update_one(
+        {"reservation_id": reservation_id, "status": "active"},
+        {"$set": {"status": status, **(extra or {})}},
+    )
+    return bool(result.matched_count)
+
+
+def _drop(reservations: List[ReservationInMemory], status: str):
+    for res in reservations:
+        res.status = status
+        _untrack(res.reservation_id)
+
+
+async def _finish(reservations: List[ReservationInMemory], status: str):
+    """Drop claimed (or no longer active) holds from memory and the journal."""
+    _drop(reservations, status)
+    await _journal_removed([res.reservation_id for res in reservations])
+
+
+async def _write_orders(order_docs: List[dict]):
+    """
+    Insert orders keyed on reservation_id: writing one that already exists
+    is a no-op, so replaying a commit never creates a second order.
+    """
+    await orders_collection.bulk_write(
+        [
+            UpdateOne({"reservation_id": doc["reservation_id"]}, {"$setOnInsert": doc}, upsert=True)
+            for doc in order_docs
+        ],
+        ordered=False,
+    )
+
+
+async def _commit_writes(quantities: Dict[str, int], order_docs: List[dict]):
+    """
+    The writes of a claimed commit, run concurrently once the holds are
+    dropped and the product locks released. The journal's pending record
+    (orders included) is only closed when both succeeded; otherwise the
+    orders are written at the next restore.
+    """
+    results = await asyncio.gather(
+        stock_service.commit(quantities),
+        _write_orders(order_docs),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    await _journal_removed([doc["reservation_id"] for doc in order_docs])
+
+
+async def _lost_claim(res: ReservationInMemory):
+    # MongoDB says this hold is no longer active: believe it
+    doc = await reservations_collection.find_one({"reservation_id": res.reservation_id})
+    await _finish([res], doc["status"] if doc else "unknown")
+    raise HTTPException(status_code=400, detail="Reservation not active")
+
+
+@asynccontextmanager
+async def _locked_reservation(reservation_id: str):
+    """
+    Resolve reservation_id to its product, take that product's lock and yield
+    the reservation, re-checking it is still live once the lock is held.
+    """
+    res = reservation_store.get(reservation_id)
+    if not res:
+        raise HTTPException(
+            status_code=404, detail="Reservation not active or already processed"
+        )
+
+    async with product_locks.hold(res.product_id):
+        if reservation_store.get(reservation_id) is not res:
+            raise HTTPException(
+                status_code=404, detail="Reservation not active or already processed"
+            )
+        yield res
+
+
+async def create_reservation(payload: ReservationCreate, user_id: str) -> ReservationInMemory:
+    if reservation_batcher is not None:
+        async with _user_slots(user_id, 1):
+            return await reservation_batcher.submit(payload.product_id, (payload, user_id))
+
+    async with _user_slots(user_id, 1), product_locks.hold(payload.product_id):
+        product = await stock_service.reserve(payload.product_id, payload.quantity)
+
         if not product:
             raise HTTPException(
                 status_code=400,
@@ -59,10 +361,10 @@ async def create_reservation(payload: ReservationCreate, user_id: str) -> Reserv
             )
 
         reservation_id = f"RES_{uuid4().hex[:8]}"
-        created_at = now_utc()
+        created_ms = now_ms()
 
         ttl_minutes = payload.ttl_minutes or RESERVATION_DEFAULT_TTL_MINUTES
-        expires_at = created_at + timedelta(minutes=ttl_minutes)
+        expires_ms = created_ms + ttl_minutes * 60_000
 
         unit_price = float(product["price"])
 
@@ -72,29 +374,138 @@ async def create_reservation(payload: ReservationCreate, user_id: str) -> Reserv
             product_id=payload.product_id,
             quantity=payload.quantity,
             status="active",
-            created_at=created_at,
-            expires_at=expires_at,
+            created_ms=created_ms,
+            expires_ms=expires_ms,
             unit_price=unit_price,
+            available_stock=product.get("available_stock"),
         )
 
-        reservation_store[reservation_id] = res
-        await reservations_collection.insert_one(res.model_dump())
+        await _journal_created([res])
+        try:
+            await reservations_collection.insert_one(res.to_document())
+        except Exception:
+            await stock_service.release({payload.product_id: payload.quantity})
+            await _journal_removed([reservation_id])
+            raise
+        _track(res)
+    counters.incr("reservations_created")
 
-        await log_event(
-            "reservation_created",
-            "reservation",
-            reservation_id,
-            user_id,
-            {"product_id": payload.product_id, "quantity": payload.quantity},
-        )
+    await log_event(
+        "reservation_created",
+        "reservation",
+        reservation_id,
+        user_id,
+        {"product_id": payload.product_id, "quantity": payload.quantity},
+    )
+    return res
 
-        return res
 
+def _grant_fifo(quantities: List[int], available: int) -> List[bool]:
+    """Serve requests in arrival order while stock lasts; skip any that do not fit."""
+    granted = []
+    for quantity in quantities:
+        ok = quantity <= available
+        if ok:
+            available -= quantity
+        granted.append(ok)
+    return granted
 
-async def get_reservation(reservation_id: str) -> ReservationInMemory:
-    async with reservation_lock:
-        res = reservation_store.get(reservation_id)
 
+async def _create_batch(product_id: str, requests: List[tuple]) -> List[Any]:
+    """
+    KeyedBatcher handler: reserve a window's worth of (payload, user_id)
+    requests for one product with one conditional $inc for the summed
+    quantity and one insert_many. If the sum does not fit, requests are
+    granted in FIFO order against the current stock and the rest get 400.
+    """
+    quantities = [payload.quantity for payload, _ in requests]
+    granted = [True] * len(requests)
+
+    async with product_locks.hold(product_id):
+        while True:
+            total = sum(q for q, ok in zip(quantities, granted) if ok)
+            if total == 0:
+                product = None
+                break
+            product = await stock_service.reserve(product_id, total)
+            if product is not None:
+                break
+            # Not enough for everyone (or stock moved under us): re-plan
+            # against what is actually there.
+            current = await stock_service.available(product_id)
+            if current is None:
+                granted = [False] * len(requests)
+            else:
+                granted = _grant_fifo(quantities, current)
+
+        results: List[Any] = []
+        reservations: List[ReservationInMemory] = []
+        if product is not None:
+            unit_price = float(product["price"])
+            created_ms = now_ms()
+
+        for (payload, user_id), ok in zip(requests, granted):
+            if not ok:
+                results.append(HTTPException(
+                    status_code=400,
+                    detail="Insufficient stock or product not found",
+                ))
+                continue
+            ttl_minutes = payload.ttl_minutes or RESERVATION_DEFAULT_TTL_MINUTES
+            res = ReservationInMemory(
+                reservation_id=f"RES_{uuid4().hex[:8]}",
+                user_id=user_id,
+                product_id=product_id,
+                quantity=payload.quantity,
+                status="active",
+                created_ms=created_ms,
+                expires_ms=created_ms + ttl_minutes * 60_000,
+                unit_price=unit_price,
+                available_stock=product.get("available_stock"),
+            )
+            reservations.append(res)
+            results.append(res)
+
+        if reservations:
+            await _journal_created(reservations)
+            try:
+                await reservations_collection.insert_many(
+                    [res.to_document() for res in reservations]
+                )
+            except Exception:
+                await stock_service.release({product_id: total})
+                await _journal_removed([res.reservation_id for res in reservations])
+                raise
+            for res in reservations:
+                _track(res)
+
+    if reservations:
+        counters.incr("reservations_created", len(reservations))
+        await log_events([
+            build_event(
+                "reservation_created",
+                "reservation",
+                res.reservation_id,
+                res.user_id,
+                {"product_id": product_id, "quantity": res.quantity},
+            )
+            for res in reservations
+        ])
+    return results
+
+
+# Per-product request coalescing for create_reservation; None when
+# RESERVATION_BATCH_WINDOW_MS is 0.
+reservation_batcher: Optional[KeyedBatcher] = (
+    KeyedBatcher(_create_batch, RESERVATION_BATCH_WINDOW_MS, RESERVATION_BATCH_MAX_SIZE)
+    if RESERVATION_BATCH_WINDOW_MS > 0
+    else None
+)
+
+
+async def get_reservation(reservation_id: str) -> ReservationInMemory:
+    # A plain dict read never yields to the event loop, so no lock is needed.
+    res = reservation_store.get(reservation_id)
     if res:
         return res
 
@@ -102,49 +513,42 @@ async def get_reservation(reservation_id: str) -> ReservationInMemory:
     if not doc:
         raise HTTPException(status_code=404, detail="Reservation not found")
 
-    return ReservationInMemory(**doc)
+    return ReservationInMemory.from_document(doc)
 
 
 async def get_user_active_reservations(user_id: str) -> List[ReservationInMemory]:
-    async with reservation_lock:
-        return [
-            r
-            for r in reservation_store.values()
-            if r.user_id == user_id and r.status == "active"
-        ]
+    return [reservation_store[i] for i in user_index.get(user_id, ())]
+
+
+async def get_product_active_reservations(product_id: str) -> List[ReservationInMemory]:
+    return [reservation_store[i] for i in product_index.get(product_id, ())]
 
 
 async def _restore_stock_for_reservation(res: ReservationInMemory):
-    await products_collection.update_one(
-        {"product_id": res.product_id},
-        {
-            "$inc": {
-                "reserved_stock": -res.quantity,
-                "available_stock": res.quantity,
-            }
-        },
-    )
+    await stock_service.release({res.product_id: res.quantity})
 
 
 async def commit_reservation(reservation_id: str, commit_payload) -> dict:
-    async with reservation_lock:
-        res = reservation_store.get(reservation_id)
-        if not res:
-            raise HTTPException(
-                status_code=404, detail="Reservation not active or already processed"
-            )
-
+    """
+    The reservation is claimed first (active -> committed, conditionally)
+    and the hold dropped under the product lock; the stock and order writes
+    then run together outside it. If one of them fails, a retry gets 404
+    instead of a second order: the order is journaled with the pending
+    record and written at the next restore (see _commit_writes).
+    """
+    async with _locked_reservation(reservation_id) as res:
         if res.status != "active":
             raise HTTPException(status_code=400, detail="Reservation not active")
 
-        if res.expires_at < now_utc():
-            await _restore_stock_for_reservation(res)
-            res.status = "expired"
-            reservation_store.pop(reservation_id, None)
-            await reservations_collection.update_one(
-                {"reservation_id": reservation_id},
-                {"$set": {"status": "expired"}},
-            )
+        if res.expires_ms < now_ms():
+            await _journal_pending([reservation_id])
+            if not await _claim(reservation_id, "expired"):
+                await _lost_claim(res)
+            try:
+                await _restore_stock_for_reservation(res)
+            finally:
+                await _finish([res], "expired")
+            counters.incr("reservations_expired")
             await log_event(
                 "reservation_expired_on_commit",
                 "reservation",
@@ -170,96 +574,491 @@ async def commit_reservation(reservation_id: str, commit_payload) -> dict:
             "created_at": now_utc(),
             "shipped_at": None,
         }
-        await orders_collection.insert_one(order_doc)
+        await _journal_pending([reservation_id], [order_doc])
+        if not await _claim(reservation_id, "committed", {"order_id": order_id}):
+            await _lost_claim(res)
+        _drop([res], "committed")
+
+    await _commit_writes({res.product_id: res.quantity}, [order_doc])
+    counters.incr("orders")
+
+    await log_event(
+        "order_committed",
+        "order",
+        order_id,
+        res.user_id,
+        {"reservation_id": reservation_id, "total_amount": total_amount},
+    )
+
+    return order_doc
+
+
+async def cancel_reservation(reservation_id: str, cancel_payload):
+    async with _locked_reservation(reservation_id) as res:
+        if res.status != "active":
+            raise HTTPException(status_code=400, detail="Reservation not active")
+
+        await _journal_pending([reservation_id])
+        if not await _claim(reservation_id, "cancelled", {"cancel_reason": cancel_payload.reason}):
+            await _lost_claim(res)
+        try:
+            await _restore_stock_for_reservation(res)
+        finally:
+            await _finish([res], "cancelled")
+    counters.incr("reservations_cancelled")
+
+    await log_event(
+        "reservation_cancelled",
+        "reservation",
+        reservation_id,
+        res.user_id,
+        {"reason": cancel_payload.reason},
+    )
 
-        await products_collection.update_one(
-            {"product_id": res.product_id},
-            {
-                "$inc": {
-                    "reserved_stock": -res.quantity,
-                    "total_stock": -res.quantity,
-                }
-            },
-        )
 
-        res.status = "committed"
-        reservation_store.pop(reservation_id, None)
-        await reservations_collection.update_one(
-            {"reservation_id": reservation_id},
-            {"$set": {"status": "committed"}},
+async def create_cart_reservation(
+    payload: CartReservationCreate, user_id: str, cart_id: Optional[str] = None
+) -> List[ReservationInMemory]:
+    """
+    Reserve every cart line or none of them. Lines for the same product are
+    merged. All product locks are taken up front (in sorted order), the
+    conditional stock updates run concurrently, and if any line fails the
+    lines that did succeed are released again. cart_id is only passed when
+    a partitioned cluster splits one cart over several workers.
+    """
+    quantities: Dict[str, int] = {}
+    for item in payload.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    async with _user_slots(user_id, len(quantities)), product_locks.hold_many(quantities):
+        products = await asyncio.gather(*(
+            stock_service.reserve(product_id, quantity)
+            for product_id, quantity in quantities.items()
+        ))
+        reserved = {
+            product_id: product
+            for product_id, product in zip(quantities, products)
+            if product is not None
+        }
+
+        if len(reserved) < len(quantities):
+            if reserved:
+                await stock_service.release({pid: quantities[pid] for pid in reserved})
+            failed = [pid for pid in quantities if pid not in reserved]
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient stock or product not found: {', '.join(failed)}",
+            )
+
+        cart_id = cart_id or f"CART_{uuid4().hex[:8]}"
+        created_ms = now_ms()
+        ttl_minutes = payload.ttl_minutes or RESERVATION_DEFAULT_TTL_MINUTES
+        expires_ms = created_ms + ttl_minutes * 60_000
+
+        reservations = [
+            ReservationInMemory(
+                reservation_id=f"RES_{uuid4().hex[:8]}",
+                user_id=user_id,
+                product_id=product_id,
+                quantity=quantity,
+                status="active",
+                created_ms=created_ms,
+                expires_ms=expires_ms,
+                unit_price=float(reserved[product_id]["price"]),
+                cart_id=cart_id,
+            )
+            for product_id, quantity in quantities.items()
+        ]
+
+        await _journal_created(reservations)
+        try:
+            await reservations_collection.insert_many(
+                [res.to_document() for res in reservations]
+            )
+        except Exception:
+            await stock_service.release(quantities)
+            await _journal_removed([res.reservation_id for res in reservations])
+            raise
+
+        cart_store[cart_id] = [res.reservation_id for res in reservations]
+        for res in reservations:
+            _track(res)
+    counters.incr("reservations_created", len(reservations))
+
+    await log_events([
+        build_event(
+            "reservation_created",
+            "reservation",
+            res.reservation_id,
+            user_id,
+            {"product_id": res.product_id, "quantity": res.quantity, "cart_id": cart_id},
         )
+        for res in reservations
+    ])
 
-        await log_event(
-            "order_committed",
-            "order",
-            order_id,
-            res.user_id,
-            {"reservation_id": reservation_id, "total_amount": total_amount},
+    return reservations
+
+
+def _cart_holds(reservation_ids: List[str], user_id: str) -> List[ReservationInMemory]:
+    reservations = [reservation_store.get(i) for i in reservation_ids]
+    if any(res is None for res in reservations):
+        raise HTTPException(
+            status_code=400,
+            detail="Some reservations in this cart are no longer active",
         )
+    if any(res.user_id != user_id for res in reservations):
+        raise HTTPException(status_code=403, detail="Not allowed to commit this cart")
+    return reservations
 
-        return order_doc
 
+async def check_cart(cart_id: str, user_id: str):
+    """
+    Raise the error commit_cart would give right now, without committing:
+    lets a cart spread over several workers be checked on all of them first.
+    """
+    reservation_ids = cart_store.get(cart_id)
+    if not reservation_ids:
+        raise HTTPException(status_code=404, detail="Cart not active or already processed")
+    now = now_ms()
+    if any(res.expires_ms < now for res in _cart_holds(reservation_ids, user_id)):
+        raise HTTPException(status_code=400, detail="Cart reservation expired")
 
-async def cancel_reservation(reservation_id: str, cancel_payload):
-    async with reservation_lock:
-        res = reservation_store.get(reservation_id)
-        if not res:
+
+async def commit_cart(cart_id: str, commit_payload, user_id: str) -> List[dict]:
+    """
+    Turn every reservation of a cart into an order: one update_many claiming
+    the reservations under the product locks (as in commit_reservation),
+    then, with the locks released, the stock bulk_write and the orders
+    bulk_write together.
+    """
+    reservation_ids = cart_store.get(cart_id)
+    if not reservation_ids:
+        raise HTTPException(status_code=404, detail="Cart not active or already processed")
+
+    product_ids = [
+        reservation_store[i].product_id for i in reservation_ids if i in reservation_store
+    ]
+    async with product_locks.hold_many(product_ids):
+        if cart_store.get(cart_id) is not reservation_ids:
             raise HTTPException(
-                status_code=404, detail="Reservation not active or already processed"
+                status_code=404, detail="Cart not active or already processed"
             )
+        reservations = _cart_holds(reservation_ids, user_id)
 
-        if res.status != "active":
-            raise HTTPException(status_code=400, detail="Reservation not active")
+        now = now_ms()
+        expired = [res for res in reservations if res.expires_ms < now]
+        if expired:
+            for res in expired:
+                _untrack(res.reservation_id)
+            await _expire_reservations(expired)
+            raise HTTPException(status_code=400, detail="Cart reservation expired")
+
+        order_docs = [
+            {
+                "order_id": f"ORD_{uuid4().hex[:8]}",
+                "reservation_id": res.reservation_id,
+                "user_id": res.user_id,
+                "product_id": res.product_id,
+                "quantity": res.quantity,
+                "unit_price": res.unit_price,
+                "total_amount": res.unit_price * res.quantity,
+                "status": "confirmed",
+                "payment_id": commit_payload.payment_id,
+                "shipping_address": commit_payload.shipping_address,
+                "cart_id": cart_id,
+                "created_at": from_ms(now),
+                "shipped_at": None,
+            }
+            for res in reservations
+        ]
+
+        await _journal_pending(reservation_ids, order_docs)
+        claim_id = uuid4().hex
+        claimed = await reservations_collection.update_many(
+            {"reservation_id": {"$in": reservation_ids}, "status": "active"},
+            {"$set": {"status": "committed", "cart_commit": claim_id}},
+        )
+        if claimed.matched_count < len(reservation_ids):
+            # Some holds are no longer active in MongoDB: give the rest back
+            await reservations_collection.update_many(
+                {"cart_commit": claim_id},
+                {"$set": {"status": "active"}, "$unset": {"cart_commit": ""}},
+            )
+            raise HTTPException(
+                status_code=400,
+                detail="Some reservations in this cart are no longer active",
+            )
+        _drop(reservations, "committed")
 
-        await _restore_stock_for_reservation(res)
-        res.status = "cancelled"
-        reservation_store.pop(reservation_id, None)
+    await _commit_writes({res.product_id: res.quantity for res in reservations}, order_docs)
+    counters.incr("orders", len(order_docs))
 
-        await reservations_collection.update_one(
-            {"reservation_id": reservation_id},
+    await log_events([
+        build_event(
+            "order_committed",
+            "order",
+            order["order_id"],
+            user_id,
             {
-                "$set": {
-                    "status": "cancelled",
-                    "cancel_reason": cancel_payload.reason,
-                }
+                "reservation_id": order["reservation_id"],
+                "total_amount": order["total_amount"],
+                "cart_id": cart_id,
             },
         )
+        for order in order_docs
+    ])
 
-        await log_event(
-            "reservation_cancelled",
-            "reservation",
-            reservation_id,
-            res.user_id,
-            {"reason": cancel_payload.reason},
-        )
+    return order_docs
 
 
 async def cleanup_expired_reservations():
-    now = now_utc()
+    due_by_product: Dict[str, List[ReservationInMemory]] = {}
+    for res_id in expiry_index.pop_due(now_ms()):
+        res = reservation_store.get(res_id)
+        if res and res.status == "active":
+            due_by_product.setdefault(res.product_id, []).append(res)
+
     to_expire: List[ReservationInMemory] = []
+    for product_id, due in due_by_product.items():
+        # Claim under the product lock so an in-flight commit/cancel on the
+        # same reservation either finishes first or sees it gone.
+        async with product_locks.hold(product_id):
+            for res in due:
+                if reservation_store.get(res.reservation_id) is res:
+                    _untrack(res.reservation_id)
+                    to_expire.append(res)
+
+    await _expire_reservations(to_expire)
+
 
-    async with reservation_lock:
-        for res_id, res in list(reservation_store.items()):
-            if res.status == "active" and res.expires_at < now:
-                to_expire.append(res)
-                reservation_store.pop(res_id, None)
+async def _expire_batch(batch: List[ReservationInMemory]):
+    """
+    Persist one batch of expirations in three round trips: one stock release
+    with a single $inc per product, one update_many over the reservation ids
+    and one insert_many of audit rows.
+    """
+    restore: Dict[str, int] = {}
+    for res in batch:
+        restore[res.product_id] = restore.get(res.product_id, 0) + res.quantity
+    reservation_ids = [res.reservation_id for res in batch]
 
-    for res in to_expire:
-        await _restore_stock_for_reservation(res)
-        await reservations_collection.update_one(
-            {"reservation_id": res.reservation_id},
+    await _journal_pending(reservation_ids)
+    await asyncio.gather(
+        stock_service.release(restore),
+        reservations_collection.update_many(
+            {"reservation_id": {"$in": reservation_ids}},
             {"$set": {"status": "expired"}},
-        )
-        await log_event(
+        ),
+    )
+    await _journal_removed(reservation_ids)
+    counters.incr("reservations_expired", len(batch))
+
+    await log_events([
+        build_event(
             "reservation_expired",
             "reservation",
             res.reservation_id,
             res.user_id,
             {"product_id": res.product_id, "quantity": res.quantity},
         )
+        for res in batch
+    ])
 
 
-async def expiration_worker():
+async def _expire_reservations(reservations: List[ReservationInMemory]):
+    """
+    Expire already-claimed reservations in batches of
+    RESERVATION_EXPIRY_BATCH_SIZE, with at most RESERVATION_EXPIRY_CONCURRENCY
+    batches in flight so a large backlog cannot flood the connection pool.
+    """
+    if not reservations:
+        return
+
+    semaphore = asyncio.Semaphore(RESERVATION_EXPIRY_CONCURRENCY)
+
+    async def run(batch: List[ReservationInMemory]):
+        async with semaphore:
+            await _expire_batch(batch)
+
+    await asyncio.gather(*(
+        run(reservations[i:i + RESERVATION_EXPIRY_BATCH_SIZE])
+        for i in range(0, len(reservations), RESERVATION_EXPIRY_BATCH_SIZE)
+    ))
+
+
+def _load_recovered(reservations, now: int) -> List[ReservationInMemory]:
+    """Put recovered holds back into the store; return those already past due."""
+    expired: List[ReservationInMemory] = []
+    for res in reservations:
+        if res.reservation_id in reservation_store:
+            continue
+        if not partitioning.is_local(res.product_id):
+            # Another worker of a partitioned cluster owns this product
+            continue
+        if res.expires_ms < now:
+            expired.append(res)
+            continue
+        if res.cart_id is not None:
+            cart_store.setdefault(res.cart_id, []).append(res.reservation_id)
+        _track(res)
+    return expired
+
+
+def _record_restore(source: str, loaded: int, expired: int, started: float) -> Dict[str, Any]:
+    warm_restart_stats.clear()
+    warm_restart_stats.update({
+        "source": source,
+        "loaded": loaded,
+        "expired": expired,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        "finished_at": now_utc(),
+    })
+    logger.info(
+        "Restored reservation store from %s: %d active, %d expired in %.1f ms",
+        source,
+        loaded,
+        expired,
+        warm_restart_stats["elapsed_ms"],
+    )
+    return dict(warm_restart_stats)
+
+
+async def rebuild_reservation_store() -> Dict[str, Any]:
+    """
+    Reload every active reservation from MongoDB into reservation_store after
+    a restart. Documents are streamed off the cursor; holds that ran out
+    while the process was down are expired in one batched pass.
+    """
+    started = time.perf_counter()
+    now = now_ms()
+    before = len(reservation_store)
+    expired: List[ReservationInMemory] = []
+
+    async for doc in reservations_collection.find({"status": "active"}):
+        expired += _load_recovered([ReservationInMemory.from_document(doc)], now)
+
+    await _expire_reservations(expired)
+    return _record_restore("mongo", len(reservation_store) - before, len(expired), started)
+
+
+async def _replay_orders(orders: Dict[str, Dict[str, Any]]):
+    """
+    Write the orders of commits that did not finish before the last
+    shutdown, for the reservations MongoDB shows as committed to them (the
+    others were never claimed). Orders already there are left alone.
+    """
+    replay = []
+    async for doc in reservations_collection.find(
+        {"reservation_id": {"$in": list(orders)}, "status": "committed"}
+    ):
+        order = orders[doc["reservation_id"]]
+        # Cart claims do not record the order_id on the reservation
+        if doc.get("order_id", order["order_id"]) == order["order_id"]:
+            replay.append({**order, "created_at": from_ms(order["created_at"])})
+    if replay:
+        logger.warning("Writing %d orders of interrupted commits", len(replay))
+        await _write_orders(replay)
+
+
+async def restore_reservation_store() -> Dict[str, Any]:
+    """
+    Startup entry point. With a journal configured, replay the local snapshot
+    and journal (falling back to MongoDB when there is nothing usable on
+    disk), then start journaling from a fresh snapshot. Without one, rebuild
+    from MongoDB.
+    """
+    if reservation_journal is None:
+        return await rebuild_reservation_store()
+
+    started = time.perf_counter()
+    recovered = await asyncio.to_thread(reservation_journal.recover)
+    if recovered is None:
+        stats = await rebuild_reservation_store()
+    else:
+        records, uncertain, orders = recovered
+        if orders:
+            await _replay_orders(orders)
+        if uncertain:
+            # Interrupted commits/cancels/expiries: MongoDB has the final word
+            async for doc in reservations_collection.find(
+                {"reservation_id": {"$in": list(uncertain)}}
+            ):
+                if doc.get("status") == "active":
+                    uncertain.discard(doc["reservation_id"])
+            for reservation_id in uncertain:
+                records.pop(reservation_id, None)
+
+        before = len(reservation_store)
+        expired = _load_recovered(
+            (ReservationInMemory(**reservation_fields(r)) for r in records.values()),
+            now_ms(),
+        )
+        await _expire_reservations(expired)
+        stats = _record_restore(
+            "journal", len(reservation_store) - before, len(expired), started
+        )
+
+    await reservation_journal.start(
+        record_from_reservation(r) for r in reservation_store.values()
+    )
+    return stats
+
+
+async def snapshot_worker():
+    """Periodically compact the journal into a fresh snapshot."""
     while True:
-        await asyncio.sleep(RESERVATION_CLEANUP_INTERVAL_SECONDS)
-        await cleanup_expired_reservations()
+        await asyncio.sleep(RESERVATION_SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await reservation_journal.snapshot(
+                record_from_reservation(r) for r in reservation_store.values()
+            )
+        except Exception:
+            logger.exception("Reservation snapshot failed")
+
+
+async def close_reservation_journal():
+    if reservation_journal is not None:
+        await reservation_journal.close(
+            record_from_reservation(r) for r in reservation_store.values()
+        )
+
+
+async def expiration_worker():
+    """
+    Sleep until the earliest pending expires_at (never longer than
+    RESERVATION_CLEANUP_INTERVAL_SECONDS), then expire whatever is due.
+    A reservation that expires sooner than the planned wake-up wakes the
+    worker early, so expired stock is freed within milliseconds.
+    """
+    global _expiry_wakeup, _worker_wake_at
+
+    _expiry_wakeup = asyncio.Event()
+    max_sleep = RESERVATION_CLEANUP_INTERVAL_SECONDS * 1000
+    try:
+        while True:
+            now = now_ms()
+            next_deadline = expiry_index.next_deadline()
+            if next_deadline is not None and next_deadline < now:
+                try:
+                    await cleanup_expired_reservations()
+                except Exception:
+                    logger.exception("Expiring reservations failed")
+                    await asyncio.sleep(1)
+                continue
+
+            wake_at = now + max_sleep
+            if next_deadline is not None and next_deadline < wake_at:
+                wake_at = next_deadline
+            _worker_wake_at = wake_at
+            _expiry_wakeup.clear()
+
+            # Never sleep less than a millisecond so a deadline that is due
+            # right now cannot turn this loop into a busy spin.
+            timeout = max((wake_at - now) / 1000, 0.001)
+            try:
+                await asyncio.wait_for(_expiry_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _expiry_wakeup = None
+        _worker_wake_at = None
@@ -0,0 +1,515 @@
+"""
+Every stock movement of a product goes through here, so reservations do not
+need to know how a product's stock is stored.
+
+By default a product's stock lives on its document as total_stock,
+available_stock and reserved_stock. A product can be switched to "striped"
+mode (PUT /products/{id}/stripes). Most of its available stock is then
+split over K documents in stock_buckets ({product_id, bucket,
+available_stock, price}), so concurrent reservations update different
+documents. Available stock is the product's own available_stock plus the
+sum of the buckets, and reserved stock is total_stock minus that, so
+neither has to be written on every reservation. A background rebalancer
+evens the buckets out again. It runs in one process at a time (the holder
+of the stock-rebalance lease) and parks the stock it moves in the source
+bucket's in_transit field until it has been handed out, so a rebalance cut
+short is finished by the next one instead of losing the stock.
+
+Because the product fields count in both modes, every write that touches
+only them (plain reserve and release, commit, stock added) is correct
+whatever mode the product is in, and other processes can write while the
+mode changes. The stock_stripes field of the product document is the only
+authority on the mode; which bucket writes a process tries first is a
+per-process hint. Switching modes keeps every unit accounted for:
+
+    plain -> striped   insert empty buckets, set the flag while taking the
+                       product's available_stock in the same update, then
+                       spread that stock over the buckets
+    striped -> plain   clear the flag, set reserved_stock to everything not
+                       available on the product itself (bucket stock
+                       included), then delete the buckets one by one,
+                       moving what each held back to available_stock
+"""
+import asyncio
+import contextlib
+import logging
+import random
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+
+from app.db.database import products_collection, stock_buckets_collection
+from app.services.catalog_cache import catalog_cache
+from app.services.leader_lease import LeaderLease
+from app.core.config import (
+    EXPIRY_LEASE_HEARTBEAT_SECONDS,
+    EXPIRY_LEASE_TTL_SECONDS,
+    STOCK_REBALANCE_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# product_id -> number of stock buckets, for the products striped as far as
+# this process knows. Only decides whether reserve/release try the buckets
+# first: a stale entry costs a retry, never stock. Reloaded by
+# stock_rebalancer.
+striped_products: Dict[str, int] = {}
+
+rebalance_stats = {"runs": 0, "moved": 0}
+
+rebalance_lease = LeaderLease(
+    "stock-rebalance", EXPIRY_LEASE_TTL_SECONDS, EXPIRY_LEASE_HEARTBEAT_SECONDS
+)
+
+
+async def load_striped_products():
+    found = {}
+    async for doc in products_collection.find({"stock_stripes": {"$gte": 2}}):
+        found[doc["product_id"]] = doc["stock_stripes"]
+    striped_products.clear()
+    striped_products.update(found)
+
+
+async def _buckets(product_id: str) -> List[dict]:
+    return await stock_buckets_collection.find({"product_id": product_id}).to_list(length=None)
+
+
+async def _bucket_totals(product_ids: List[str]) -> Dict[str, int]:
+    """Available stock summed over the buckets of each product, in one query."""
+    cursor = stock_buckets_collection.aggregate([
+        {"$match": {"product_id": {"$in": product_ids}}},
+        {"$group": {"_id": "$product_id", "available": {"$sum": "$available_stock"}}},
+    ])
+    return {doc["_id"]: doc["available"] async for doc in cursor}
+
+
+def _summed(doc: dict, in_buckets: int) -> dict:
+    available = doc.get("available_stock", 0) + in_buckets
+    return {
+        **doc,
+        "available_stock": available,
+        "reserved_stock": doc["total_stock"] - available,
+    }
+
+
+async def with_stock(doc: dict) -> dict:
+    """Product document with available/reserved stock summed over its buckets."""
+    if not doc.get("stock_stripes"):
+        return doc
+    totals = await _bucket_totals([doc["product_id"]])
+    return _summed(doc, totals.get(doc["product_id"], 0))
+
+
+async def with_stock_many(docs: List[dict]) -> List[dict]:
+    """with_stock for a page of documents, with one query for all their buckets."""
+    striped = [d["product_id"] for d in docs if d.get("stock_stripes")]
+    if not striped:
+        return docs
+    totals = await _bucket_totals(striped)
+    return [
+        _summed(d, totals.get(d["product_id"], 0)) if d.get("stock_stripes") else d
+        for d in docs
+    ]
+
+
+async def available(product_id: str) -> Optional[int]:
+    doc = await products_collection.find_one(
+        {"product_id": product_id},
+        {"available_stock": 1, "total_stock": 1, "stock_stripes": 1, "_id": 0},
+    )
+    if doc is None:
+        return None
+    return (await with_stock({**doc, "product_id": product_id}))["available_stock"]
+
+
+async def reserve(product_id: str, quantity: int) -> Optional[dict]:
+    """
+    Move quantity from available to reserved. Returns the product document
+    (at least its price), or None when the product does not exist or has
+    too little stock. Its available_stock is the stock left right after this
+    write, or None when it came from a bucket (the figure would need a read
+    of every bucket).
+    """
+    if product_id in striped_products:
+        product = await _reserve_striped(product_id, quantity)
+        if product is not None:
+            return product
+
+    product = await products_collection.find_one_and_update(
+        {"product_id": product_id, "available_stock": {"$gte": quantity}},
+        {"$inc": {"available_stock": -quantity, "reserved_stock": quantity}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if product is not None:
+        if product.get("stock_stripes"):
+            # Only part of its stock: the rest is in the buckets
+            catalog_cache.bump(product_id)
+            product["available_stock"] = None
+        else:
+            catalog_cache.bump(product_id, product)
+        return product
+
+    # Too little stock, or striped by another process since the last reload
+    if product_id in striped_products:
+        return None
+    doc = await products_collection.find_one(
+        {"product_id": product_id}, {"stock_stripes": 1, "_id": 0}
+    )
+    if doc is None or not doc.get("stock_stripes"):
+        return None
+    striped_products[product_id] = doc["stock_stripes"]
+    return await _reserve_striped(product_id, quantity)
+
+
+async def _reserved_from(product_id: str, bucket: dict) -> dict:
+    catalog_cache.bump(product_id)
+    if "price" not in bucket:
+        # Bucket written before buckets carried the price
+        bucket = await products_collection.find_one({"product_id": product_id})
+    return {"product_id": product_id, "price": bucket["price"], "available_stock": None}
+
+
+async def _reserve_striped(product_id: str, quantity: int) -> Optional[dict]:
+    # Start at a random bucket and walk to the neighbours when it runs dry.
+    # Buckets carry the price, so the product document is not read.
+    stripes = striped_products[product_id]
+    start = random.randrange(stripes)
+    for i in range(stripes):
+        bucket = await stock_buckets_collection.find_one_and_update(
+            {
+                "product_id": product_id,
+                "bucket": (start + i) % stripes,
+                "available_stock": {"$gte": quantity},
+            },
+            {"$inc": {"available_stock": -quantity}},
+        )
+        if bucket is not None:
+            return await _reserved_from(product_id, bucket)
+
+    # No single bucket holds enough: take it piecewise, or undo and fail
+    last = await _take_from_buckets(product_id, quantity)
+    return await _reserved_from(product_id, last) if last is not None else None
+
+
+async def _take_from_buckets(product_id: str, quantity: int) -> Optional[dict]:
+    """
+    Take quantity from the buckets with conditional decrements, richest
+    first. Returns the last bucket written, or None (having put back what
+    was taken) when they do not hold enough.
+    """
+    taken = 0
+    for bucket in sorted(await _buckets(product_id), key=lambda b: -b["available_stock"]):
+        take = min(quantity - taken, bucket["available_stock"])
+        if take <= 0:
+            continue
+        done = await stock_buckets_collection.find_one_and_update(
+            {
+                "product_id": product_id,
+                "bucket": bucket["bucket"],
+                "available_stock": {"$gte": take},
+            },
+            {"$inc": {"available_stock": -take}},
+        )
+        if done is not None:
+            taken += take
+            if taken == quantity:
+                return done
+    if taken:
+        await _release_one(product_id, taken)
+    return None
+
+
+def _released(quantity: int) -> dict:
+    return {"$inc": {"reserved_stock": -quantity, "available_stock": quantity}}
+
+
+async def _release_one(product_id: str, quantity: int):
+    """
+    Put stock back into a bucket, or onto the product when it has none left
+    (switched to plain meanwhile: see the module docstring).
+    """
+    bucket = random.randrange(striped_products.get(product_id, 1))
+    for query in ({"product_id": product_id, "bucket": bucket}, {"product_id": product_id}):
+        result = await stock_buckets_collection.update_one(
+            query, {"$inc": {"available_stock": quantity}}
+        )
+        if result.matched_count:
+            return
+    await products_collection.update_one({"product_id": product_id}, _released(quantity))
+
+
+async def release(quantities: Dict[str, int]):
+    """Return reserved stock to available (cancel, expiry, rollback)."""
+    plain = [
+        UpdateOne({"product_id": product_id}, _released(quantity))
+        for product_id, quantity in quantities.items()
+        if product_id not in striped_products
+    ]
+    await asyncio.gather(
+        *([products_collection.bulk_write(plain, ordered=False)] if plain else []),
+        *(
+            _release_one(product_id, quantity)
+            for product_id, quantity in quantities.items()
+            if product_id in striped_products
+        ),
+    )
+    for product_id in quantities:
+        catalog_cache.bump(product_id)
+
+
+async def commit(quantities: Dict[str, int]):
+    """Reserved stock leaves the warehouse (order committed)."""
+    await products_collection.bulk_write(
+        [
+            UpdateOne(
+                {"product_id": product_id},
+                {"$inc": {"reserved_stock": -quantity, "total_stock": -quantity}},
+            )
+            for product_id, quantity in quantities.items()
+        ],
+        ordered=False,
+    )
+    for product_id in quantities:
+        catalog_cache.bump(product_id)
+
+
+async def adjust(product_id: str, change: int) -> Optional[dict]:
+    """
+    Admin stock correction; returns the updated product with summed stock.
+    Only available stock can be removed (400 otherwise).
+    """
+    query = {"product_id": product_id}
+    if change < 0:
+        query["available_stock"] = {"$gte": -change}
+    updated = await products_collection.find_one_and_update(
+        query,
+        {"$inc": {"total_stock": change, "available_stock": change}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        product = await products_collection.find_one({"product_id": product_id})
+        if product is None:
+            return None
+        # More than the product document holds itself: take it from the
+        # buckets instead. reserved_stock moves along so the figures also
+        # add up if the product is being switched to plain meanwhile.
+        if not product.get("stock_stripes") or await _take_from_buckets(product_id, -change) is None:
+            raise HTTPException(status_code=400, detail="Not enough available stock to remove")
+        updated = await products_collection.find_one_and_update(
+            {"product_id": product_id},
+            {"$inc": {"total_stock": change, "reserved_stock": change}},
+            return_document=ReturnDocument.AFTER,
+        )
+    return await with_stock(updated)
+
+
+async def _stripe(product: dict, stripes: int):
+    product_id = product["product_id"]
+    await stock_buckets_collection.insert_many([
+        {"product_id": product_id, "bucket": i, "available_stock": 0, "price": product["price"]}
+        for i in range(stripes)
+    ])
+    before = await products_collection.find_one_and_update(
+        {"product_id": product_id, "stock_stripes": {"$exists": False}},
+        {"$set": {"stock_stripes": stripes, "available_stock": 0}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        # Striped concurrently by another process
+        return
+    striped_products[product_id] = stripes
+    share, extra = divmod(before["available_stock"], stripes)
+    await stock_buckets_collection.bulk_write(
+        [
+            UpdateOne(
+                {"product_id": product_id, "bucket": i},
+                {"$inc": {"available_stock": share + (1 if i < extra else 0)}},
+            )
+            for i in range(stripes)
+        ],
+        ordered=False,
+    )
+
+
+async def _unstripe(product_id: str):
+    before = await products_collection.find_one_and_update(
+        {"product_id": product_id, "stock_stripes": {"$exists": True}},
+        {"$unset": {"stock_stripes": ""}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    striped_products.pop(product_id, None)
+    if before is None:
+        return
+    # reserved_stock = total - available as of the flip, bucket stock
+    # included until it is drained. $inc keeps concurrent writes intact.
+    correction = (
+        before["total_stock"] - before["available_stock"] - before.get("reserved_stock", 0)
+    )
+    await products_collection.update_one(
+        {"product_id": product_id}, {"$inc": {"reserved_stock": correction}}
+    )
+    for bucket in await _buckets(product_id):
+        drained = await stock_buckets_collection.find_one_and_delete(
+            {"product_id": product_id, "bucket": bucket["bucket"]}
+        )
+        # Stock a rebalance was moving out of the bucket goes back with it
+        left = drained["available_stock"] + drained.get("in_transit", 0) if drained else 0
+        if left:
+            await products_collection.update_one({"product_id": product_id}, _released(left))
+
+
+async def set_stripes(product_id: str, stripes: int) -> Optional[dict]:
+    """
+    Switch a product between plain (stripes=1) and striped stock, or change
+    its number of buckets. Safe against concurrent stock writes from any
+    process (see the module docstring).
+    """
+    product = await products_collection.find_one({"product_id": product_id})
+    if product is None:
+        return None
+    if stripes != product.get("stock_stripes", 1):
+        if product.get("stock_stripes"):
+            await _unstripe(product_id)
+        if stripes > 1:
+            await _stripe(product, stripes)
+        catalog_cache.invalidate(product_id)
+        product = await products_collection.find_one({"product_id": product_id})
+    return await with_stock(product)
+
+
+async def _land_in_transit(product_id: str):
+    """Put stock parked by an interrupted rebalance back into its bucket."""
+    async for bucket in stock_buckets_collection.find(
+        {"product_id": product_id, "in_transit": {"$gt": 0}}
+    ):
+        parked = bucket["in_transit"]
+        await stock_buckets_collection.update_one(
+            {"_id": bucket["_id"], "in_transit": parked},
+            {"$inc": {"available_stock": parked, "in_transit": -parked}},
+        )
+
+
+async def rebalance(product_id: str) -> int:
+    """
+    Even out one product's buckets. Surplus is taken from rich buckets with
+    conditional decrements (so concurrent reservations are never overdrawn)
+    that park it in the bucket's in_transit field, then handed to the
+    poorest buckets in one ordered bulk_write together with clearing
+    in_transit. Returns the units moved. Only one process may rebalance a
+    product at a time (stock_rebalancer holds the lease).
+    """
+    await _land_in_transit(product_id)
+
+    # Stock added to a striped product lands on its document: hand it out
+    added = await products_collection.find_one_and_update(
+        {"product_id": product_id, "stock_stripes": {"$exists": True}, "available_stock": {"$gt": 0}},
+        {"$set": {"available_stock": 0}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if added is not None:
+        await _release_one(product_id, added["available_stock"])
+
+    buckets = await _buckets(product_id)
+    if len(buckets) < 2:
+        return 0
+    total = sum(b["available_stock"] for b in buckets)
+    target = total // len(buckets)
+    # Only bother once some bucket has fallen below half its fair share
+    if all(b["available_stock"] * 2 >= target for b in buckets):
+        return 0
+
+    taken: Dict[int, int] = {}
+    for b in buckets:
+        surplus = b["available_stock"] - target
+        if surplus <= 0:
+            continue
+        done = await stock_buckets_collection.find_one_and_update(
+            {
+                "product_id": product_id,
+                "bucket": b["bucket"],
+                "available_stock": {"$gte": surplus},
+            },
+            {"$inc": {"available_stock": -surplus, "in_transit": surplus}},
+        )
+        if done is not None:
+            taken[b["bucket"]] = surplus
+    moved = sum(taken.values())
+    if not moved:
+        return 0
+
+    # Fill the poorest buckets up to the target; rounding leftovers go to
+    # the poorest one.
+    gives: Dict[int, int] = {}
+    remaining = moved
+    for b in sorted(buckets, key=lambda b: b["available_stock"]):
+        give = min(remaining, target - b["available_stock"])
+        if give <= 0:
+            break
+        gives[b["bucket"]] = give
+        remaining -= give
+    if remaining:
+        poorest = min(buckets, key=lambda b: b["available_stock"])["bucket"]
+        gives[poorest] = gives.get(poorest, 0) + remaining
+
+    # in_transit is cleared first: a batch cut short by MongoDB can then
+    # strand stock, but never hand it out twice
+    result = await stock_buckets_collection.bulk_write(
+        [
+            UpdateOne(
+                {"product_id": product_id, "bucket": bucket},
+                {"$inc": {"in_transit": -quantity}},
+            )
+            for bucket, quantity in taken.items()
+        ]
+        + [
+            UpdateOne(
+                {"product_id": product_id, "bucket": bucket},
+                {"$inc": {"available_stock": quantity}},
+            )
+            for bucket, quantity in gives.items()
+        ],
+        ordered=True,
+    )
+    if result.matched_count < len(taken) + len(gives):
+        # Switched to plain while rebalancing: some buckets were drained
+        logger.warning("Rebalancing %s raced a switch to plain stock", product_id)
+    return moved
+
+
+async def stock_rebalancer():
+    """
+    Refresh the striped-product map in every process; rebalance every
+    striped product only while holding the stock-rebalance lease.
+    """
+    heartbeat = asyncio.create_task(rebalance_lease.run())
+    try:
+        while True:
+            await asyncio.sleep(STOCK_REBALANCE_INTERVAL_SECONDS)
+            try:
+                await load_striped_products()
+                if not rebalance_lease.is_leader:
+                    continue
+                for product_id in list(striped_products):
+                    if not rebalance_lease.is_leader:
+                        break
+                    rebalance_stats["moved"] += await rebalance(product_id)
+                rebalance_stats["runs"] += 1
+            except Exception:
+                logger.exception("Stock rebalance failed")
+    finally:
+        heartbeat.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await heartbeat
+        try:
+            await rebalance_lease.release()
+        except Exception:
+            logger.exception("Releasing the stock-rebalance lease failed")
+
+
+def stats() -> dict:
+    return {
+        "striped_products": dict(striped_products),
+        **rebalance_stats,
+        "lease": rebalance_lease.stats(),
+    }
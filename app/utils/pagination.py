@@ -0,0 +1,125 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+
+# Sort specification as passed to Motor's .sort(): [(field, 1 | -1), ...].
+# The last field must be unique (normally _id) so every position is exact.
+SortSpec = List[Tuple[str, int]]
+
+STREAM_BATCH_SIZE = 500
+
+_CURSOR_JSON_OPTIONS = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+# What a sort key can hold. Cursors come from clients and their values go
+# into the query, so anything else (e.g. {"$ne": null}) is refused.
+_CURSOR_VALUE_TYPES = (str, int, float, bool, type(None), datetime, ObjectId)
+
+
+def encode_cursor(doc: Dict[str, Any], sort: SortSpec) -> str:
+    """Opaque cursor pointing just past doc in the given sort order."""
+    values = {field: doc.get(field) for field, _ in sort}
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: SortSpec) -> List[Any]:
+    """The cursor's values in sort order; 400 unless it fits the sort spec."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json_util.loads(
+            base64.urlsafe_b64decode(padded.encode()), json_options=_CURSOR_JSON_OPTIONS
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    fields = [field for field, _ in sort]
+    if (
+        not isinstance(values, dict)
+        or sorted(values) != sorted(fields)
+        or not all(isinstance(v, _CURSOR_VALUE_TYPES) for v in values.values())
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return [values[field] for field in fields]
+
+
+def apply_cursor(query: Dict[str, Any], sort: SortSpec, cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Restrict query to documents strictly after the cursor position, e.g. for
+    [(created_at, -1), (_id, -1)]:
+        created_at < c  OR  (created_at == c AND _id < i)
+    Both forms are answered by an index on the sort keys.
+    """
+    if not cursor:
+        return query
+
+    values = decode_cursor(cursor, sort)
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        clauses.append(clause)
+
+    keyset = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    if not query:
+        return keyset
+    return {"$and": [query, keyset]}
+
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    sort: SortSpec,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of documents and the cursor for the next page (or None)."""
+    docs = (
+        await collection.find(apply_cursor(query, sort, cursor))
+        .sort(sort)
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1], sort)
+
+
+async def stream_ndjson(
+    collection,
+    query: Dict[str, Any],
+    sort: SortSpec,
+    encode: Callable[[dict], str],
+    cursor: Optional[str] = None,
+    prepare: Optional[Callable[[dict], Awaitable[dict]]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yield one JSON line per document straight off the Motor cursor, so only
+    one driver batch is held in memory however large the result is.
+    prepare, if given, is awaited on each document before encoding.
+    """
+    docs = (
+        collection.find(apply_cursor(query, sort, cursor))
+        .sort(sort)
+        .batch_size(STREAM_BATCH_SIZE)
+    )
+    async for doc in docs:
+        if prepare is not None:
+            doc = await prepare(doc)
+        yield (encode(doc) + "\n").encode()
+
+
+def encode_document(doc: dict) -> str:
+    """JSON for a raw Mongo document (ObjectId and datetimes included)."""
+    if "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return json.dumps(doc, default=_json_default)
+
+
+def _json_default(value: Any):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
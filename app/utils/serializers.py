@@ -0,0 +1,135 @@
+"""
+Fast JSON responses for hot endpoints.
+
+A handler that returns pydantic models under response_model pays for
+validation twice: once when it builds the models and again when FastAPI
+checks them against response_model before encoding. A ResponseSerializer is
+compiled once from the response model into a plain function that copies the
+fields out of a record and coerces the numeric ones, as the model would.
+Values the plain coercions do not cover, such as 2.5 for an int field, send
+the record through the model instead, which accepts or rejects it exactly as
+the slow path does.
+The record can be a Mongo document, a ReservationInMemory or an already
+built model. orjson then turns the result straight into bytes, and the
+Response skips FastAPI's response_model handling altogether. The JSON is
+the same as the model would produce.
+
+Each router creates its serializers with enabled=fast_json_enabled(<name>),
+so the fast path is switched on per router through FAST_JSON_ROUTERS. When
+it is off, response() builds the models and hands them to FastAPI as
+before.
+"""
+from typing import Any, Callable, Dict, Optional, Type, Union, get_args, get_origin
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from app.core.config import FAST_JSON_ROUTERS
+
+# Timezone-aware UTC datetimes end in "Z", as pydantic writes them
+_ORJSON_OPTIONS = orjson.OPT_UTC_Z
+
+
+def fast_json_enabled(router_name: str) -> bool:
+    return router_name in FAST_JSON_ROUTERS
+
+
+def _optional(convert: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    return lambda value: None if value is None else convert(value)
+
+
+def _to_int(value: Any) -> int:
+    # int() would truncate 2.5; pydantic only takes floats without a fraction
+    if type(value) is int:
+        return value
+    if type(value) is float and value.is_integer():
+        return int(value)
+    raise ValueError(f"{value!r} needs the model to coerce it to int")
+
+
+def _coercion(annotation: Any) -> Optional[str]:
+    """Name of the converter that gives a stored value this field's type."""
+    optional = False
+    if get_origin(annotation) is Union:
+        args = [a for a in get_args(annotation) if a is not type(None)]
+        optional = len(args) < len(get_args(annotation))
+        annotation = args[0] if len(args) == 1 else None
+    if annotation in (int, float):
+        return ("opt_" if optional else "") + "to_" + annotation.__name__
+    return None
+
+
+def _compile(model: Type[BaseModel], from_dict: bool) -> Callable[[Any], Dict[str, Any]]:
+    """Generate `def to_dict(r): return {field: r[field], ...}` for model."""
+    namespace: Dict[str, Any] = {
+        "to_int": _to_int,
+        "opt_to_int": _optional(_to_int),
+        "to_float": float,
+        "opt_to_float": _optional(float),
+    }
+    lines = []
+    for name, field in model.model_fields.items():
+        if field.is_required():
+            value = f"r[{name!r}]" if from_dict else f"r.{name}"
+        else:
+            namespace[f"default_{name}"] = field.default
+            value = (
+                f"r.get({name!r}, default_{name})"
+                if from_dict
+                else f"getattr(r, {name!r}, default_{name})"
+            )
+        coerce = _coercion(field.annotation)
+        if coerce:
+            value = f"{coerce}({value})"
+        lines.append(f"        {name!r}: {value},")
+    source = "def to_dict(r):\n    return {\n" + "\n".join(lines) + "\n    }\n"
+    exec(source, namespace)
+    return namespace["to_dict"]
+
+
+class ResponseSerializer:
+    def __init__(self, model: Type[BaseModel], enabled: bool):
+        self.model = model
+        self.enabled = enabled
+        self._from_dict = _compile(model, from_dict=True)
+        self._from_attrs = _compile(model, from_dict=False)
+
+    def to_dict(self, record: Any) -> Dict[str, Any]:
+        from_dict = isinstance(record, dict)
+        try:
+            return self._from_dict(record) if from_dict else self._from_attrs(record)
+        except ValueError:
+            # Raises the model's ValidationError if the model rejects it too
+            model = self.model.model_validate(record, from_attributes=not from_dict)
+            return model.model_dump()
+
+    def dumps(self, content: Any) -> bytes:
+        """JSON bytes for one record or a list of them."""
+        if isinstance(content, list):
+            data = [self.to_dict(record) for record in content]
+        else:
+            data = self.to_dict(content)
+        return orjson.dumps(data, option=_ORJSON_OPTIONS)
+
+    def _model(self, record: Any) -> BaseModel:
+        if isinstance(record, self.model):
+            return record
+        return self.model(**self.to_dict(record))
+
+    def response(self, content: Any, headers: Optional[Dict[str, str]] = None, **overrides):
+        """
+        What the handler returns for one record or a list of them. overrides
+        replace fields of every record (e.g. a value computed by the route).
+        On the fast path this is the encoded Response, which carries its own
+        headers; otherwise the models, for FastAPI's response_model handling.
+        """
+        if overrides and isinstance(content, list):
+            content = [{**self.to_dict(record), **overrides} for record in content]
+        elif overrides:
+            content = {**self.to_dict(content), **overrides}
+        if self.enabled:
+            return Response(self.dumps(content), media_type="application/json", headers=headers)
+        if isinstance(content, list):
+            return [self._model(record) for record in content]
+        return self._model(content)
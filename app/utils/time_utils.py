@@ -1,4 +1,26 @@
+import time
 from datetime import datetime, timezone
 
+
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    """MongoDB hands datetimes back naive; they are always UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def now_ms() -> int:
+    """Current time as integer epoch milliseconds (MongoDB's own precision)."""
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(value: datetime) -> int:
+    return int(as_utc(value).timestamp() * 1000)
+
+
+def from_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
@@ -0,0 +1,138 @@
+"""
+Reservation latency during a burst of logins.
+
+Fires LOGINS concurrent POST /auth/login requests while a steady stream of
+POST /reservations/ requests goes through the same app and event loop,
+both in process through httpx's ASGI transport. The reservations take the
+real path (auth, product lock, MongoDB stock update, hold), so their
+latency includes the time spent waiting for a loop busy with hashing.
+Compares verifying inline on the loop (the old login handler) with
+app.auth.passwords' thread pool. Needs MongoDB; it seeds a product and a
+user and removes them again, so point it at a scratch database:
+
+    MONGO_DB_NAME=login_burst python -m benchmarks.login_burst [--logins 500] [--rate 200]
+
+Reports reservation p50/p99/max latency, the time until every login was
+answered, and how many logins the pool refused with a 503 (more than
+PASSWORD_HASH_MAX_WAITING waiting).
+"""
+import argparse
+import asyncio
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from app.auth.auth_handler import sign_jwt
+from app.auth.passwords import pwd_context, verify_and_update
+from app.db import database
+from app.routes import auth_route
+from main import app
+
+EMAIL = "login-burst@bench.local"
+PRODUCT_ID = "BENCH_LOGIN_BURST"
+
+
+async def inline_verify(password: str, hashed: str):
+    return pwd_context.verify_and_update(password, hashed)
+
+
+async def seed(hashed: str):
+    await cleanup()
+    await database.users_collection.insert_one(
+        {"email": EMAIL, "password": hashed, "full_name": "Bench", "role": "user"}
+    )
+    await database.products_collection.insert_one({
+        "product_id": PRODUCT_ID,
+        "name": PRODUCT_ID,
+        "description": "login_burst benchmark",
+        "price": 1.0,
+        "total_stock": 1_000_000,
+        "available_stock": 1_000_000,
+        "reserved_stock": 0,
+    })
+
+
+async def cleanup():
+    await database.users_collection.delete_many({"email": EMAIL})
+    await database.products_collection.delete_many({"product_id": PRODUCT_ID})
+    await database.reservations_collection.delete_many({"product_id": PRODUCT_ID})
+
+
+async def reserve(client: AsyncClient, headers: dict, arrived: float, latencies: list):
+    response = await client.post(
+        "/reservations/",
+        json={"product_id": PRODUCT_ID, "quantity": 1, "ttl_minutes": 5},
+        headers=headers,
+    )
+    response.raise_for_status()
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def run(verify, logins: int, rate: int, hashed: str):
+    """
+    Reservations "arrive" on a fixed schedule whether or not the loop is
+    free to accept them (as they would from the network), and latency is
+    counted from that arrival time.
+    """
+    auth_route.verify_and_update = verify
+    await seed(hashed)
+    headers = {"Authorization": f"Bearer {sign_jwt(EMAIL, 'user')['access_token']}"}
+    credentials = {"email": EMAIL, "password": "secret"}
+    latencies: list = []
+    pending = set()
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Warm up the connection pool and the caches
+            await reserve(client, headers, time.perf_counter(), [])
+
+            started = time.perf_counter()
+            burst = asyncio.gather(
+                *(client.post("/auth/login", json=credentials) for _ in range(logins))
+            )
+            burst_done = None
+            sent = 0
+            while burst_done is None or pending:
+                now = time.perf_counter()
+                while burst_done is None and started + sent / rate <= now:
+                    arrived = started + sent / rate
+                    task = asyncio.create_task(reserve(client, headers, arrived, latencies))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    sent += 1
+                if burst_done is None and burst.done():
+                    burst_done = now - started
+                await asyncio.sleep(1 / rate)
+            refused = 0
+            for response in await burst:
+                if response.status_code == 503:
+                    refused += 1
+                else:
+                    response.raise_for_status()
+    finally:
+        await cleanup()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return p(0.5), p(0.99), latencies[-1] * 1000, burst_done, refused
+
+
+async def compare(logins: int, rate: int):
+    # One event loop for both runs: the MongoDB client stays bound to it
+    hashed = pwd_context.hash("secret")
+    print(f"{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>9} {'logins done s':>14} {'refused':>8}")
+    for name, verify in (("inline", inline_verify), ("pool", verify_and_update)):
+        p50, p99, worst, burst_done, refused = await run(verify, logins, rate, hashed)
+        print(f"{name:<8} {p50:>8.1f} {p99:>8.1f} {worst:>9.1f} {burst_done:>14.2f} {refused:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--rate", type=int, default=200, help="reservations per second")
+    args = parser.parse_args()
+    asyncio.run(compare(args.logins, args.rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Memory and construction cost of the in-memory reservation store.
+
+Compares the original pydantic ReservationInMemory (reproduced below as
+PydanticReservation) with the current slotted record:
+
+    python -m benchmarks.reservation_store [--count 200000]
+
+Reports bytes per stored reservation (tracemalloc, store dict included) and
+records built per second.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.services.reservation_service import ReservationInMemory
+from app.utils.time_utils import now_ms, now_utc
+
+PRODUCTS = 500
+USERS = 20000
+
+
+class PydanticReservation(BaseModel):
+    reservation_id: str
+    user_id: str
+    product_id: str
+    quantity: int
+    status: str
+    created_at: datetime
+    expires_at: datetime
+    unit_price: float
+    cart_id: Optional[str] = None
+
+
+def _ids(i: int):
+    # Built per call, like ids decoded from a request or a MongoDB document
+    return f"RES_{i:08x}", f"user{i % USERS}@test.com", f"PROD_{i % PRODUCTS}"
+
+
+def build_pydantic(i: int):
+    reservation_id, user_id, product_id = _ids(i)
+    created_at = now_utc()
+    return PydanticReservation(
+        reservation_id=reservation_id,
+        user_id=user_id,
+        product_id=product_id,
+        quantity=1,
+        status="active",
+        created_at=created_at,
+        expires_at=created_at + timedelta(minutes=10),
+        unit_price=10.0,
+    )
+
+
+def build_slotted(i: int):
+    reservation_id, user_id, product_id = _ids(i)
+    created_ms = now_ms()
+    return ReservationInMemory(
+        reservation_id=reservation_id,
+        user_id=user_id,
+        product_id=product_id,
+        quantity=1,
+        status="active",
+        created_ms=created_ms,
+        expires_ms=created_ms + 600_000,
+        unit_price=10.0,
+    )
+
+
+def measure(build, count: int):
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    store = {}
+    for i in range(count):
+        res = build(i)
+        store[res.reservation_id] = res
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bytes_per = (used - baseline) / count
+    del store
+
+    gc.collect()
+    started = time.perf_counter()
+    for i in range(count):
+        build(i)
+    rate = count / (time.perf_counter() - started)
+    return bytes_per, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f"{'representation':<12} {'bytes/res':>10} {'creations/s':>12}")
+    for name, build in (("pydantic", build_pydantic), ("slotted", build_slotted)):
+        bytes_per, rate = measure(build, args.count)
+        print(f"{name:<12} {bytes_per:>10.0f} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
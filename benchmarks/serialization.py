@@ -0,0 +1,92 @@
+"""
+Serialization cost per item of a 1,000-product listing page.
+
+Starts from the Mongo documents of one GET /products/ page and measures
+what happens until the response body exists:
+
+    models       ProductResponse(**doc) per document, then FastAPI's
+                 response_model validation and JSONResponse rendering (the
+                 default path)
+    fast         ResponseSerializer.dumps on the documents (FAST_JSON_ROUTERS
+                 includes "products")
+
+    python -m benchmarks.serialization [--items 1000] [--repeat 200]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from app.routes import product_route
+from app.schemas.product_schema import ProductResponse
+from app.utils.serializers import ResponseSerializer
+
+
+def _documents(items: int):
+    created = datetime(2024, 1, 1)
+    return [
+        {
+            "product_id": f"PROD_{i:08x}",
+            "name": f"Product {i}",
+            "description": "Benchmark product",
+            "price": 10 + i % 90,
+            "total_stock": 1000,
+            "available_stock": 1000 - i % 50,
+            "reserved_stock": i % 50,
+            "created_at": created + timedelta(seconds=i),
+        }
+        for i in range(items)
+    ]
+
+
+def _listing_field():
+    for route in product_route.router.routes:
+        if route.name == "list_products":
+            return route.response_field
+    raise RuntimeError("list_products route not found")
+
+
+async def models_path(docs, field) -> bytes:
+    products = [ProductResponse(**d) for d in docs]
+    content = await serialize_response(field=field, response_content=products)
+    return JSONResponse(content).body
+
+
+async def fast_path(docs, serializer) -> bytes:
+    return serializer.dumps(docs)
+
+
+async def measure(render, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await render()
+    return (time.perf_counter() - started) / repeat
+
+
+async def run(items: int, repeat: int):
+    docs = _documents(items)
+    field = _listing_field()
+    serializer = ResponseSerializer(ProductResponse, enabled=True)
+
+    print(f"{'path':<8} {'ms/page':>9} {'us/item':>9}")
+    for name, render in (
+        ("models", lambda: models_path(docs, field)),
+        ("fast", lambda: fast_path(docs, serializer)),
+    ):
+        seconds = await measure(render, repeat)
+        print(f"{name:<8} {seconds * 1000:>9.2f} {seconds / items * 1e6:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
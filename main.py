@@ -13,20 +13,63 @@ from app.routes import (
     order_route,
     system_route,
 )
-from app.services.reservation_service import expiration_worker
+from app.services import reservation_service
+from app.services.reservation_backend import backend
+from app.services.audit_service import audit_writer
+from app.services.counters import counters, counters_worker
+from app.auth.revocation import revocation_refresher, revoked_tokens
+from app.services.stock_service import load_striped_products, stock_rebalancer
+from app.db.indexes import ensure_indexes
+from app.services.latency_metrics import HandlerLatencyMiddleware, mongo_commands
+from app.db.database import command_listeners
+from app.core.config import RESERVATION_BACKEND, LATENCY_METRICS
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    task = asyncio.create_task(expiration_worker())
+    await ensure_indexes()
+    await audit_writer.start()
     try:
-        yield
+        await load_striped_products()
+        # Revoked tokens must be known before the first request is authorized
+        await revoked_tokens.refresh()
+        await counters.load()
+        in_memory = RESERVATION_BACKEND in ("memory", "partitioned")
+        if in_memory:
+            # Reload active holds before serving so commits/cancels find them
+            await reservation_service.restore_reservation_store()
+        if RESERVATION_BACKEND == "partitioned":
+            # Accept requests forwarded by the other workers
+            await backend.start()
+        tasks = [
+            asyncio.create_task(backend.expiration_worker()),
+            asyncio.create_task(stock_rebalancer()),
+            asyncio.create_task(revocation_refresher()),
+            asyncio.create_task(counters_worker()),
+        ]
+        if in_memory and reservation_service.reservation_journal is not None:
+            tasks.append(asyncio.create_task(reservation_service.snapshot_worker()))
+        try:
+            yield
+        finally:
+            # Shutdown logic (optional but safe)
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+            if RESERVATION_BACKEND == "partitioned":
+                await backend.stop()
+            # Hand this process's counts over before exiting
+            with contextlib.suppress(Exception):
+                await counters.checkpoint()
+            # Final snapshot so the next start replays as little as possible
+            await reservation_service.close_reservation_journal()
     finally:
-        # Shutdown logic (optional but safe)
-        task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await task
+        # Drain buffered audit events last so nothing logged above is lost,
+        # also when startup or an earlier shutdown step failed
+        await audit_writer.stop()
 
 
 app = FastAPI(
@@ -42,6 +85,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if LATENCY_METRICS:
+    # Outermost, so the timing covers CORS handling too
+    app.add_middleware(HandlerLatencyMiddleware)
+    command_listeners.register(mongo_commands)
+
 app.include_router(auth_route.router)
 app.include_router(product_route.router)
 app.include_router(reservation_route.router)
@@ -4,8 +4,24 @@ import pytest,pytest_asyncio
 from types import SimpleNamespace
 from typing import Any, Dict, List
 
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
 from app.db import database as db_module
 from app.services import reservation_service as rs
+from app.services import audit_service
+from app.services import order_service
+from app.services import stock_service
+from app.services import mongo_reservation_service
+from app.services import partitioned_reservations
+from app.services import leader_lease
+from app.services import counters as counters_module
+from app.services import latency_metrics
+from app.auth import deps
+from app.auth.user_cache import user_cache
+from app.auth import revocation
+from app.routes import auth_route, product_route, system_route
+from app.services.catalog_cache import catalog_cache
 
 
 # ---------- Simple in-memory fake DB layer for tests ----------
@@ -25,26 +41,40 @@ class FakeCursor:
     def __init__(self, docs: List[Dict]):
         self._docs = [d.copy() for d in docs]
 
-    def sort(self, *args, **kwargs):
+    def sort(self, key_or_list, direction: int = 1):
+        keys = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: d.get(field), reverse=order < 0)
         return self
 
     def limit(self, n: int):
         self._docs = self._docs[:n]
         return self
 
+    def batch_size(self, n: int):
+        return self
+
     async def to_list(self, length: int):
         return self._docs[:length]
 
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for d in self._docs:
+            yield d
+
 
 class FakeCollection:
     """
     In-memory mini "Mongo collection" with just what we need:
-      - insert_one
+      - insert_one / insert_many
       - find_one
       - find_one_and_update
-      - update_one
-      - delete_many
-      - find
+      - update_one / update_many
+      - bulk_write (UpdateOne only)
+      - find_one_and_delete / delete_many
+      - find / aggregate
       - count_documents
     """
 
@@ -52,10 +82,16 @@ class FakeCollection:
         self.docs: List[Dict[str, Any]] = []
 
     async def insert_one(self, doc: Dict[str, Any]):
-        self.docs.append(doc.copy())
+        stored = {"_id": ObjectId(), **doc}
+        self.docs.append(stored)
+        return FakeInsertOneResult(stored["_id"])
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True):
+        for doc in docs:
+            await self.insert_one(doc)
         return FakeInsertOneResult()
 
-    async def find_one(self, filter: Dict[str, Any]):
+    async def find_one(self, filter: Dict[str, Any], projection: Dict[str, Any] = None):
         for d in self.docs:
             if _matches_filter(d, filter):
                 return d.copy()
@@ -66,20 +102,57 @@ class FakeCollection:
         filter: Dict[str, Any],
         update: Dict[str, Any],
         return_document=None,
+        upsert: bool = False,
     ):
         for d in self.docs:
             if _matches_filter(d, filter):
+                before = d.copy()
                 _apply_update(d, update)
-                return d.copy()
-        return None
-
-    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any]):
+                return d.copy() if return_document else before
+        if not upsert:
+            return None
+        if "_id" in filter and any(d["_id"] == filter["_id"] for d in self.docs):
+            raise DuplicateKeyError("duplicate _id")
+        doc = {k: v for k, v in filter.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(doc, update)
+        await self.insert_one(doc)
+        return doc.copy()
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
         for d in self.docs:
             if _matches_filter(d, filter):
                 _apply_update(d, update)
                 return FakeUpdateResult(matched_count=1, modified_count=1)
+        if upsert:
+            if "_id" in filter and any(d["_id"] == filter["_id"] for d in self.docs):
+                raise DuplicateKeyError("duplicate _id")
+            doc = {k: v for k, v in filter.items() if not k.startswith("$") and not isinstance(v, dict)}
+            _apply_update(doc, update, inserting=True)
+            await self.insert_one(doc)
         return FakeUpdateResult(matched_count=0, modified_count=0)
 
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any]):
+        matched = 0
+        for d in self.docs:
+            if _matches_filter(d, filter):
+                _apply_update(d, update)
+                matched += 1
+        return FakeUpdateResult(matched_count=matched, modified_count=matched)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True):
+        matched = 0
+        for op in requests:
+            result = await self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
+            matched += result.matched_count
+        return FakeUpdateResult(matched_count=matched, modified_count=matched)
+
+    async def find_one_and_delete(self, filter: Dict[str, Any]):
+        for d in self.docs:
+            if _matches_filter(d, filter):
+                self.docs.remove(d)
+                return d.copy()
+        return None
+
     async def delete_many(self, filter: Dict[str, Any]):
         if not filter:
             self.docs.clear()
@@ -90,38 +163,82 @@ class FakeCollection:
                 remaining.append(d)
         self.docs = remaining
 
-    def find(self, filter: Dict[str, Any]):
+    def find(self, filter: Dict[str, Any], projection: Dict[str, Any] = None):
         matched = [d for d in self.docs if _matches_filter(d, filter)]
         return FakeCursor(matched)
 
     async def count_documents(self, filter: Dict[str, Any]):
         return sum(1 for d in self.docs if _matches_filter(d, filter))
 
+    def aggregate(self, pipeline: List[Dict[str, Any]]):
+        """$match, then $group on one field with $sum accumulators."""
+        docs = self.docs
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [d for d in docs if _matches_filter(d, stage["$match"])]
+            elif "$group" in stage:
+                spec = dict(stage["$group"])
+                key = spec.pop("_id").lstrip("$")
+                groups: Dict[Any, Dict[str, Any]] = {}
+                for d in docs:
+                    group = groups.setdefault(d.get(key), {"_id": d.get(key), **{f: 0 for f in spec}})
+                    for field, acc in spec.items():
+                        group[field] += d.get(acc["$sum"].lstrip("$"), 0)
+                docs = list(groups.values())
+        return FakeCursor(docs)
+
 
 def _matches_filter(doc: Dict[str, Any], flt: Dict[str, Any]) -> bool:
     """
     Very tiny filter support:
       { field: value }
-      { field: { "$gte": value } }
+      { field: { "$gte" | "$gt" | "$lte" | "$lt": value } }
+      { field: { "$in": [values] } }
+      { field: { "$exists": bool } }
+      { "$or": [filters] }, { "$and": [filters] }
     """
     for key, cond in flt.items():
-        if isinstance(cond, dict):
-            if "$gte" in cond:
-                if doc.get(key, None) < cond["$gte"]:
-                    return False
-            else:
+        if key == "$or":
+            if not any(_matches_filter(doc, f) for f in cond):
+                return False
+        elif key == "$and":
+            if not all(_matches_filter(doc, f) for f in cond):
                 return False
+        elif isinstance(cond, dict):
+            value = doc.get(key, None)
+            for op, operand in cond.items():
+                if op == "$in":
+                    if value not in operand:
+                        return False
+                elif op == "$exists":
+                    if (key in doc) != bool(operand):
+                        return False
+                elif op in _COMPARISONS:
+                    if value is None or not _COMPARISONS[op](value, operand):
+                        return False
+                else:
+                    return False
         else:
             if doc.get(key, None) != cond:
                 return False
     return True
 
 
-def _apply_update(doc: Dict[str, Any], update: Dict[str, Any]):
+_COMPARISONS = {
+    "$gte": lambda a, b: a >= b,
+    "$gt": lambda a, b: a > b,
+    "$lte": lambda a, b: a <= b,
+    "$lt": lambda a, b: a < b,
+}
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
     """
     Support for:
       { "$inc": { field: value } }
       { "$set": { field: value } }
+      { "$unset": { field: "" } }
+      { "$setOnInsert": { field: value } }   (upserts that insert only)
     """
     for op, changes in update.items():
         if op == "$inc":
@@ -130,54 +247,113 @@ def _apply_update(doc: Dict[str, Any], update: Dict[str, Any]):
         elif op == "$set":
             for field, value in changes.items():
                 doc[field] = value
+        elif op == "$unset":
+            for field in changes:
+                doc.pop(field, None)
+        elif op == "$setOnInsert":
+            if inserting:
+                doc.update(changes)
         else:
             pass
 
 
 # ---------- Pytest fixture wiring fake DB into the app ----------
 
-@pytest.fixture(autouse=True)
-def fake_db():
+COLLECTION_NAMES = (
+    "products", "reservations", "orders", "audit_logs", "stock_history",
+    "users", "stock_buckets", "leases", "revoked_tokens", "counters",
+)
+
+
+def install_collections(collections: Dict[str, Any]):
     """
-    Runs before every test (sync fixture):
-      - Creates fresh FakeCollection objects
-      - Patches BOTH:
-          app.db.database.*  AND
-          app.services.reservation_service.*
-      - Clears in-memory reservation_store
+    Point the app at `collections` (keyed by COLLECTION_NAMES). Patches BOTH
+    app.db.database.* AND the services/routes that imported a collection
+    by name. Also used by the multi-process tests inside each worker.
     """
-
-    # 1️⃣ Fresh fake collections
-    products = FakeCollection()
-    reservations = FakeCollection()
-    orders = FakeCollection()
-    audits = FakeCollection()
-    stock_history = FakeCollection()
-    users = FakeCollection()
-
-    # 2️⃣ Patch db_module (what routes/services normally import)
-    db_module.products_collection = products
-    db_module.reservations_collection = reservations
-    db_module.orders_collection = orders
-    db_module.audit_collection = audits
-    db_module.stock_history_collection = stock_history
-    db_module.users_collection = users
+    c = collections
+
+    # Patch db_module (what routes/services normally import)
+    db_module.products_collection = c["products"]
+    db_module.reservations_collection = c["reservations"]
+    db_module.orders_collection = c["orders"]
+    db_module.audit_collection = c["audit_logs"]
+    db_module.stock_history_collection = c["stock_history"]
+    db_module.users_collection = c["users"]
+    db_module.stock_buckets_collection = c["stock_buckets"]
+    db_module.leases_collection = c["leases"]
+    db_module.revoked_tokens_collection = c["revoked_tokens"]
+    db_module.counters_collection = c["counters"]
     db_module.db = SimpleNamespace(
-        products=products,
-        reservations=reservations,
-        orders=orders,
-        audit_logs=audits,
-        stock_history=stock_history,
-        users=users,
+        products=c["products"],
+        reservations=c["reservations"],
+        orders=c["orders"],
+        audit_logs=c["audit_logs"],
+        stock_history=c["stock_history"],
+        users=c["users"],
+        stock_buckets=c["stock_buckets"],
     )
 
-    # 3️⃣ Patch reservation_service's own imported collections
-    rs.products_collection = products
-    rs.reservations_collection = reservations
-    rs.orders_collection = orders
+    # Patch the services' and routes' own imported collections
+    rs.reservations_collection = c["reservations"]
+    rs.orders_collection = c["orders"]
+    audit_service.audit_collection = c["audit_logs"]
+    order_service.orders_collection = c["orders"]
+    stock_service.products_collection = c["products"]
+    mongo_reservation_service.reservations_collection = c["reservations"]
+    mongo_reservation_service.orders_collection = c["orders"]
+    partitioned_reservations.reservations_collection = c["reservations"]
+    leader_lease.leases_collection = c["leases"]
+    revocation.revoked_tokens_collection = c["revoked_tokens"]
+    stock_service.stock_buckets_collection = c["stock_buckets"]
+    deps.users_collection = c["users"]
+    auth_route.users_collection = c["users"]
+    product_route.products_collection = c["products"]
+    product_route.stock_history_collection = c["stock_history"]
+    system_route.audit_collection = c["audit_logs"]
+
+
+@pytest.fixture
+def insert_product():
+    """Inserts a plain (unstriped) product with all of its stock available."""
+
+    async def insert(product_id: str, stock: int, price: float = 10.0):
+        await db_module.products_collection.insert_one({
+            "product_id": product_id,
+            "name": product_id,
+            "description": "Test",
+            "price": price,
+            "total_stock": stock,
+            "available_stock": stock,
+            "reserved_stock": 0,
+        })
+
+    return insert
 
-    # 4️⃣ Clear in-memory reservation store
+
+@pytest.fixture(autouse=True)
+def fake_db():
+    """
+    Runs before every test (sync fixture):
+      - Creates fresh FakeCollection objects and installs them
+      - Clears in-memory reservation_store and caches
+    """
+    install_collections({name: FakeCollection() for name in COLLECTION_NAMES})
+    user_cache.clear()
+    revocation.revoked_tokens.clear()
+    counters_module.counters.reset()
+    catalog_cache.clear()
+    stock_service.striped_products.clear()
+
+    # Clear in-memory reservation store and per-product locks
     rs.reservation_store.clear()
+    rs.cart_store.clear()
+    rs.user_index.clear()
+    rs.product_index.clear()
+    rs.expiry_index.clear()
+    rs.product_locks.reset()
+    for histogram in latency_metrics.HISTOGRAMS:
+        histogram.reset()
 
     yield
     # No explicit cleanup needed; new fakes created next test
@@ -0,0 +1,97 @@
+# tests/test_audit.py
+import asyncio
+
+import pytest
+
+from app.db import database as db_module
+from app.services import audit_service
+from app.services.audit_service import AuditWriter, log_event
+
+
+@pytest.mark.asyncio
+async def test_log_event_writes_through_without_writer():
+    await log_event("product_created", "product", "PROD_A1", "admin@test.com")
+
+    doc = await db_module.audit_collection.find_one({"entity_id": "PROD_A1"})
+    assert doc["event_type"] == "product_created"
+
+
+@pytest.mark.asyncio
+async def test_writer_batches_events_and_drains_on_stop(monkeypatch):
+    writer = AuditWriter(max_size=100, batch_size=10, flush_interval=60)
+    monkeypatch.setattr(audit_service, "audit_writer", writer)
+    await writer.start()
+
+    for i in range(25):
+        await log_event("stock_updated", "product", f"PROD_B{i}")
+    await asyncio.sleep(0)
+
+    # Two full batches go out immediately, the rest waits for the timer.
+    assert writer.stats()["written"] == 20
+
+    await writer.stop()
+
+    assert writer.stats()["written"] == 25
+    assert writer.stats()["batches"] == 3
+    assert await db_module.audit_collection.count_documents({}) == 25
+
+
+@pytest.mark.asyncio
+async def test_writer_applies_backpressure_when_full(monkeypatch):
+    writer = AuditWriter(max_size=2, batch_size=100, flush_interval=60)
+    monkeypatch.setattr(audit_service, "audit_writer", writer)
+
+    gate = asyncio.Event()
+    insert_many = db_module.audit_collection.insert_many
+
+    async def slow_insert_many(docs, ordered=True):
+        await gate.wait()
+        return await insert_many(docs, ordered=ordered)
+
+    monkeypatch.setattr(db_module.audit_collection, "insert_many", slow_insert_many)
+    await writer.start()
+
+    for i in range(5):
+        await log_event("stock_updated", "product", f"PROD_C{i}")
+    # The flusher is stuck on the first write and the buffer is full again.
+    blocked = asyncio.create_task(log_event("stock_updated", "product", "PROD_C5"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    assert writer.stats()["backpressure_waits"] >= 1
+
+    gate.set()
+    await blocked
+    await writer.stop()
+    assert await db_module.audit_collection.count_documents({}) == 6
+
+
+@pytest.mark.asyncio
+async def test_stop_closes_intake_and_drains_waiting_producers(monkeypatch):
+    writer = AuditWriter(max_size=2, batch_size=100, flush_interval=60)
+    monkeypatch.setattr(audit_service, "audit_writer", writer)
+
+    gate = asyncio.Event()
+    insert_many = db_module.audit_collection.insert_many
+
+    async def slow_insert_many(docs, ordered=True):
+        await gate.wait()
+        return await insert_many(docs, ordered=ordered)
+
+    monkeypatch.setattr(db_module.audit_collection, "insert_many", slow_insert_many)
+    await writer.start()
+
+    for i in range(5):
+        await log_event("stock_updated", "product", f"PROD_D{i}")
+    blocked = asyncio.create_task(log_event("stock_updated", "product", "PROD_D5"))
+    await asyncio.sleep(0.01)
+    stopping = asyncio.create_task(writer.stop())
+    await asyncio.sleep(0.01)
+
+    # Intake is closed: new events no longer queue behind the stop marker
+    assert not writer.running
+    await log_event("stock_updated", "product", "PROD_D6")
+
+    gate.set()
+    await stopping
+    await blocked
+    assert await db_module.audit_collection.count_documents({}) == 7
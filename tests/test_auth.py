@@ -0,0 +1,171 @@
+# tests/test_auth.py
+import asyncio
+import threading
+
+import pytest
+from datetime import timedelta
+from fastapi import HTTPException
+from httpx import AsyncClient, ASGITransport
+from passlib.hash import pbkdf2_sha256
+
+from main import app
+from app.db import database as db_module
+from app.auth import auth_bearer, deps, passwords
+from app.auth.revocation import revoked_tokens
+from app.auth.auth_handler import sign_jwt, decode_jwt
+from app.core.config import PASSWORD_HASH_ROUNDS
+from app.utils.time_utils import now_utc
+
+
+@pytest.mark.asyncio
+async def test_token_decoded_once_and_user_cached(monkeypatch):
+    email = "cached@test.com"
+    await db_module.users_collection.insert_one({"email": email, "role": "user"})
+    headers = {"Authorization": f"Bearer {sign_jwt(email, 'user')['access_token']}"}
+
+    calls = {"decode": 0, "find_one": 0}
+
+    def counting_decode(token):
+        calls["decode"] += 1
+        return decode_jwt(token)
+
+    find_one = db_module.users_collection.find_one
+
+    async def counting_find_one(filter):
+        calls["find_one"] += 1
+        return await find_one(filter)
+
+    monkeypatch.setattr(auth_bearer, "decode_jwt", counting_decode)
+    monkeypatch.setattr(db_module.users_collection, "find_one", counting_find_one)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        first = await client.get("/orders/", headers=headers)
+        second = await client.get("/orders/", headers=headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert calls == {"decode": 2, "find_one": 1}
+
+
+@pytest.mark.asyncio
+async def test_invalid_token_is_rejected():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get(
+            "/orders/", headers={"Authorization": "Bearer not-a-token"}
+        )
+
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_login_verifies_off_loop_and_upgrades_weak_hash(monkeypatch):
+    email = "weak@test.com"
+    await db_module.users_collection.insert_one({
+        "email": email,
+        "role": "user",
+        "password": pbkdf2_sha256.using(rounds=1000).hash("secret"),
+    })
+    threads = []
+    verify_and_update = passwords.pwd_context.verify_and_update
+
+    def recording_verify(password, hashed):
+        threads.append(threading.current_thread().name)
+        return verify_and_update(password, hashed)
+
+    monkeypatch.setattr(passwords.pwd_context, "verify_and_update", recording_verify)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        wrong = await client.post("/auth/login", json={"email": email, "password": "nope"})
+        right = await client.post("/auth/login", json={"email": email, "password": "secret"})
+        again = await client.post("/auth/login", json={"email": email, "password": "secret"})
+
+    assert wrong.status_code == 401
+    assert right.status_code == 200 and again.status_code == 200
+    assert len(threads) == 3
+    assert all(name.startswith("password-hash") for name in threads)
+    user = await db_module.users_collection.find_one({"email": email})
+    assert pbkdf2_sha256.from_string(user["password"]).rounds == PASSWORD_HASH_ROUNDS
+
+
+@pytest.mark.asyncio
+async def test_password_checks_beyond_the_waiting_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(passwords, "PASSWORD_HASH_WORKERS", 1)
+    monkeypatch.setattr(passwords, "PASSWORD_HASH_MAX_WAITING", 1)
+    monkeypatch.setattr(passwords, "_slots_loop", None)
+    release = threading.Event()
+
+    def stuck_verify(password, hashed):
+        release.wait(5)
+        return False, None
+
+    monkeypatch.setattr(passwords.pwd_context, "verify_and_update", stuck_verify)
+    running = asyncio.create_task(passwords.verify_and_update("a", "x"))
+    waiting = asyncio.create_task(passwords.verify_and_update("b", "x"))
+    await asyncio.sleep(0.01)
+
+    # The event loop stays free while one check runs and one waits
+    with pytest.raises(HTTPException) as refused:
+        await passwords.verify_and_update("c", "x")
+    assert refused.value.status_code == 503
+
+    release.set()
+    assert await running == (False, None) and await waiting == (False, None)
+    assert passwords._pending == 0
+
+
+@pytest.mark.asyncio
+async def test_stateless_mode_skips_user_lookup_and_logout_revokes(monkeypatch):
+    monkeypatch.setattr(deps, "AUTH_STATELESS", True)
+    headers = {"Authorization": f"Bearer {sign_jwt('claims@test.com', 'user')['access_token']}"}
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        # No user document exists: the signed claims alone authorize the call
+        assert (await client.get("/orders/", headers=headers)).status_code == 200
+        assert (await client.post("/auth/logout", headers=headers)).status_code == 200
+        assert (await client.get("/orders/", headers=headers)).status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_revocations_from_other_processes_are_loaded_incrementally():
+    token = decode_jwt(sign_jwt("other@test.com", "user")["access_token"])
+    await db_module.revoked_tokens_collection.insert_one({
+        "jti": token["jti"],
+        "expires_at": now_utc() + timedelta(hours=1),
+        "revoked_at": now_utc(),
+    })
+    assert not revoked_tokens.is_revoked(token["jti"])
+
+    await revoked_tokens.refresh()
+    assert revoked_tokens.is_revoked(token["jti"])
+    # Long-expired entries are dropped from memory on the next refresh
+    await db_module.revoked_tokens_collection.insert_one({
+        "jti": "old",
+        "expires_at": now_utc() - timedelta(hours=1),
+        "revoked_at": now_utc() + timedelta(seconds=1),
+    })
+    await revoked_tokens.refresh()
+    assert not revoked_tokens.is_revoked("old")
+    assert revoked_tokens.stats()["revoked"] == 1
+
+
+@pytest.mark.asyncio
+async def test_revocation_committed_after_a_newer_one_is_not_skipped():
+    stamped = now_utc()
+    await db_module.revoked_tokens_collection.insert_one({
+        "jti": "newer",
+        "expires_at": stamped + timedelta(hours=1),
+        "revoked_at": stamped,
+    })
+    await revoked_tokens.refresh()
+    # Another process stamped its revocation earlier but it lands only now
+    await db_module.revoked_tokens_collection.insert_one({
+        "jti": "late",
+        "expires_at": stamped + timedelta(hours=1),
+        "revoked_at": stamped - timedelta(seconds=2),
+    })
+    await revoked_tokens.refresh()
+    assert revoked_tokens.is_revoked("late")
@@ -0,0 +1,234 @@
+# tests/test_cluster.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.db import database as db_module
+from app.schemas.reservation_schema import (
+    CartItem,
+    CartReservationCreate,
+    ReservationCommitRequest,
+    ReservationCreate,
+)
+from app.services import cluster_ipc
+from app.services import partitioned_reservations as pr
+from app.services import reservation_service as rs
+from app.services.partitioning import HashRing
+
+
+def test_hash_ring_spreads_products_and_moves_few_on_resize():
+    keys = [f"PROD_{i}" for i in range(3000)]
+    four, five = HashRing(4), HashRing(5)
+
+    counts = [0] * 4
+    for key in keys:
+        counts[four.owner(key)] += 1
+    assert min(counts) > len(keys) / 4 * 0.6
+
+    assert all(HashRing(4).owner(key) == four.owner(key) for key in keys)
+    moved = sum(four.owner(key) != five.owner(key) for key in keys)
+    assert moved < len(keys) * 0.35
+
+
+@pytest.mark.asyncio
+async def test_requests_for_remote_products_are_forwarded(monkeypatch, tmp_path):
+    # Pretend to be worker 0 of two, with "worker 1" served from this process
+    ring = HashRing(2)
+    monkeypatch.setattr(cluster_ipc, "CLUSTER_SOCKET_DIR", str(tmp_path))
+    monkeypatch.setattr(pr, "ring", ring)
+    monkeypatch.setattr(pr, "owner_of", ring.owner)
+    monkeypatch.setattr(pr, "worker_id", 0)
+    remote = next(f"PROD_C_{i}" for i in range(100) if ring.owner(f"PROD_C_{i}") == 1)
+    await db_module.products_collection.insert_one({
+        "product_id": remote,
+        "name": "Remote",
+        "price": 10.0,
+        "total_stock": 5,
+        "available_stock": 5,
+        "reserved_stock": 0,
+    })
+
+    server = cluster_ipc.IPCServer(1)
+    await server.start()
+    peers = cluster_ipc.PeerClient()
+    monkeypatch.setattr(pr, "peers", peers)
+    try:
+        res = await pr.create_reservation(
+            ReservationCreate(product_id=remote, quantity=2, ttl_minutes=5), "c1@test.com"
+        )
+        assert res.product_id == remote and res.quantity == 2
+
+        # A worker without the hold in memory finds its owner through MongoDB
+        held = rs.reservation_store.pop(res.reservation_id)
+        assert await pr._reservation_owner(res.reservation_id) == 1
+        rs.reservation_store[res.reservation_id] = held
+
+        with pytest.raises(HTTPException) as exc:
+            await pr.create_reservation(
+                ReservationCreate(product_id=remote, quantity=10, ttl_minutes=5), "c1@test.com"
+            )
+        assert exc.value.status_code == 400
+        assert (peers.forwarded, server.handled) == (2, 2)
+    finally:
+        await peers.close()
+        await server.stop()
+
+
+
+@pytest.mark.asyncio
+async def test_peer_client_reconnects_once_after_peer_restart(monkeypatch, tmp_path):
+    monkeypatch.setattr(cluster_ipc, "CLUSTER_SOCKET_DIR", str(tmp_path))
+
+    async def echo(value):
+        return value
+
+    monkeypatch.setitem(cluster_ipc.handlers, "echo", echo)
+    peers = cluster_ipc.PeerClient()
+    server = cluster_ipc.IPCServer(1)
+    await server.start()
+    try:
+        assert await peers.call(1, "echo", value=1) == 1
+        # The peer restarts: the pooled connection is closed under us
+        await server.stop()
+        server = cluster_ipc.IPCServer(1)
+        await server.start()
+        assert await peers.call(1, "echo", value=2) == 2
+        assert (peers.forwarded, server.handled) == (2, 1)
+
+        # A fresh connection that fails is not retried
+        await server.stop()
+        with pytest.raises((ConnectionError, FileNotFoundError)):
+            await peers.call(1, "echo", value=3)
+    finally:
+        await peers.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_peer_client_never_resends_a_request_the_peer_received(monkeypatch, tmp_path):
+    monkeypatch.setattr(cluster_ipc, "CLUSTER_SOCKET_DIR", str(tmp_path))
+    received = []
+
+    async def serve(reader, writer):
+        # Answers the first request, then drops the connection mid-request
+        while True:
+            try:
+                request = await cluster_ipc._recv(reader)
+            except asyncio.IncompleteReadError:
+                break
+            received.append(request["args"]["value"])
+            if len(received) > 1:
+                break
+            await cluster_ipc._send(writer, {"ok": request["args"]["value"]})
+        writer.close()
+
+    server = await asyncio.start_unix_server(serve, path=cluster_ipc.socket_path(1))
+    peers = cluster_ipc.PeerClient()
+    try:
+        assert await peers.call(1, "echo", value=1) == 1
+        with pytest.raises(asyncio.IncompleteReadError):
+            await peers.call(1, "echo", value=2)
+        assert received == [1, 2]
+    finally:
+        await peers.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_cart_spanning_owners_is_checked_everywhere_before_committing(monkeypatch):
+    monkeypatch.setattr(pr, "owner_of", lambda product_id: 1 if product_id == "PROD_R" else 0)
+    monkeypatch.setattr(pr, "worker_id", 0)
+    await db_module.products_collection.insert_one({
+        "product_id": "PROD_L",
+        "name": "Local",
+        "price": 10.0,
+        "total_stock": 5,
+        "available_stock": 5,
+        "reserved_stock": 0,
+    })
+    local = await rs.create_cart_reservation(
+        CartReservationCreate(items=[CartItem(product_id="PROD_L", quantity=1)], ttl_minutes=5),
+        "cart@test.com",
+        "CART_SPLIT",
+    )
+    # Worker 1's line of the same cart
+    await db_module.reservations_collection.insert_one(
+        {"reservation_id": "RES_REMOTE", "product_id": "PROD_R", "cart_id": "CART_SPLIT"}
+    )
+
+    calls = []
+
+    class FakePeers:
+        fail_on = "check_cart"
+
+        async def call(self, worker, op, **args):
+            calls.append(op)
+            if op == self.fail_on:
+                raise HTTPException(status_code=400, detail="Cart reservation expired")
+            return []
+
+    peers = FakePeers()
+    monkeypatch.setattr(pr, "peers", peers)
+    commit = ReservationCommitRequest(payment_id="PAY_S", shipping_address="Street S")
+
+    with pytest.raises(HTTPException) as exc:
+        await pr.commit_cart("CART_SPLIT", commit, "cart@test.com")
+    assert exc.value.status_code == 400
+    assert calls == ["check_cart"]
+    assert local[0].reservation_id in rs.reservation_store
+
+    # Worker 1 passes the check but fails its commit: the partial result is reported
+    peers.fail_on = "commit_cart"
+    with pytest.raises(HTTPException) as exc:
+        await pr.commit_cart("CART_SPLIT", commit, "cart@test.com")
+    assert exc.value.status_code == 409
+    assert [o["reservation_id"] for o in exc.value.detail["orders"]] == [local[0].reservation_id]
+    assert exc.value.detail["failed"] == [{"reservation_id": "RES_REMOTE", "product_id": "PROD_R"}]
+
+
+@pytest.mark.asyncio
+async def test_user_cap_is_enforced_by_the_users_owner(monkeypatch):
+    ring = HashRing(2)
+    monkeypatch.setattr(pr, "ring", ring)
+    monkeypatch.setattr(pr, "owner_of", lambda product_id: 0)
+    monkeypatch.setattr(pr, "user_owner_of", lambda user_id: ring.owner(f"user:{user_id}"))
+    monkeypatch.setattr(pr, "worker_id", 0)
+    monkeypatch.setattr(pr, "RESERVATION_MAX_ACTIVE_PER_USER", 2)
+    local_user = next(f"u{i}@test.com" for i in range(100) if ring.owner(f"user:u{i}@test.com") == 0)
+    remote_user = next(f"u{i}@test.com" for i in range(100) if ring.owner(f"user:u{i}@test.com") == 1)
+    await db_module.products_collection.insert_one({
+        "product_id": "PROD_CAP",
+        "name": "Cap",
+        "price": 10.0,
+        "total_stock": 10,
+        "available_stock": 10,
+        "reserved_stock": 0,
+    })
+
+    calls = []
+
+    class FakePeers:
+        # Worker 1 already holds one reservation for every user
+        async def call(self, worker, op, **args):
+            calls.append((worker, op))
+            if op == "user_active_count":
+                return 1
+            raise AssertionError(op)
+
+    monkeypatch.setattr(pr, "peers", FakePeers())
+    payload = ReservationCreate(product_id="PROD_CAP", quantity=1, ttl_minutes=5)
+
+    await pr.create_reservation(payload, local_user)
+    # One hold here plus one on worker 1 reaches the cap of 2
+    with pytest.raises(HTTPException) as exc:
+        await pr.create_reservation(payload, local_user)
+    assert exc.value.status_code == 429
+    assert calls == [(1, "user_active_count")] * 2
+
+    # Another user's creates go to that user's owner
+    calls.clear()
+    with pytest.raises(AssertionError):
+        await pr.create_reservation(payload, remote_user)
+    assert calls == [(1, "create_reservation_capped")]
@@ -87,3 +87,123 @@ async def test_metrics_api_unauthorized():
 #     assert isinstance(response.json(), list)
 
 
+@pytest.mark.asyncio
+async def test_latency_histograms_in_prometheus_format(admin_headers, insert_product):
+    from types import SimpleNamespace
+    from app.schemas.reservation_schema import ReservationCreate
+    from app.services import reservation_service as rs
+    from app.services.latency_metrics import (
+        HandlerLatencyMiddleware, lock_hold, lock_wait, mongo_commands,
+    )
+
+    await insert_product("PROD_PROM_1", 10, price=25.0)
+    await rs.create_reservation(
+        ReservationCreate(product_id="PROD_PROM_1", quantity=1, ttl_minutes=5), "user@test.com"
+    )
+    # What pymongo reports for one find on the products collection
+    mongo_commands.started(SimpleNamespace(
+        command={"find": "products", "filter": {}}, command_name="find",
+        request_id=1, connection_id=("localhost", 27017),
+    ))
+    mongo_commands.succeeded(SimpleNamespace(
+        command_name="find", request_id=1, connection_id=("localhost", 27017),
+        duration_micros=1500,
+    ))
+
+    # LATENCY_METRICS is off by default, so wrap the app the way main.py would
+    transport = ASGITransport(app=HandlerLatencyMiddleware(app))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get("/products/PROD_PROM_1")
+        await client.request("BREW", "/products/PROD_PROM_1")
+        response = await client.get("/metrics/prometheus", headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert lock_wait.count("product") == 1 and lock_hold.count("product") == 1
+    text = response.text
+    assert "# TYPE inventory_http_request_duration_seconds histogram" in text
+    # Routes are labelled by template, not by product id
+    assert (
+        'inventory_http_request_duration_seconds_count'
+        '{method="GET",route="/products/{product_id}",status="200"} 1'
+    ) in text
+    # Made-up methods share one label value
+    assert 'method="BREW"' not in text
+    assert 'inventory_http_request_duration_seconds_count{method="OTHER",' in text
+    assert 'inventory_lock_wait_seconds_bucket{lock="product",le="+Inf"} 1' in text
+    assert (
+        'inventory_mongodb_command_duration_seconds_bucket'
+        '{collection="products",command="find",le="0.001"} 0'
+    ) in text
+    assert (
+        'inventory_mongodb_command_duration_seconds_bucket'
+        '{collection="products",command="find",le="0.0025"} 1'
+    ) in text
+
+
+@pytest.mark.asyncio
+async def test_counters_track_lifecycle_checkpoint_and_reconcile(insert_product):
+    from app.schemas.reservation_schema import (
+        CancelReservationRequest, ReservationCommitRequest, ReservationCreate,
+    )
+    from app.services import reservation_service as rs
+    from app.services.counters import Counters, counters
+
+    await insert_product("PROD_COUNT_1", 10)
+    await db_module.orders_collection.insert_one({"order_id": "ORD_OLD"})
+    # First start: totals that were never recorded are counted once
+    await counters.load()
+    assert (counters.value("products"), counters.value("orders")) == (1, 1)
+
+    commit = ReservationCommitRequest(payment_id="PAY_C", shipping_address="Street C")
+    reservations = [
+        await rs.create_reservation(
+            ReservationCreate(product_id="PROD_COUNT_1", quantity=1, ttl_minutes=5),
+            f"count{i}@test.com",
+        )
+        for i in range(3)
+    ]
+    await rs.commit_reservation(reservations[0].reservation_id, commit)
+    await rs.cancel_reservation(reservations[1].reservation_id, CancelReservationRequest(reason="x"))
+    reservations[2].expires_ms = 0
+    rs.expiry_index.push(reservations[2].reservation_id, 0)
+    await rs.cleanup_expired_reservations()
+
+    assert counters.value("orders") == 2
+    assert counters.value("reservations_created") == 3
+    assert counters.value("reservations_cancelled") == 1
+    assert counters.value("reservations_expired") == 1
+    assert counters.rate("reservations_created") == pytest.approx(3 / 60)
+
+    # Another process picks the checkpointed totals up
+    await counters.checkpoint()
+    other = Counters()
+    await other.load()
+    assert other.value("orders") == 2 and other.value("reservations_created") == 3
+
+    # Drift (e.g. a process that died before checkpointing) is reconciled away
+    await db_module.orders_collection.insert_one({"order_id": "ORD_SCRIPT"})
+    await other.reconcile()
+    assert other.value("orders") == 3
+
+
+@pytest.mark.asyncio
+async def test_reconcile_does_not_count_other_writers_pending_deltas_twice():
+    from app.services.counters import Counters
+    from app.utils.time_utils import now_utc
+
+    this, other = Counters(), Counters()
+    await this.load()
+    await other.load()
+
+    # The other process wrote an order but has not checkpointed it yet
+    await db_module.orders_collection.insert_one({"order_id": "ORD_P1", "created_at": now_utc()})
+    other.incr("orders")
+    await this.reconcile()
+    await other.checkpoint()
+    await this.checkpoint()
+    assert this.value("orders") == other.value("orders") == 1
+
+    # Later reconciles keep it at the true count
+    await this.reconcile()
+    assert this.value("orders") == 1
@@ -0,0 +1,62 @@
+# tests/test_indexes.py
+import pytest
+
+from app.db import database as db_module
+from app.db import indexes
+
+
+class ExplainCursor:
+    def __init__(self, plan):
+        self._plan = plan
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return self
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": self._plan}}
+
+
+class ExplainCollection:
+    def __init__(self, name, plan):
+        self.name = name
+        self._plan = plan
+        self.created = []
+
+    def find(self, flt):
+        return ExplainCursor(self._plan)
+
+    async def create_indexes(self, models):
+        self.created.extend(m.document["name"] for m in models)
+
+
+INDEXED = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+SCANNED = {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+
+
+@pytest.mark.asyncio
+async def test_query_plan_check_flags_collection_scans(monkeypatch):
+    for attr in indexes.INDEXES:
+        plan = SCANNED if attr == "audit_collection" else INDEXED
+        monkeypatch.setattr(db_module, attr, ExplainCollection(attr, plan))
+
+    report = await indexes.check_query_plans()
+
+    scans = {entry["query"] for entry in report if entry["collection_scan"]}
+    assert scans == {"audit log"}
+    assert len(report) == len(indexes.HOT_QUERIES)
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_creates_declared_indexes(monkeypatch):
+    collections = {}
+    for attr in indexes.INDEXES:
+        collections[attr] = ExplainCollection(attr, INDEXED)
+        monkeypatch.setattr(db_module, attr, collections[attr])
+
+    await indexes.ensure_indexes()
+
+    assert "product_id_unique" in collections["products_collection"].created
+    assert "email_unique" in collections["users_collection"].created
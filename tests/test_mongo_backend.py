@@ -0,0 +1,333 @@
+# tests/test_mongo_backend.py
+import asyncio
+import inspect
+import multiprocessing
+import threading
+import uuid
+from multiprocessing.managers import BaseManager
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import MONGO_URL
+from app.db import database as db_module
+from app.schemas.reservation_schema import (
+    CancelReservationRequest,
+    CartItem,
+    CartReservationCreate,
+    ReservationCommitRequest,
+    ReservationCreate,
+)
+from app.services import leader_lease
+from app.services import mongo_reservation_service as mrs
+from app.utils.time_utils import from_ms
+from tests.conftest import COLLECTION_NAMES, FakeCollection, FakeCursor, install_collections
+
+COMMIT = ReservationCommitRequest(payment_id="PAY_M", shipping_address="Street M")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_commits_of_one_reservation_commit_once(insert_product):
+    await insert_product("PROD_M_1", 5)
+    res = await mrs.create_reservation(
+        ReservationCreate(product_id="PROD_M_1", quantity=2, ttl_minutes=5),
+        "m1@test.com",
+    )
+
+    results = await asyncio.gather(
+        mrs.commit_reservation(res.reservation_id, COMMIT),
+        mrs.commit_reservation(res.reservation_id, COMMIT),
+        mrs.cancel_reservation(res.reservation_id, CancelReservationRequest(reason="x")),
+        return_exceptions=True,
+    )
+
+    assert sum(isinstance(r, dict) for r in results) == 1
+    assert all(r.status_code == 400 for r in results if isinstance(r, HTTPException))
+    assert await db_module.orders_collection.count_documents({}) == 1
+    product = await db_module.products_collection.find_one({"product_id": "PROD_M_1"})
+    assert (product["total_stock"], product["available_stock"], product["reserved_stock"]) == (3, 3, 0)
+
+
+@pytest.mark.asyncio
+async def test_expiry_sweep_and_cart_commit(insert_product):
+    await insert_product("PROD_M_2", 5)
+    await insert_product("PROD_M_3", 5)
+    stale = await mrs.create_reservation(
+        ReservationCreate(product_id="PROD_M_2", quantity=2, ttl_minutes=5),
+        "m2@test.com",
+    )
+    await db_module.reservations_collection.update_one(
+        {"reservation_id": stale.reservation_id},
+        {"$set": {"expires_at": mrs.now_utc().replace(year=2000)}},
+    )
+    assert await mrs.cleanup_expired_reservations() == 1
+    assert await mrs.cleanup_expired_reservations() == 0
+    with pytest.raises(HTTPException) as exc:
+        await mrs.commit_reservation(stale.reservation_id, COMMIT)
+    assert exc.value.status_code == 400
+
+    cart = await mrs.create_cart_reservation(
+        CartReservationCreate(
+            items=[CartItem(product_id="PROD_M_2", quantity=1), CartItem(product_id="PROD_M_3", quantity=1)],
+            ttl_minutes=5,
+        ),
+        "m2@test.com",
+    )
+    orders = await mrs.commit_cart(cart[0].cart_id, COMMIT, "m2@test.com")
+    assert len(orders) == 2
+    with pytest.raises(HTTPException):
+        await mrs.commit_cart(cart[0].cart_id, COMMIT, "m2@test.com")
+    for product_id in ("PROD_M_2", "PROD_M_3"):
+        product = await db_module.products_collection.find_one({"product_id": product_id})
+        assert (product["total_stock"], product["available_stock"], product["reserved_stock"]) == (4, 4, 0)
+
+
+@pytest.mark.asyncio
+async def test_expiry_worker_sleeps_until_the_next_deadline(insert_product):
+    await insert_product("PROD_M_4", 5)
+    worker = asyncio.create_task(mrs.expiration_worker())
+    try:
+        # Let the worker take the lease and go to sleep
+        await asyncio.sleep(0.01)
+        res = await mrs.create_reservation(
+            ReservationCreate(product_id="PROD_M_4", quantity=2, ttl_minutes=5),
+            "m4@test.com",
+        )
+        # Move the deadline just ahead; the worker must wake for it rather
+        # than sleeping out its 30 second upper bound.
+        expires_ms = mrs.now_ms() + 50
+        await db_module.reservations_collection.update_one(
+            {"reservation_id": res.reservation_id},
+            {"$set": {"expires_at": from_ms(expires_ms)}},
+        )
+        mrs._wake_for(expires_ms)
+
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            doc = await db_module.reservations_collection.find_one(
+                {"reservation_id": res.reservation_id}
+            )
+            if doc["status"] != "active":
+                break
+    finally:
+        worker.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+
+    assert doc["status"] == "expired"
+    product = await db_module.products_collection.find_one({"product_id": "PROD_M_4"})
+    assert (product["available_stock"], product["reserved_stock"]) == (5, 0)
+
+
+@pytest.mark.asyncio
+async def test_expiry_lease_has_one_holder_and_fails_over(monkeypatch):
+    clock = [1_000_000]
+    monkeypatch.setattr(leader_lease, "now_ms", lambda: clock[0])
+    a = leader_lease.LeaderLease("expiry-test", ttl_seconds=10, heartbeat_seconds=1)
+    b = leader_lease.LeaderLease("expiry-test", ttl_seconds=10, heartbeat_seconds=1)
+
+    assert await a.try_acquire()
+    assert not await b.try_acquire()
+    assert (a.is_leader, b.is_leader, b.current_holder) == (True, False, a.holder)
+
+    # a stops renewing (dies); b takes over once the lease has run out
+    clock[0] += 5_000
+    assert not await b.try_acquire()
+    clock[0] += 5_001
+    assert not a.is_leader
+    assert await b.try_acquire()
+    assert not await a.try_acquire()
+
+    # A clean shutdown hands the lease over immediately
+    await b.release()
+    assert await a.try_acquire()
+    assert (a.acquired, b.acquired, b.lost) == (2, 1, 0)
+
+
+# ---------- Multi-process stress tests ----------
+#
+# Several spawned worker processes reserve from one product, then all race
+# to commit every reservation. Against a real MongoDB when one is reachable,
+# and always against a fake database shared between the processes.
+
+STRESS_STOCK = 50
+STRESS_WORKERS = 4
+STRESS_ATTEMPTS = 40
+
+
+def _mongo_available() -> bool:
+    from pymongo import MongoClient
+
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+class _SharedFakeDB:
+    """
+    FakeCollections living in a manager process. Each operation runs whole
+    under one lock, so, like MongoDB's single-document updates, a
+    conditional update is atomic with respect to every worker process.
+    """
+
+    def __init__(self):
+        self._collections = {name: FakeCollection() for name in COLLECTION_NAMES}
+        self._lock = threading.Lock()
+
+    def call(self, collection: str, method: str, args: tuple, kwargs: dict):
+        with self._lock:
+            result = getattr(self._collections[collection], method)(*args, **kwargs)
+            if inspect.iscoroutine(result):
+                # The fakes never really suspend: run the coroutine to its end
+                try:
+                    result.send(None)
+                except StopIteration as done:
+                    result = done.value
+                else:
+                    raise RuntimeError(f"{collection}.{method} suspended")
+            if isinstance(result, FakeCursor):
+                result = result._docs
+            return result
+
+
+class _FakeDBManager(BaseManager):
+    pass
+
+
+_FakeDBManager.register("SharedFakeDB", _SharedFakeDB)
+
+
+class _RemoteCollection:
+    """What a worker process uses as a collection: forwards to _SharedFakeDB."""
+
+    def __init__(self, shared, name: str):
+        self._shared = shared
+        self._name = name
+
+    def __getattr__(self, method: str):
+        async def call(*args, **kwargs):
+            return self._shared.call(self._name, method, args, kwargs)
+
+        return call
+
+    def find(self, *args, **kwargs):
+        return FakeCursor(self._shared.call(self._name, "find", args, kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return FakeCursor(self._shared.call(self._name, "aggregate", args, kwargs))
+
+
+def _stress_worker(product_id: str, seed: int, queue, shared=None):
+    # Fresh interpreter (spawn). Without `shared` the app talks to the
+    # throwaway database named in MONGO_DB_NAME, inherited from the parent.
+    if shared is not None:
+        install_collections({name: _RemoteCollection(shared, name) for name in COLLECTION_NAMES})
+
+    async def run():
+        reserved, committed = [], 0
+        for i in range(STRESS_ATTEMPTS):
+            try:
+                res = await mrs.create_reservation(
+                    ReservationCreate(product_id=product_id, quantity=1 + (seed + i) % 2, ttl_minutes=5),
+                    f"stress{seed}@test.com",
+                )
+                reserved.append(res.reservation_id)
+            except HTTPException:
+                pass
+        queue.put(("reserved", reserved))
+        # Every worker then races to commit every reservation it can see
+        docs = await mrs.reservations_collection.find(
+            {"product_id": product_id}
+        ).to_list(length=None)
+        for doc in docs:
+            try:
+                await mrs.commit_reservation(doc["reservation_id"], COMMIT)
+                committed += 1
+            except HTTPException:
+                pass
+        queue.put(("committed", committed))
+
+    asyncio.run(run())
+
+
+def _run_stress_workers(product_id: str, shared=None):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=_stress_worker, args=(product_id, i, queue, shared))
+        for i in range(STRESS_WORKERS)
+    ]
+    for w in workers:
+        w.start()
+    messages = [queue.get(timeout=120) for _ in range(2 * STRESS_WORKERS)]
+    for w in workers:
+        w.join(timeout=30)
+    return messages
+
+
+def _check_stress(messages, product, reservations, orders):
+    reserved_ids = [i for kind, ids in messages if kind == "reserved" for i in ids]
+    commits = sum(n for kind, n in messages if kind == "committed")
+    reserved_qty = sum(doc["quantity"] for doc in reservations)
+
+    # Every reservation a worker was told about exists
+    assert sorted(reserved_ids) == sorted(doc["reservation_id"] for doc in reservations)
+    # No oversell: stock never went negative and holds never exceeded it
+    assert reserved_qty <= STRESS_STOCK
+    assert product["available_stock"] == STRESS_STOCK - reserved_qty
+    # No double commit: one order per reservation, one winner per commit race
+    assert commits == len(reserved_ids)
+    assert len(orders) == len(reserved_ids)
+    assert len({doc["reservation_id"] for doc in orders}) == len(reserved_ids)
+    assert product["total_stock"] == STRESS_STOCK - reserved_qty
+    assert product["reserved_stock"] == 0
+
+
+def _stress_product(product_id: str) -> dict:
+    return {
+        "product_id": product_id,
+        "name": product_id,
+        "price": 1.0,
+        "total_stock": STRESS_STOCK,
+        "available_stock": STRESS_STOCK,
+        "reserved_stock": 0,
+    }
+
+
+def test_multiprocess_no_oversell_no_double_commit_on_shared_fake():
+    product_id = "PROD_STRESS_FAKE"
+    with _FakeDBManager(ctx=multiprocessing.get_context("spawn")) as manager:
+        shared = manager.SharedFakeDB()
+        shared.call("products", "insert_one", (_stress_product(product_id),), {})
+
+        messages = _run_stress_workers(product_id, shared)
+
+        product = shared.call("products", "find_one", ({"product_id": product_id},), {})
+        reservations = shared.call("reservations", "find", ({"product_id": product_id},), {})
+        orders = shared.call("orders", "find", ({},), {})
+    _check_stress(messages, product, reservations, orders)
+
+
+@pytest.mark.skipif(not _mongo_available(), reason="needs a running MongoDB at MONGO_URL")
+def test_multiprocess_no_oversell_no_double_commit(monkeypatch):
+    from pymongo import MongoClient
+
+    db_name = f"stress_{uuid.uuid4().hex[:8]}"
+    product_id = "PROD_STRESS"
+    client = MongoClient(MONGO_URL)
+    db = client[db_name]
+    db.products.insert_one(_stress_product(product_id))
+    # Spawned workers inherit the environment before they import the app
+    monkeypatch.setenv("MONGO_DB_NAME", db_name)
+    try:
+        messages = _run_stress_workers(product_id)
+        _check_stress(
+            messages,
+            db.products.find_one({"product_id": product_id}),
+            list(db.reservations.find({"product_id": product_id})),
+            list(db.orders.find({})),
+        )
+    finally:
+        client.drop_database(db_name)
@@ -0,0 +1,328 @@
+# tests/test_products.py
+import base64
+import json
+from datetime import datetime
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from main import app
+from app.db import database as db_module
+from app.routes import product_route
+from app.schemas.reservation_schema import ReservationCreate, ReservationResponse
+from app.services import reservation_service as rs
+from app.services.catalog_cache import catalog_cache
+from app.utils.serializers import ResponseSerializer
+
+
+@pytest.mark.asyncio
+async def test_public_product_reads_are_served_from_cache(monkeypatch, insert_product):
+    await insert_product("PROD_CACHE_1", 10)
+
+    calls = {"find_one": 0}
+    find_one = db_module.products_collection.find_one
+
+    async def counting_find_one(filter, *args):
+        calls["find_one"] += 1
+        return await find_one(filter)
+
+    monkeypatch.setattr(db_module.products_collection, "find_one", counting_find_one)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        for _ in range(5):
+            response = await client.get("/products/PROD_CACHE_1")
+            assert response.status_code == 200
+
+    assert calls["find_one"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reservation_refreshes_cached_stock(insert_product):
+    await insert_product("PROD_CACHE_2", 10)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        before = await client.get("/products/PROD_CACHE_2")
+        await rs.create_reservation(
+            ReservationCreate(product_id="PROD_CACHE_2", quantity=3, ttl_minutes=5),
+            "user@test.com",
+        )
+        after = await client.get("/products/PROD_CACHE_2")
+
+    assert before.json()["available_stock"] == 10
+    assert after.json()["available_stock"] == 7
+    assert after.json()["reserved_stock"] == 3
+
+
+def test_catalog_cache_validates_lazily_and_expires_shared_entries(monkeypatch):
+    from app.schemas.product_schema import ProductResponse
+    from app.services import catalog_cache as cache_module
+
+    clock = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: clock[0])
+    cache = cache_module.CatalogCache(max_staleness_ms=5, ttl_seconds=1)
+    doc = {
+        "product_id": "PROD_LAZY_1", "name": "Lazy", "description": "Test", "price": 5.0,
+        "total_stock": 4, "available_stock": 3, "reserved_stock": 1,
+    }
+    cache.bump("PROD_LAZY_1", doc)
+    # Kept as the raw document until it is read
+    assert cache._entries["PROD_LAZY_1"][0] is doc
+    product = cache.get_product("PROD_LAZY_1")
+    assert isinstance(product, ProductResponse) and product.available_stock == 3
+
+    # Another process's write is picked up once the short TTL has passed
+    clock[0] += 1.5
+    assert cache.get_product("PROD_LAZY_1") is None
+
+
+def _cursor(values: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+@pytest.mark.asyncio
+async def test_product_listing_pages_with_cursor(insert_product):
+    for i in range(5):
+        await insert_product(f"PROD_PAGE_{i}", i)
+
+    seen = []
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        params = {"limit": 2}
+        while True:
+            response = await client.get("/products/", params=params)
+            assert response.status_code == 200
+            seen.extend(p["product_id"] for p in response.json())
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params = {"limit": 2, "cursor": next_cursor}
+
+        bad = await client.get("/products/", params={"cursor": "not-a-cursor"})
+        # Well-formed, but an operator where a value belongs, or a key the
+        # listing does not sort by
+        tampered = [
+            {"_id": {"$ne": None}},
+            {"_id": None, "price": 1},
+        ]
+        rejected = [
+            await client.get("/products/", params={"cursor": _cursor(values)})
+            for values in tampered
+        ]
+
+    assert seen == [f"PROD_PAGE_{i}" for i in range(5)]
+    assert bad.status_code == 400
+    assert [r.status_code for r in rejected] == [400, 400]
+
+
+@pytest.mark.asyncio
+async def test_fast_json_matches_response_model_output(monkeypatch, insert_product):
+    for i in range(3):
+        await insert_product(f"PROD_FAST_{i}", i)
+    # Integer price and a naive datetime, as MongoDB hands them back
+    db_module.products_collection.docs[0].update(price=10, created_at=datetime(2024, 5, 1, 12, 0, 0, 123000))
+
+    async def listing(fast: bool):
+        monkeypatch.setattr(product_route.product_json, "enabled", fast)
+        catalog_cache.clear()
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/products/", params={"limit": 2})
+
+    slow, fast = await listing(False), await listing(True)
+    assert fast.status_code == 200
+    assert fast.content == slow.content
+    assert fast.headers["X-Next-Cursor"] == slow.headers["X-Next-Cursor"]
+
+    res = rs.ReservationInMemory(
+        reservation_id="RES_FAST",
+        user_id="fast@test.com",
+        product_id="PROD_FAST_0",
+        quantity=2,
+        status="active",
+        created_ms=1_700_000_000_123,
+        expires_ms=1_700_000_600_123,
+        unit_price=10.0,
+    )
+    serializer = ResponseSerializer(ReservationResponse, enabled=True)
+    expected = ReservationResponse(**serializer.to_dict(res)).model_dump_json()
+    assert serializer.dumps(res) == expected.encode()
+
+
+def test_fast_json_coerces_ints_like_the_model():
+    from pydantic import ValidationError
+
+    serializer = ResponseSerializer(ReservationResponse, enabled=True)
+    doc = {
+        "reservation_id": "RES_INT",
+        "user_id": "int@test.com",
+        "product_id": "PROD_INT",
+        "quantity": 2.0,
+        "status": "active",
+        "created_at": datetime(2024, 5, 1),
+        "expires_at": datetime(2024, 5, 1, 0, 10),
+    }
+    assert serializer.to_dict(doc)["quantity"] == 2
+    # "3" is not covered by the plain coercions; the model accepts it
+    assert serializer.to_dict({**doc, "quantity": "3"})["quantity"] == 3
+    # int() would truncate this to 2; the model rejects it
+    with pytest.raises(ValidationError):
+        serializer.to_dict({**doc, "quantity": 2.5})
+
+
+@pytest.mark.asyncio
+async def test_product_listing_streams_ndjson(insert_product):
+    for i in range(3):
+        await insert_product(f"PROD_STREAM_{i}", 1)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/products/", params={"stream": "true"})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [p["product_id"] for p in lines] == [f"PROD_STREAM_{i}" for i in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_striped_stock_is_summed_and_rebalanced(insert_product):
+    from app.schemas.reservation_schema import CancelReservationRequest, ReservationCommitRequest
+    from app.services import stock_service
+
+    await insert_product("PROD_STRIPE_1", 12)
+    await stock_service.set_stripes("PROD_STRIPE_1", 4)
+    buckets = await db_module.stock_buckets_collection.find(
+        {"product_id": "PROD_STRIPE_1"}
+    ).to_list(length=None)
+    assert sorted(b["available_stock"] for b in buckets) == [3, 3, 3, 3]
+
+    held = [
+        await rs.create_reservation(
+            ReservationCreate(product_id="PROD_STRIPE_1", quantity=2, ttl_minutes=5),
+            "user@test.com",
+        )
+        for _ in range(4)
+    ]
+    # 4 units left spread thinly: a 4-unit hold has to be taken piecewise
+    big = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_STRIPE_1", quantity=4, ttl_minutes=5),
+        "user@test.com",
+    )
+    assert await stock_service.available("PROD_STRIPE_1") == 0
+
+    await rs.cancel_reservation(big.reservation_id, CancelReservationRequest(reason="x"))
+    await rs.commit_reservation(
+        held[0].reservation_id,
+        ReservationCommitRequest(payment_id="PAY_S", shipping_address="Street S"),
+    )
+    await stock_service.rebalance("PROD_STRIPE_1")
+    buckets = await db_module.stock_buckets_collection.find(
+        {"product_id": "PROD_STRIPE_1"}
+    ).to_list(length=None)
+    assert sorted(b["available_stock"] for b in buckets) == [1, 1, 1, 1]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        product = (await client.get("/products/PROD_STRIPE_1")).json()
+    assert product["total_stock"] == 10
+    assert product["available_stock"] == 4
+    assert product["reserved_stock"] == 6
+
+    await stock_service.set_stripes("PROD_STRIPE_1", 1)
+    doc = await db_module.products_collection.find_one({"product_id": "PROD_STRIPE_1"})
+    assert (doc["available_stock"], doc["reserved_stock"]) == (4, 6)
+    assert "stock_stripes" not in doc
+
+
+@pytest.mark.asyncio
+async def test_rebalance_cut_short_loses_no_stock(monkeypatch, insert_product):
+    from app.services import stock_service
+
+    await insert_product("PROD_STRIPE_4", 8)
+    await stock_service.set_stripes("PROD_STRIPE_4", 2)
+    await db_module.stock_buckets_collection.update_one(
+        {"product_id": "PROD_STRIPE_4", "bucket": 0}, {"$inc": {"available_stock": -4}}
+    )
+    await db_module.stock_buckets_collection.update_one(
+        {"product_id": "PROD_STRIPE_4", "bucket": 1}, {"$inc": {"available_stock": 4}}
+    )
+
+    async def dying_bulk_write(requests, ordered=True):
+        raise RuntimeError("process died")
+
+    bulk_write = db_module.stock_buckets_collection.bulk_write
+    monkeypatch.setattr(db_module.stock_buckets_collection, "bulk_write", dying_bulk_write)
+    with pytest.raises(RuntimeError):
+        await stock_service.rebalance("PROD_STRIPE_4")
+    monkeypatch.setattr(db_module.stock_buckets_collection, "bulk_write", bulk_write)
+    buckets = await db_module.stock_buckets_collection.find(
+        {"product_id": "PROD_STRIPE_4"}
+    ).to_list(length=None)
+    assert sorted((b["available_stock"], b.get("in_transit", 0)) for b in buckets) == [(0, 0), (4, 4)]
+
+    # The next run puts the parked stock back and finishes the move
+    assert await stock_service.rebalance("PROD_STRIPE_4") == 4
+    buckets = await db_module.stock_buckets_collection.find(
+        {"product_id": "PROD_STRIPE_4"}
+    ).to_list(length=None)
+    assert sorted((b["available_stock"], b.get("in_transit", 0)) for b in buckets) == [(4, 0), (4, 0)]
+
+
+@pytest.mark.asyncio
+async def test_striped_stock_survives_stale_stripe_map(monkeypatch, insert_product):
+    from fastapi import HTTPException
+    from app.schemas.reservation_schema import CancelReservationRequest
+    from app.services import stock_service
+
+    await insert_product("PROD_STRIPE_2", 12)
+    await insert_product("PROD_STRIPE_3", 4)
+    await stock_service.set_stripes("PROD_STRIPE_2", 4)
+    await stock_service.set_stripes("PROD_STRIPE_3", 2)
+    held = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_STRIPE_2", quantity=3, ttl_minutes=5),
+        "user@test.com",
+    )
+
+    # Another process whose map has not caught up treats it as plain
+    stock_service.striped_products.clear()
+    await rs.cancel_reservation(held.reservation_id, CancelReservationRequest(reason="x"))
+    assert await stock_service.available("PROD_STRIPE_2") == 12
+    await rs.create_reservation(
+        ReservationCreate(product_id="PROD_STRIPE_2", quantity=5, ttl_minutes=5),
+        "user@test.com",
+    )
+    assert await stock_service.available("PROD_STRIPE_2") == 7
+
+    # Removing stock never overdraws a bucket
+    with pytest.raises(HTTPException) as exc:
+        await stock_service.adjust("PROD_STRIPE_2", -8)
+    assert exc.value.status_code == 400
+    updated = await stock_service.adjust("PROD_STRIPE_2", -4)
+    assert (updated["total_stock"], updated["available_stock"], updated["reserved_stock"]) == (8, 3, 5)
+    buckets = await db_module.stock_buckets_collection.find(
+        {"product_id": "PROD_STRIPE_2"}
+    ).to_list(length=None)
+    assert all(b["available_stock"] >= 0 for b in buckets)
+
+    # A listing page sums all its striped products with one query
+    calls = {"aggregate": 0}
+    aggregate = db_module.stock_buckets_collection.aggregate
+
+    def counting_aggregate(pipeline):
+        calls["aggregate"] += 1
+        return aggregate(pipeline)
+
+    monkeypatch.setattr(db_module.stock_buckets_collection, "aggregate", counting_aggregate)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        listing = (await client.get("/products/?limit=10")).json()
+    assert calls["aggregate"] == 1
+    assert {p["product_id"]: p["available_stock"] for p in listing} == {
+        "PROD_STRIPE_2": 3,
+        "PROD_STRIPE_3": 4,
+    }
+
+    await stock_service.set_stripes("PROD_STRIPE_2", 1)
+    doc = await db_module.products_collection.find_one({"product_id": "PROD_STRIPE_2"})
+    assert (doc["total_stock"], doc["available_stock"], doc["reserved_stock"]) == (8, 3, 5)
@@ -1,9 +1,19 @@
 # tests/test_reservations.py
 import pytest
 import asyncio
+from datetime import timedelta
 
-from app.schemas.reservation_schema import ReservationCreate
+from fastapi import HTTPException
+
+from app.schemas.reservation_schema import (
+    ReservationCreate,
+    ReservationCommitRequest,
+    CancelReservationRequest,
+    CartItem,
+    CartReservationCreate,
+)
 from app.services import reservation_service as rs
+from app.services.lock_manager import KeyedLockManager
 from app.db import database as db_module
 from pydantic import ValidationError
 
@@ -35,6 +45,8 @@ async def test_reservation_creation_success():
     assert res.product_id == product_id
     assert res.quantity == 2
     assert res.status == "active"
+    # Reported from the stock write itself, no second product read
+    assert res.available_stock == 8
 
     product = await db_module.products_collection.find_one({"product_id": product_id})
     assert product["available_stock"] == 8
@@ -130,5 +142,561 @@ async def test_reservation_invalid_quantity():
         )
 
 
+@pytest.mark.asyncio
+async def test_unrelated_products_do_not_share_a_lock(insert_product):
+    await insert_product("PROD_LOCK_A", 5)
+    await insert_product("PROD_LOCK_B", 5)
+
+    async with rs.product_locks.hold("PROD_LOCK_A"):
+        # Product A is busy, product B must still go through.
+        res = await asyncio.wait_for(
+            rs.create_reservation(
+                ReservationCreate(product_id="PROD_LOCK_B", quantity=1, ttl_minutes=5),
+                "user4@test.com",
+            ),
+            timeout=1,
+        )
+
+    assert res.product_id == "PROD_LOCK_B"
+    # Per-key stats outlive the idle locks
+    assert not rs.product_locks._locks
+    assert rs.product_locks.wait_stats("PROD_LOCK_B")["PROD_LOCK_B"]["acquisitions"] == 1
+    stats = rs.product_locks.total_stats()
+    assert stats["acquisitions"] == 2
+    assert stats["contended"] == 0
+
+
+@pytest.mark.asyncio
+async def test_lock_wait_stats_keep_the_most_recent_idle_keys():
+    locks = KeyedLockManager("test", max_recent=2)
+    for key in ("A", "B", "A", "C"):
+        async with locks.hold(key):
+            pass
+    # B was used least recently and is only counted in the totals now
+    assert sorted(locks.wait_stats()) == ["A", "C"]
+    assert locks.wait_stats("A")["A"]["acquisitions"] == 2
+    assert locks.total_stats()["acquisitions"] == 4
+
+    async def hold_c(seconds):
+        async with locks.hold("C"):
+            await asyncio.sleep(seconds)
+
+    await asyncio.gather(hold_c(0.01), hold_c(0))
+    assert [entry["key"] for entry in locks.top_stats(1)] == ["C"]
+    assert locks.top_stats(1)[0]["contended"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_commit_and_cancel_only_one_wins(insert_product):
+    await insert_product("PROD_LOCK_C", 3)
+    res = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_LOCK_C", quantity=2, ttl_minutes=5),
+        "user5@test.com",
+    )
+
+    async def attempt(coro):
+        try:
+            return await coro
+        except HTTPException:
+            return None
+
+    order, _ = await asyncio.gather(
+        attempt(rs.commit_reservation(
+            res.reservation_id,
+            ReservationCommitRequest(payment_id="PAY_1", shipping_address="Street 1"),
+        )),
+        attempt(rs.cancel_reservation(
+            res.reservation_id, CancelReservationRequest(reason="changed mind")
+        )),
+    )
+
+    assert order is not None
+    product = await db_module.products_collection.find_one({"product_id": "PROD_LOCK_C"})
+    assert product["available_stock"] == 1
+    assert product["reserved_stock"] == 0
+    assert product["total_stock"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cleanup_expires_only_due_reservations(insert_product):
+    await insert_product("PROD_EXP_1", 10)
+    due = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_EXP_1", quantity=3, ttl_minutes=5),
+        "user6@test.com",
+    )
+    fresh = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_EXP_1", quantity=2, ttl_minutes=5),
+        "user6@test.com",
+    )
+    cancelled = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_EXP_1", quantity=1, ttl_minutes=5),
+        "user6@test.com",
+    )
+    await rs.cancel_reservation(
+        cancelled.reservation_id, CancelReservationRequest(reason="test")
+    )
+
+    # Move the first hold into the past and re-index it.
+    due.expires_ms = rs.now_ms() - 1000
+    rs.expiry_index.push(due.reservation_id, due.expires_ms)
+
+    await rs.cleanup_expired_reservations()
+
+    assert due.reservation_id not in rs.reservation_store
+    assert fresh.reservation_id in rs.reservation_store
+    assert len(rs.expiry_index) == 1
+
+    product = await db_module.products_collection.find_one({"product_id": "PROD_EXP_1"})
+    assert product["available_stock"] == 8
+    assert product["reserved_stock"] == 2
+    doc = await db_module.reservations_collection.find_one(
+        {"reservation_id": due.reservation_id}
+    )
+    assert doc["status"] == "expired"
+
+
+@pytest.mark.asyncio
+async def test_expiration_worker_wakes_for_sooner_deadline(insert_product):
+    await insert_product("PROD_EXP_2", 5)
+    worker = asyncio.create_task(rs.expiration_worker())
+    try:
+        await asyncio.sleep(0)
+        res = await rs.create_reservation(
+            ReservationCreate(product_id="PROD_EXP_2", quantity=2, ttl_minutes=5),
+            "user7@test.com",
+        )
+        # Re-track with a deadline just ahead; the worker must wake for it
+        # rather than sleeping out its 30 second upper bound.
+        res.expires_ms = rs.now_ms() + 50
+        rs._track(res)
+
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if res.reservation_id not in rs.reservation_store:
+                break
+    finally:
+        worker.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+
+    assert res.reservation_id not in rs.reservation_store
+    product = await db_module.products_collection.find_one({"product_id": "PROD_EXP_2"})
+    assert product["available_stock"] == 5
+    assert product["reserved_stock"] == 0
+
+
+@pytest.mark.asyncio
+async def test_mass_expiry_is_batched_per_product(insert_product):
+    await insert_product("PROD_EXP_3", 10)
+    await insert_product("PROD_EXP_4", 10)
+    held = []
+    for product_id in ("PROD_EXP_3", "PROD_EXP_4"):
+        for _ in range(3):
+            held.append(await rs.create_reservation(
+                ReservationCreate(product_id=product_id, quantity=2, ttl_minutes=5),
+                "user8@test.com",
+            ))
+
+    calls = {"bulk_write": 0, "update_many": 0}
+    products = db_module.products_collection
+    reservations = db_module.reservations_collection
+    bulk_write, update_many = products.bulk_write, reservations.update_many
+
+    async def counting_bulk_write(requests, ordered=True):
+        calls["bulk_write"] += 1
+        assert len(requests) == 2
+        return await bulk_write(requests, ordered=ordered)
+
+    async def counting_update_many(filter, update):
+        calls["update_many"] += 1
+        return await update_many(filter, update)
+
+    products.bulk_write = counting_bulk_write
+    reservations.update_many = counting_update_many
+
+    for res in held:
+        res.expires_ms = rs.now_ms() - 1000
+        rs.expiry_index.push(res.reservation_id, res.expires_ms)
+    await rs.cleanup_expired_reservations()
+
+    assert calls == {"bulk_write": 1, "update_many": 1}
+    assert not rs.reservation_store
+    for product_id in ("PROD_EXP_3", "PROD_EXP_4"):
+        product = await products.find_one({"product_id": product_id})
+        assert product["available_stock"] == 10
+        assert product["reserved_stock"] == 0
+    expired = await db_module.audit_collection.count_documents(
+        {"event_type": "reservation_expired"}
+    )
+    assert expired == 6
+
+
+@pytest.mark.asyncio
+async def test_cart_reservation_is_all_or_nothing(insert_product):
+    await insert_product("PROD_CART_1", 5)
+    await insert_product("PROD_CART_2", 1)
+
+    with pytest.raises(HTTPException) as exc:
+        await rs.create_cart_reservation(
+            CartReservationCreate(
+                items=[
+                    CartItem(product_id="PROD_CART_1", quantity=2),
+                    CartItem(product_id="PROD_CART_2", quantity=3),
+                ],
+                ttl_minutes=5,
+            ),
+            "user9@test.com",
+        )
+
+    assert "PROD_CART_2" in exc.value.detail
+    assert not rs.reservation_store
+    product = await db_module.products_collection.find_one({"product_id": "PROD_CART_1"})
+    assert product["available_stock"] == 5
+    assert product["reserved_stock"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cart_commit_turns_every_line_into_an_order(insert_product):
+    await insert_product("PROD_CART_3", 5, price=2.0)
+    await insert_product("PROD_CART_4", 5, price=3.0)
+
+    items = await rs.create_cart_reservation(
+        CartReservationCreate(
+            items=[
+                CartItem(product_id="PROD_CART_3", quantity=1),
+                CartItem(product_id="PROD_CART_4", quantity=2),
+                CartItem(product_id="PROD_CART_3", quantity=1),
+            ],
+            ttl_minutes=5,
+        ),
+        "user10@test.com",
+    )
+    assert [(r.product_id, r.quantity) for r in items] == [
+        ("PROD_CART_3", 2),
+        ("PROD_CART_4", 2),
+    ]
+    cart_id = items[0].cart_id
+
+    with pytest.raises(HTTPException) as exc:
+        await rs.commit_cart(
+            cart_id,
+            ReservationCommitRequest(payment_id="PAY_2", shipping_address="Street 2"),
+            "someone-else@test.com",
+        )
+    assert exc.value.status_code == 403
+
+    orders = await rs.commit_cart(
+        cart_id,
+        ReservationCommitRequest(payment_id="PAY_2", shipping_address="Street 2"),
+        "user10@test.com",
+    )
+
+    assert sorted(o["total_amount"] for o in orders) == [4.0, 6.0]
+    assert not rs.reservation_store
+    assert cart_id not in rs.cart_store
+    for product_id in ("PROD_CART_3", "PROD_CART_4"):
+        product = await db_module.products_collection.find_one({"product_id": product_id})
+        assert product["available_stock"] == 3
+        assert product["reserved_stock"] == 0
+        assert product["total_stock"] == 3
+
+
+@pytest.mark.asyncio
+async def test_rebuild_restores_active_holds_and_expires_stale_ones(insert_product):
+    await insert_product("PROD_WARM_1", 10)
+    live = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_WARM_1", quantity=2, ttl_minutes=5),
+        "user11@test.com",
+    )
+    stale = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_WARM_1", quantity=3, ttl_minutes=5),
+        "user11@test.com",
+    )
+    # Simulate a restart: memory is gone and one hold ran out meanwhile.
+    # MongoDB returns naive UTC datetimes.
+    await db_module.reservations_collection.update_one(
+        {"reservation_id": stale.reservation_id},
+        {"$set": {"expires_at": (rs.now_utc() - timedelta(minutes=1)).replace(tzinfo=None)}},
+    )
+    rs.reservation_store.clear()
+    rs.expiry_index.clear()
+
+    stats = await rs.rebuild_reservation_store()
+
+    assert stats["loaded"] == 1
+    assert stats["expired"] == 1
+    assert list(rs.reservation_store) == [live.reservation_id]
+    assert rs.reservation_store[live.reservation_id].expires_at.tzinfo is not None
+    product = await db_module.products_collection.find_one({"product_id": "PROD_WARM_1"})
+    assert product["available_stock"] == 8
+    assert product["reserved_stock"] == 2
+
+    await rs.commit_reservation(
+        live.reservation_id,
+        ReservationCommitRequest(payment_id="PAY_3", shipping_address="Street 3"),
+    )
+
+
+@pytest.mark.asyncio
+async def test_restore_replays_journal_and_reconciles_interrupted_writes(
+    tmp_path, monkeypatch, insert_product
+):
+    from app.services.reservation_journal import ReservationJournal
+
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+    stats = await rs.restore_reservation_store()
+    assert stats["source"] == "mongo"
+
+    await insert_product("PROD_WAL_1", 10)
+    kept, pending, committed, cancelled = [
+        await rs.create_reservation(
+            ReservationCreate(product_id="PROD_WAL_1", quantity=1, ttl_minutes=5),
+            "user12@test.com",
+        )
+        for _ in range(4)
+    ]
+    await rs.cancel_reservation(cancelled.reservation_id, CancelReservationRequest(reason="x"))
+    # Snapshot mid-way so recovery has to combine a snapshot with a journal
+    await rs.reservation_journal.snapshot(
+        rs.record_from_reservation(r) for r in rs.reservation_store.values()
+    )
+
+    # Crash while two writes are in flight: one never reached MongoDB, the
+    # other did but its "remove" record was lost.
+    await rs.reservation_journal.append(
+        {"op": "pending", "ids": [pending.reservation_id, committed.reservation_id]}
+    )
+    await db_module.reservations_collection.update_one(
+        {"reservation_id": committed.reservation_id},
+        {"$set": {"status": "committed"}},
+    )
+    journal = rs.reservation_journal
+    journal._task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await journal._task
+    journal._file.write(b'{"op":"remo')
+    journal._file.close()
+
+    rs.reservation_store.clear()
+    rs.expiry_index.clear()
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+
+    stats = await rs.restore_reservation_store()
+
+    assert stats["source"] == "journal"
+    assert sorted(rs.reservation_store) == sorted([kept.reservation_id, pending.reservation_id])
+    restored = rs.reservation_store[kept.reservation_id]
+    assert restored.user_id == "user12@test.com"
+    assert restored.expires_at.tzinfo is not None
+    await rs.close_reservation_journal()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "journal-00000004.log",
+        "snapshot-00000004.bin",
+    ]
+
+
+async def _crash_journal(journal):
+    journal._task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await journal._task
+    journal._file.close()
+
+
+@pytest.mark.asyncio
+async def test_restore_after_corrupt_snapshot_never_replays_stale_journals(
+    tmp_path, monkeypatch, insert_product
+):
+    from app.services.reservation_journal import ReservationJournal
+
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+    await rs.restore_reservation_store()
+    await insert_product("PROD_WAL_2", 10)
+    await rs.reservation_journal.snapshot([])
+    hold = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_WAL_2", quantity=2, ttl_minutes=5),
+        "user13@test.com",
+    )
+    # Crash with the hold journaled in generation 2, whose snapshot is corrupt
+    await _crash_journal(rs.reservation_journal)
+    (tmp_path / "snapshot-00000002.bin").write_bytes(b"garbage")
+
+    # First restart: nothing usable on disk, MongoDB has the hold
+    rs.reservation_store.clear()
+    rs.expiry_index.clear()
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+    stats = await rs.restore_reservation_store()
+    assert stats["source"] == "mongo"
+    assert rs.reservation_journal.generation == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "journal-00000003.log",
+        "snapshot-00000003.bin",
+    ]
+    await rs.cancel_reservation(hold.reservation_id, CancelReservationRequest(reason="x"))
+    await _crash_journal(rs.reservation_journal)
+
+    # Second restart: the cancelled hold must not come back from generation 2
+    rs.reservation_store.clear()
+    rs.expiry_index.clear()
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+    stats = await rs.restore_reservation_store()
+    assert stats["source"] == "journal"
+    assert hold.reservation_id not in rs.reservation_store
+    await rs.close_reservation_journal()
+    product = await db_module.products_collection.find_one({"product_id": "PROD_WAL_2"})
+    assert (product["available_stock"], product["reserved_stock"]) == (10, 0)
+
+
+@pytest.mark.asyncio
+async def test_user_and_product_indexes_follow_lifecycle_and_enforce_cap(monkeypatch, insert_product):
+    await insert_product("PROD_IDX_1", 10)
+    await insert_product("PROD_IDX_2", 10)
+    monkeypatch.setattr(rs, "RESERVATION_MAX_ACTIVE_PER_USER", 3)
+
+    first = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_IDX_1", quantity=1, ttl_minutes=5),
+        "user13@test.com",
+    )
+    cart = await rs.create_cart_reservation(
+        CartReservationCreate(items=[
+            CartItem(product_id="PROD_IDX_1", quantity=1),
+            CartItem(product_id="PROD_IDX_2", quantity=1),
+        ], ttl_minutes=5),
+        "user13@test.com",
+    )
+    assert rs.user_index["user13@test.com"] == {
+        first.reservation_id, *(r.reservation_id for r in cart)
+    }
+    assert len(rs.product_index["PROD_IDX_1"]) == 2
+
+    with pytest.raises(HTTPException) as exc:
+        await rs.create_reservation(
+            ReservationCreate(product_id="PROD_IDX_2", quantity=1, ttl_minutes=5),
+            "user13@test.com",
+        )
+    assert exc.value.status_code == 429
+    product = await db_module.products_collection.find_one({"product_id": "PROD_IDX_2"})
+    assert product["available_stock"] == 9
+
+    await rs.cancel_reservation(first.reservation_id, CancelReservationRequest(reason="x"))
+    await rs.commit_cart(
+        cart[0].cart_id,
+        ReservationCommitRequest(payment_id="PAY_4", shipping_address="Street 4"),
+        "user13@test.com",
+    )
+    assert rs.user_index == {}
+    assert rs.product_index == {}
+    assert await rs.get_user_active_reservations("user13@test.com") == []
+
+
+@pytest.mark.asyncio
+async def test_batched_creates_share_one_write_and_grant_in_fifo_order(monkeypatch, insert_product):
+    from app.services.batcher import KeyedBatcher
+
+    await insert_product("PROD_HOT_1", 7)
+    batcher = KeyedBatcher(rs._create_batch, window_ms=5, max_batch=100)
+    monkeypatch.setattr(rs, "reservation_batcher", batcher)
+    calls = {"insert_many": 0}
+    insert_many = db_module.reservations_collection.insert_many
+
+    async def counting_insert_many(docs, ordered=True):
+        calls["insert_many"] += 1
+        return await insert_many(docs, ordered=ordered)
+
+    db_module.reservations_collection.insert_many = counting_insert_many
+
+    results = await asyncio.gather(*(
+        rs.create_reservation(
+            ReservationCreate(product_id="PROD_HOT_1", quantity=quantity, ttl_minutes=5),
+            f"hot{i}@test.com",
+        )
+        for i, quantity in enumerate([2, 2, 2, 2, 1])
+    ), return_exceptions=True)
+
+    # 2+2+2 fit, the fourth 2 does not, the trailing 1 still does
+    assert [isinstance(r, HTTPException) for r in results] == [False, False, False, True, False]
+    assert results[3].status_code == 400
+    assert [r.user_id for r in results if not isinstance(r, HTTPException)] == [
+        "hot0@test.com", "hot1@test.com", "hot2@test.com", "hot4@test.com"
+    ]
+    assert batcher.stats()["batches"] == 1
+    assert calls["insert_many"] == 1
+    assert len(rs.product_index["PROD_HOT_1"]) == 4
+    product = await db_module.products_collection.find_one({"product_id": "PROD_HOT_1"})
+    assert product["available_stock"] == 0
+    assert product["reserved_stock"] == 7
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_insert_leaves_no_hold_behind(monkeypatch, insert_product):
+    from app.services.batcher import KeyedBatcher
+
+    await insert_product("PROD_HOT_2", 5)
+    monkeypatch.setattr(
+        rs, "reservation_batcher", KeyedBatcher(rs._create_batch, window_ms=5, max_batch=100)
+    )
+
+    async def failing_insert_many(docs, ordered=True):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(db_module.reservations_collection, "insert_many", failing_insert_many)
+    results = await asyncio.gather(*(
+        rs.create_reservation(
+            ReservationCreate(product_id="PROD_HOT_2", quantity=2, ttl_minutes=5),
+            f"hot{i}@test.com",
+        )
+        for i in range(2)
+    ), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert rs.reservation_store == {} and rs.product_index == {}
+    product = await db_module.products_collection.find_one({"product_id": "PROD_HOT_2"})
+    assert (product["available_stock"], product["reserved_stock"]) == (5, 0)
+
+
+@pytest.mark.asyncio
+async def test_failed_commit_is_not_retried_into_a_second_order(
+    tmp_path, monkeypatch, insert_product
+):
+    from app.services.reservation_journal import ReservationJournal
+
+    monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+    await rs.restore_reservation_store()
+    await insert_product("PROD_COMMIT_1", 5)
+    res = await rs.create_reservation(
+        ReservationCreate(product_id="PROD_COMMIT_1", quantity=2, ttl_minutes=5),
+        "user14@test.com",
+    )
+    commit = ReservationCommitRequest(payment_id="PAY_F", shipping_address="Street F")
+
+    write_orders = db_module.orders_collection.bulk_write
+
+    async def failing_bulk_write(requests, ordered=True):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(db_module.orders_collection, "bulk_write", failing_bulk_write)
+    with pytest.raises(RuntimeError):
+        await rs.commit_reservation(res.reservation_id, commit)
+    monkeypatch.setattr(db_module.orders_collection, "bulk_write", write_orders)
 
+    # The claim went through first: a retry is refused instead of committing twice
+    assert res.reservation_id not in rs.reservation_store
+    with pytest.raises(HTTPException) as exc:
+        await rs.commit_reservation(res.reservation_id, commit)
+    assert exc.value.status_code == 404
+    doc = await db_module.reservations_collection.find_one({"reservation_id": res.reservation_id})
+    assert doc["status"] == "committed" and doc["order_id"].startswith("ORD_")
+    product = await db_module.products_collection.find_one({"product_id": "PROD_COMMIT_1"})
+    assert (product["total_stock"], product["reserved_stock"]) == (3, 0)
+    assert await db_module.orders_collection.count_documents({}) == 0
 
+    # The journaled order survives a snapshot and is written on restart, once
+    await rs.reservation_journal.snapshot([])
+    for _ in range(2):
+        await _crash_journal(rs.reservation_journal)
+        monkeypatch.setattr(rs, "reservation_journal", ReservationJournal(str(tmp_path), 0))
+        await rs.restore_reservation_store()
+        orders = await db_module.orders_collection.find({}).to_list(None)
+        assert [(o["order_id"], o["reservation_id"]) for o in orders] == [
+            (doc["order_id"], res.reservation_id)
+        ]
+    await _crash_journal(rs.reservation_journal)